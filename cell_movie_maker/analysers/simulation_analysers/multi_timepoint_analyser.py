@@ -20,8 +20,8 @@ class MultiTimepointAnalyser(SimulationAnalyser):
         
     def analyse(self, simulation:Simulation)->pd.DataFrame|pd.Series|float|int:
         df = []
-        for timestep in simulation.results_timesteps[self.timepoint_slice]:
-            tp = simulation.read_timepoint(timestep)
+        timesteps = simulation.results_timesteps[self.timepoint_slice]
+        for timestep, tp in zip(timesteps, simulation.prefetch_timepoints(timesteps)):
             df.append(dict(timestep=timestep, **self.timepoint_analyser.analyse(tp, simulation)))
         return pd.DataFrame(df).set_index('timestep')
 
@@ -36,8 +36,7 @@ class SpecifiedTimepointsAnalyser(SimulationAnalyser):
         
     def analyse(self, simulation:Simulation)->pd.DataFrame|pd.Series|float|int:
         df = []
-        for timestep in self.timepoints:
-            tp = simulation.read_timepoint(timestep)
+        for timestep, tp in zip(self.timepoints, simulation.prefetch_timepoints(self.timepoints)):
             df.append(dict(timestep=timestep, **self.timepoint_analyser.analyse(tp, simulation)))
         return pd.DataFrame(df).set_index('timestep')
 
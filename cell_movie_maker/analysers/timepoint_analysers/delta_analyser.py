@@ -15,7 +15,14 @@ class DeltaAnalyser(TimepointAnalyser):
         self.forward=forward # Whether to calculate delta looking forward or backward from given timepoint
         
     def analyse(self, timepoint:SimulationTimepoint, simulation:Simulation)->pd.DataFrame|pd.Series|float|int:
-        tp2 = simulation.read_timepoint((timepoint.timestep + self.delta) if self.forward else (max(0, timepoint.timestep - self.delta))).data.set_index('cell_id')[['x','y','damage']]
+        other = simulation.read_timepoint((timepoint.timestep + self.delta) if self.forward else (max(0, timepoint.timestep - self.delta)))
+        return self.analyse_pair(timepoint, other)
+
+    def analyse_pair(self, timepoint:SimulationTimepoint, other:SimulationTimepoint)->pd.DataFrame:
+        """
+        Analyse against an already read timepoint delta after (or before) timepoint, e.g. from `Simulation.iter_timepoint_pairs`
+        """
+        tp2 = other.data.set_index('cell_id')[['x','y','damage']]
         tp1 = timepoint.data.set_index('cell_id')[['x', 'y', 'damage']]
 
         return (tp2-tp1 if self.forward else tp1-tp2).loc[tp1.index].rename(dict(x='delta_x', y='delta_y', damage='delta_damage'), axis=1).reset_index()
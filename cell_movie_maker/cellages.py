@@ -0,0 +1,117 @@
+import os
+import pathlib
+import threading
+import collections.abc
+import numpy as np
+
+
+sidecar_version = 1
+
+
+def sidecar_file(results_folder:str|pathlib.Path)->pathlib.Path:
+    """
+    Parsed cell ids for a simulation, written next to `results_from_time_0`
+    """
+    return pathlib.Path(results_folder).parent.joinpath('cmm_cache', 'cellages.npz')
+
+def _signature(file:pathlib.Path)->np.ndarray:
+    stat = os.stat(file)
+    return np.array([sidecar_version, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def parse_cellages(file:str|pathlib.Path)->tuple[np.ndarray,np.ndarray,np.ndarray]:
+    """
+    Parse the cell ids from a `cellages.dat` file.
+    Each line is `<time>\\t<id> <x> <y> <age> <id> ...`, the times are converted to timesteps at 120 timesteps per hour.
+
+    Parameters
+    ----------
+    file : str, pathlib.Path
+        Path to cellages.dat
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray]
+        timesteps (T,), offsets (T+1,) and ids, where the ids at timesteps[i] are ids[offsets[i]:offsets[i+1]]
+    """
+    times, id_tokens, n_ids = [], [], []
+    for line in pathlib.Path(file).read_bytes().splitlines():
+        line = line.strip().split(b'\t')
+        if not len(line) == 2: continue
+        # Every fourth token, starting at the first, is an id. Only the ids are converted to numbers
+        tokens = line[1].split()[::4]
+        times.append(line[0])
+        id_tokens.extend(tokens)
+        n_ids.append(len(tokens))
+    if len(times) == 0: return np.empty(0, dtype=np.int64), np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    ids = np.fromiter(map(int, id_tokens), dtype=np.int64, count=len(id_tokens))
+    offsets = np.concatenate([[0], np.cumsum(n_ids, dtype=np.int64)])
+    timesteps = (np.array(times, dtype=np.float64)*120).astype(np.int64)
+    if len(ids) == 0 or ids.max() < np.iinfo(np.int32).max: ids = ids.astype(np.int32)
+    return timesteps, offsets, ids
+
+def load_cellages(results_folder:str|pathlib.Path)->tuple[np.ndarray,np.ndarray,np.ndarray]|None:
+    """
+    Cell ids of a simulation, from the sidecar file if it is up to date, otherwise parsed and written to the sidecar
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray]|None
+        See `parse_cellages`, None if the simulation has no cellages.dat
+    """
+    file = pathlib.Path(results_folder).joinpath('cellages.dat')
+    if not file.exists(): return None
+    signature = _signature(file)
+    p = sidecar_file(results_folder)
+    try:
+        with np.load(p) as f:
+            if np.array_equal(f['signature'], signature): return f['timesteps'], f['offsets'], f['ids']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    timesteps, offsets, ids = parse_cellages(file)
+    try:
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_name(f'.{p.stem}.{os.getpid()}.{threading.get_ident()}.tmp.npz')
+        np.savez(tmp, signature=signature, timesteps=timesteps, offsets=offsets, ids=ids)
+        os.replace(tmp, p)
+    except OSError:
+        pass # Read only simulation folders are parsed every time
+    return timesteps, offsets, ids
+
+
+class CellIds(collections.abc.Mapping):
+    """
+    Cell ids at each timestep, `cellages.dat` is only read the first time ids are looked up.
+    Values are int arrays in the order of the points in the results file.
+    """
+    def __init__(self, results_folder:str|pathlib.Path):
+        self.results_folder = pathlib.Path(results_folder)
+        self._loaded = None
+
+    def __getstate__(self):
+        # Workers load the ids from the sidecar file rather than receiving them
+        return dict(results_folder=self.results_folder, _loaded=None)
+
+    def _load(self):
+        if self._loaded is None:
+            r = load_cellages(self.results_folder)
+            if r is None: r = np.empty(0, dtype=np.int64), np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64)
+            timesteps, offsets, ids = r
+            self._loaded = ({int(t):i for i,t in enumerate(timesteps)}, offsets, ids)
+        return self._loaded
+
+    def __getitem__(self, timestep:int)->np.ndarray:
+        index, offsets, ids = self._load()
+        i = index[timestep]
+        return ids[offsets[i]:offsets[i+1]]
+
+    def __contains__(self, timestep)->bool:
+        return timestep in self._load()[0]
+
+    def __iter__(self):
+        return iter(self._load()[0])
+
+    def __len__(self)->int:
+        return len(self._load()[0])
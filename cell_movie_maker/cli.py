@@ -0,0 +1,170 @@
+"""
+Command line entry point, `python -m cell_movie_maker`.
+
+Jobs run either as one shard of a static split (`--shard i/n`, or the task of a SLURM array job), see `sharding`,
+or as elastic workers of a queue on the shared filesystem (`--queue`), see `task_queue`. `merge` finalises a job
+once all of its shards or queued tasks are done.
+"""
+from __future__ import annotations
+import argparse
+import importlib
+import logging
+import pathlib
+from .config import Config
+from . import sharding
+from . import task_queue
+
+
+def _import(name:str):
+    module, _, attr = name.rpartition('.')
+    return getattr(importlib.import_module(module), attr)
+
+def _load_experiment(name:str):
+    from .experiment import Experiment, load_experiment
+    return Experiment(name) if pathlib.Path(name).is_dir() else load_experiment(name)
+
+def _add_mode(p:argparse.ArgumentParser):
+    mode = p.add_mutually_exclusive_group()
+    mode.add_argument('--shard', help='index/count, defaults to the SLURM array task')
+    mode.add_argument('--queue', action='store_true', help='Work on the job\'s queue until every task is done, instead of a shard')
+    p.add_argument('--lease', type=float, default=600, help='Seconds after which tasks of a worker which stopped renewing them are requeued')
+    p.add_argument('--force', action='store_true', help='Run even if the shard is complete')
+
+def _parser()->argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m cell_movie_maker', description='Run, check or merge sharded and queued jobs')
+    parser.add_argument('--simulation-class', help='Simulation class to use, e.g. cell_movie_maker.MacrophageSimulation')
+    parser.add_argument('--no-manifest', action='store_true', help='Estimate costs from file sizes instead of the manifest')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_job(p, job_help):
+        p.add_argument('experiment', help='Experiment folder or name')
+        p.add_argument('--job', help=job_help)
+
+    p = commands.add_parser('plan', help='Print the simulations of each shard')
+    p.add_argument('experiment', help='Experiment folder or name')
+    p.add_argument('--count', type=int, required=True)
+
+    p = commands.add_parser('visualise', help='Render frames')
+    add_job(p, 'Job name, defaults to visualise-<visualisation names>')
+    p.add_argument('visualisers', nargs='+', help='Visualiser classes, e.g. cell_movie_maker.SimulationVisualiser')
+    _add_mode(p)
+    p.add_argument('--output', help='Output folder, defaults to CMM_OUTPUT_DIR')
+    p.add_argument('--start', type=int, default=0)
+    p.add_argument('--stop', type=int, default=None)
+    p.add_argument('--step', type=int, default=1)
+    p.add_argument('--maxproc', type=int, default=64, help='Processes on this node')
+    p.add_argument('--incremental', action='store_true', help='Only render frames whose results file or visualiser changed, see Config.incremental_frames')
+
+    p = commands.add_parser('preprocess', help='Run a preprocessor on each simulation')
+    add_job(p, 'Job name, defaults to preprocess-<preprocessor name>')
+    p.add_argument('preprocessor', help='Preprocessor class, e.g. cell_movie_maker.Preprocessor')
+    _add_mode(p)
+    p.add_argument('--output', help='Output folder, defaults to CMM_OUTPUT_DIR')
+    p.add_argument('--start', type=int, default=0)
+    p.add_argument('--stop', type=int, default=None)
+    p.add_argument('--step', type=int, default=1)
+    p.add_argument('--maxproc', type=int, default=8, help='Processes on this node, when working on a queue')
+
+    p = commands.add_parser('ingest', help='Ingest analysis into a database')
+    add_job(p, 'Job name, defaults to ingest-<analysers>')
+    p.add_argument('ingest', help='AnalysisIngest class, e.g. cell_movie_maker.csdc.TimepointAnalysisIngest')
+    p.add_argument('analysers', nargs='+', help='Analyser classes, each timepoint is read once for all of them')
+    p.add_argument('--db', required=True, help='Database file')
+    p.add_argument('--incremental', action='store_true', help='Recompute analysis whose results file or analyser changed, see AnalysisIngest.incremental')
+    p.add_argument('--dry-run', action='store_true', help='Print the work the ingest would do (of the shard, if --shard is given) and exit')
+    _add_mode(p)
+
+    p = commands.add_parser('status', help='Report the shards or queued tasks of a job which are not done')
+    add_job(p, 'Job name')
+    p.add_argument('--count', type=int, help='Number of shards, omit for a queued job')
+
+    p = commands.add_parser('merge', help='Make videos or finalise the ingest once every shard or queued task is done')
+    add_job(p, 'Job name, defaults to the name used by visualise or ingest')
+    p.add_argument('--count', type=int, help='Number of shards, omit for a queued job')
+    p.add_argument('--visualiser', dest='visualisers', action='append', default=[], help='Visualiser class to make videos for, may be repeated')
+    p.add_argument('--output', help='Output folder, defaults to CMM_OUTPUT_DIR')
+    p.add_argument('--framerate', type=int, default=30)
+    p.add_argument('--ingest', help='AnalysisIngest class to finalise')
+    p.add_argument('--analyser', dest='analysers', action='append', default=[], help='Analyser class of the ingest, may be repeated')
+    p.add_argument('--db', help='Database file of the ingest')
+    return parser
+
+
+def main(argv:list[str]|None=None)->int:
+    parser = _parser()
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    if args.simulation_class: Config.simulation_class = _import(args.simulation_class)
+    Config.use_manifest = not args.no_manifest
+    if getattr(args, 'output', None): Config.output_folder = pathlib.Path(args.output)
+    experiment = _load_experiment(args.experiment)
+
+    visualisers = [_import(v)() for v in getattr(args, 'visualisers', [])]
+    preprocessor = _import(args.preprocessor)() if getattr(args, 'preprocessor', None) else None
+    ingest = analyser = None
+    if getattr(args, 'ingest', None):
+        if not args.db or not args.analysers: parser.error('--ingest needs --analyser and --db')
+        Config.set_simulation_database(pathlib.Path(args.db))
+        ingest, analyser = _import(args.ingest)(Config.simulation_database), [_import(a)() for a in args.analysers]
+        ingest.incremental = getattr(args, 'incremental', False)
+    job = getattr(args, 'job', None)
+    if job is None and visualisers: job = 'visualise-' + '-'.join(v.visualisation_name for v in visualisers)
+    if job is None and preprocessor is not None: job = f'preprocess-{preprocessor.name}'
+    if job is None and analyser is not None: job = 'ingest-' + '-'.join(type(a).__name__ for a in analyser)
+    queue_kwargs = dict(lease_seconds=args.lease) if hasattr(args, 'lease') else dict()
+
+    match args.command:
+        case 'plan':
+            assignment = sharding.balance(sharding.simulation_costs(experiment.sim_folders), args.count)
+            for i in range(args.count):
+                print(f'{i}/{args.count}:', ' '.join(str(s) for s, a in zip(experiment.sim_ids, assignment) if a == i))
+        case 'visualise' if args.queue:
+            n = task_queue.visualise(experiment, visualisers, start=args.start, stop=args.stop, step=args.step, workers=args.maxproc, job=job,
+                                    incremental=args.incremental or None, **queue_kwargs)
+            logging.info(f'Rendered {n} timepoints')
+        case 'visualise':
+            shard = sharding.parse_shard(args.shard)
+            def render():
+                experiment.visualise(visualisers, start=args.start, stop=args.stop, step=args.step, clean_dir=False,
+                                     maxproc=args.maxproc, shard=shard, incremental=args.incremental or None)
+            sharding.run_shard(experiment.experiment_folder, job, shard, render, force=args.force)
+        case 'preprocess' if args.queue:
+            n = task_queue.preprocess(experiment, preprocessor, start=args.start, stop=args.stop, step=args.step, workers=args.maxproc, job=job, **queue_kwargs)
+            logging.info(f'Preprocessed {n} simulations')
+        case 'preprocess':
+            shard = sharding.parse_shard(args.shard)
+            def process():
+                part = experiment.shard(shard)
+                for i in range(len(part.simulations)):
+                    preprocessor.process(part.simulations[i], start=args.start, stop=args.stop, step=args.step)
+            sharding.run_shard(experiment.experiment_folder, job, shard, process, force=args.force)
+        case 'ingest' if args.dry_run:
+            plan = ingest.plan_experiment(experiment.shard(args.shard) if args.shard else experiment, analyser)
+            print(plan.groupby(['analysis_name', 'action']).size().to_string())
+            print(f'{int(plan.compute.sum())} of {len(plan)} timepoint analyses would be computed')
+        case 'ingest' if args.queue:
+            n = task_queue.ingest(experiment, ingest, analyser, job=job, **queue_kwargs)
+            logging.info(f'Ingested {n} simulations')
+        case 'ingest':
+            shard = sharding.parse_shard(args.shard)
+            sharding.run_shard(experiment.experiment_folder, job, shard, lambda: ingest.ingest_shard(experiment, shard, analyser), force=args.force)
+        case 'status':
+            if job is None: parser.error('status needs --job')
+            if args.count is None:
+                counts = task_queue.experiment_queue(experiment, job).counts()
+                print(f'{job}: ' + ', '.join(f'{n} {state}' for state, n in counts.items()))
+                return 0 if counts['pending'] == counts['leased'] == counts['failed'] == 0 else 1
+            missing = sharding.missing_shards(experiment.experiment_folder, job, args.count)
+            print(f'{args.count-len(missing)}/{args.count} shards of {job} complete' + (f', missing: {" ".join(map(str, missing))}' if missing else ''))
+            return 1 if missing else 0
+        case 'merge':
+            if job is None: parser.error('merge needs --job, --visualiser or --ingest')
+            kwargs = dict(visualisers=visualisers, ingest=ingest, analyser=analyser, framerate=args.framerate)
+            if args.count is not None:
+                sharding.merge(experiment, job, args.count, **kwargs)
+            else:
+                queue = task_queue.experiment_queue(experiment, job)
+                if not queue.finished(): raise RuntimeError(f'Tasks of {job} are still queued: {queue.counts()}')
+                sharding.finalise(experiment, **kwargs)
+    return 0
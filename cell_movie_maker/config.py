@@ -16,5 +16,20 @@ class Config:
         Config.simulation_database = csdc.Connection(db_file)
     # experiment_class:cls=None
     simulation_class=None
+    use_timepoint_cache:bool=False
+    vtu_reader:str='vtk'
+    use_manifest:bool=False
+    timepoint_lru_bytes:int=0
+    use_pde_store:bool=False
+    prefetch_depth:int=2
+    prefetch_max_bytes:int|None=1<<30
+    dtype_policy:str='default'
+    incremental_frames:bool=False
+    # Defaults for the options a parallel loop does not choose itself, None for the built in default. See parallel.Executor
+    executor_backend:str|None=None # 'serial', 'thread', 'process' or 'loky'
+    executor_start_method:str|None=None # 'fork', 'spawn' or 'forkserver'
+    executor_max_workers:int|None=None
+    executor_chunksize:int|None=None
+    executor_maxtasksperchild:int|None=None
 
     
@@ -1,6 +1,7 @@
 from .parameters_ingest import ParametersIngest
 
 from .analysis_ingest import AnalysisIngest
+from .analysis_spool import AnalysisSpool, SpoolLoader
 
 from .analysis_ingesters.info_ingester import InfoIngester
 from .analysis_ingesters.simulation_analysis_ingest import SimulationAnalysisIngest
@@ -0,0 +1,91 @@
+"""
+Fingerprints of the sources of analysis rows, for incremental ingests.
+
+The fingerprint of a row hashes the size and mtime of the timepoint's results file with the analyser's parameters.
+Fingerprints are kept in an `analysis_fingerprints` table next to the analysis, and are written in the same transaction
+as the rows they describe, so a row whose results file was rewritten (a re-run or extended simulation) or whose
+analyser changed is detected and replaced.
+"""
+from __future__ import annotations
+import chaste_simulation_database_connector as csdc
+import hashlib
+import os
+import pathlib
+import pandas as pd
+from ..config import Config
+from .. import manifest
+
+
+table = 'analysis_fingerprints'
+_simple_types = (int, float, str, bool, type(None))
+
+
+def analyser_parameters(analyser)->str:
+    """
+    Parameter string of an analyser, its `parameters()` if it defines one, otherwise its class, name and simple attributes
+    """
+    if hasattr(analyser, 'parameters'): return str(analyser.parameters())
+    attributes = sorted((k, v) for k, v in vars(analyser).items()
+                        if not k.startswith('_') and (isinstance(v, _simple_types) or (isinstance(v, tuple) and all(isinstance(x, _simple_types) for x in v))))
+    return f'{type(analyser).__module__}.{type(analyser).__qualname__}|{analyser}|{attributes!r}'
+
+def source_stats(results_folder:str|pathlib.Path, timesteps:list[int])->dict[int,tuple[int,int]]:
+    """
+    (size, mtime_ns) of the results file of each timestep, from the manifest when `Config.use_manifest` is set
+    """
+    results_folder = pathlib.Path(results_folder)
+    if Config.use_manifest:
+        entry = manifest.simulation_entry(results_folder)
+        known = {t:(size, mtime) for t, size, mtime in zip(entry['timesteps'], entry['size'], entry['mtime_ns'])}
+        return {t:known[t] for t in timesteps if t in known}
+    stats = dict()
+    for t in timesteps:
+        try:
+            stat = os.stat(results_folder.joinpath(f'results_{t}.vtu'))
+        except FileNotFoundError:
+            continue
+        stats[t] = (stat.st_size, stat.st_mtime_ns)
+    return stats
+
+def fingerprint(size:int, mtime_ns:int, parameters:str)->str:
+    return hashlib.blake2b(f'{size}|{mtime_ns}|{parameters}'.encode(), digest_size=16).hexdigest()
+
+
+def _has_table(db:csdc.Connection)->bool:
+    return len(pd.read_sql("SELECT name FROM sqlite_master WHERE type = 'table' AND name = :name", db.get_connection(), params=dict(name=table))) > 0
+
+def read_fingerprints(db:csdc.Connection, experiment:str, analysis_names:list[str])->dict[tuple[int,int,str],str]:
+    """
+    Recorded fingerprints of the analysis of an experiment, keyed by (iteration, timestep, analysis name)
+    """
+    if not analysis_names or not _has_table(db): return dict()
+    names = {f'analysis_name_{i}':name for i, name in enumerate(dict.fromkeys(analysis_names))}
+    df = pd.read_sql(f"SELECT iteration, timestep, analysis_name, fingerprint FROM {table} WHERE analysis_name IN ({', '.join(':'+k for k in names)}) AND experiment = :experiment",
+                     db.get_connection(), params=dict(names, experiment=experiment))
+    return {(int(i), int(t), n):f for i, t, n, f in zip(df.iteration, df.timestep, df.analysis_name, df.fingerprint)}
+
+def record_fingerprints(db:csdc.Connection, rows:list[dict]):
+    """
+    Record the fingerprints of rows with keys experiment, iteration, timestep, analysis_name and fingerprint, without committing
+    """
+    if not rows: return
+    connection = db.get_connection()
+    connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (experiment TEXT, iteration INTEGER, timestep INTEGER, analysis_name TEXT, fingerprint TEXT, "
+                       "PRIMARY KEY (experiment, iteration, timestep, analysis_name))")
+    connection.executemany(f"INSERT OR REPLACE INTO {table} (experiment, iteration, timestep, analysis_name, fingerprint) VALUES (:experiment, :iteration, :timestep, :analysis_name, :fingerprint)",
+                           [dict(experiment=r['experiment'], iteration=int(r['iteration']), timestep=int(r['timestep']), analysis_name=r['analysis_name'], fingerprint=r['fingerprint']) for r in rows])
+
+def add_analysis(db:csdc.Connection, rows:list[dict]):
+    """
+    Insert analysis rows without committing. Rows carrying a `source_fingerprint` replace any existing analysis of the
+    same timepoint and analyser, and their fingerprints are recorded
+    """
+    rows = [dict(r) for r in rows]
+    fingerprints = [r.pop('source_fingerprint', None) for r in rows]
+    fingerprinted = [dict(r, fingerprint=f) for r, f in zip(rows, fingerprints) if f is not None]
+    if fingerprinted:
+        db.get_connection().executemany("DELETE FROM analysis WHERE timestep = :timestep AND analysis_name = :analysis_name AND simulation_id IN "
+                                        "(SELECT id FROM simulations WHERE experiment = :experiment AND iteration = :iteration)",
+                                        [dict(experiment=r['experiment'], iteration=int(r['iteration']), timestep=int(r['timestep']), analysis_name=r['analysis_name']) for r in fingerprinted])
+    if rows: db.add_bulk_analysis(rows, commit=False, close_connection=False)
+    record_fingerprints(db, fingerprinted)
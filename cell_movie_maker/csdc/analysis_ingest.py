@@ -2,9 +2,89 @@ import chaste_simulation_database_connector as csdc
 from ..experiment import Experiment
 from ..simulation import Simulation
 from ..simulation_timepoint import SimulationTimepoint
+from ..config import Config
+from .. import sharding
+from .. import parallel
+from .. import scheduler
+from .analysis_spool import AnalysisSpool, SpoolLoader
+from . import analysis_fingerprints
+import pathlib
 import typing
+import logging
+import time
+import tqdm
 import pandas as pd
 
+
+def analyse_timestep(args:tuple[int,int,int,list[int],list[str]|None])->list[dict]|int:
+    """
+    Read a timepoint in a worker of `AnalysisIngest.stream_timepoint_analysis` and run the analysers it still needs on it.
+    Returns the rows, or the number of rows written to segments when spooling
+    """
+    token, i, timestep, needed, fingerprints = args
+    context, (process_timepoint, analysers, spool) = parallel._worker_state[token]
+    try:
+        sim = context.simulation(i)
+        tp = sim.read_timepoint(timestep)
+    except Exception as e:
+        logging.error(f"Unable to process {context.sim_folders[i]} {timestep}: {e}")
+        tp = None
+    rows = [] if tp is None or not tp.ok else [process_timepoint((tp, analysers[k], sim.name)) for k in needed]
+    if fingerprints is not None:
+        rows = [r if r is None else dict(r, source_fingerprint=f) for r, f in zip(rows, fingerprints)]
+    rows = [r for r in rows if r is not None]
+    return rows if spool is None else spool.append(token, rows)
+
+
+class AnalysisWriter:
+    """
+    Buffer of analysis rows, inserted and committed every `commit_rows` rows or `commit_seconds` seconds,
+    so a long ingest keeps little in memory and loses at most the last few rows if it is interrupted.
+    The connection is kept open until the writer is closed.
+    """
+    def __init__(self, db:csdc.Connection, commit_rows:int=1000, commit_seconds:float=60):
+        self.db = db
+        self.commit_rows = commit_rows
+        self.commit_seconds = commit_seconds
+        self.rows:list[dict] = []
+        self.written = 0
+        self._last_commit = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, row:dict|None):
+        self.add_many([] if row is None else [row])
+
+    def add_many(self, rows:list[dict]):
+        """
+        Add rows which are written in the same transaction
+        """
+        self.rows.extend(rows)
+        if len(self.rows) >= self.commit_rows or (self.rows and time.monotonic() - self._last_commit >= self.commit_seconds):
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            analysis_fingerprints.add_analysis(self.db, self.rows)
+            self.db.commit()
+            self.written += len(self.rows)
+            logging.debug(f"Committed {len(self.rows)} analysis rows, {self.written} in total")
+            self.rows = []
+        self._last_commit = time.monotonic()
+
+    def close(self):
+        """
+        Write the remaining rows, rows already buffered are written even if the ingest failed
+        """
+        self.flush()
+        self.db.commit()
+        self.db.close_connection()
+
+
 class AnalysisIngest:
     """
     Abstract class to handle performing and storing analysis to a database
@@ -15,6 +95,18 @@ class AnalysisIngest:
         CSDC Database connection
     skip_existing : bool
         If true will skip performing analysis if analysis already exists in database
+    commit_rows : int
+        Rows inserted per commit by streaming ingests (default 1000)
+    commit_seconds : float
+        Longest time between commits of streaming ingests (default 60)
+    spool_folder : pathlib.Path|None
+        If set, workers of streaming ingests write their rows to parquet segments in this folder (preferably on a local
+        disk), which are loaded by a single `SpoolLoader`, see `analysis_spool`. Segments left by an interrupted ingest
+        are loaded when the next ingest starts (default None)
+    incremental : bool
+        If true, timepoint ingests record a fingerprint of each row's source (results file size and mtime, and the
+        analyser's parameters, see `analysis_fingerprints`) and recompute rows whose fingerprint changed, replacing
+        them. Existing rows without a fingerprint are kept and their fingerprint recorded (default False)
     """
     def __init__(self, db:csdc.Connection, skip_existing=True):
         """
@@ -29,6 +121,10 @@ class AnalysisIngest:
         """
         self.db:csdc.Connection = db
         self.skip_existing = skip_existing
+        self.commit_rows = 1000
+        self.commit_seconds = 60.
+        self.spool_folder:pathlib.Path|None = None
+        self.incremental = False
 
     def ingest_experiment(self, experiment:Experiment, *args, **kwargs):
         raise NotImplementedError
@@ -38,7 +134,195 @@ class AnalysisIngest:
     
     def ingest_timepoint(self, timepoint:SimulationTimepoint, *args, **kwargs):
         raise NotImplementedError
+
+    def ingest_shard(self, experiment:Experiment, shard:sharding.Shard|str|None, *args, **kwargs):
+        """
+        Ingest the simulations of one shard of an experiment, see `Experiment.shard`
+
+        Parameters
+        ----------
+        experiment : Experiment
+            Experiment containing simulations to process
+        shard : Shard|str|None
+            Shard, 'index/count', or None for the task of a SLURM array job
+        *args, **kwargs
+            Passed to `ingest_experiment`
+        """
+        return self.ingest_experiment(experiment.shard(shard), *args, **kwargs)
+
+    def load_spool(self)->int:
+        """
+        Load the segments left in `spool_folder` by an interrupted ingest, so they are seen by `get_skip_*`
+
+        Returns
+        -------
+        int
+            Number of rows inserted
+        """
+        if self.spool_folder is None: return 0
+        loader = SpoolLoader(self.db, self.spool_folder, self.commit_rows, self.commit_seconds)
+        inserted = loader.load()
+        if inserted: logging.info(f"Loaded {inserted} analysis left in {self.spool_folder}")
+        return inserted
+
+    def plan_timepoint_ingest(self, experiment:Experiment|str, sim_folders:list, analyser)->pd.DataFrame:
+        """
+        Work a timepoint ingest would do, without doing it.
+        Each timestep selected by `select_timesteps` is compared with the existing analysis and its recorded fingerprint
+
+        Parameters
+        ----------
+        experiment : Experiment|str
+            Experiment, or its name
+        sim_folders : list
+            Results folders of the simulations
+        analyser : TimepointAnalyser|list[TimepointAnalyser]
+            One or several analysers
+
+        Returns
+        -------
+        pd.DataFrame
+            iteration, timestep, analysis_name, fingerprint, action and compute of each (timepoint, analyser).
+            action is 'new' (no analysis), 'current' (fingerprint unchanged), 'changed' (fingerprint differs) or 'unrecorded'
+            (analysis without a fingerprint), compute is whether the ingest would analyse it
+        """
+        analysers = list(analyser) if isinstance(analyser, (list, tuple)) else [analyser]
+        names = [str(a) for a in analysers]
+        parameters = [analysis_fingerprints.analyser_parameters(a) for a in analysers]
+        existing = self.get_existing_sim_timepoints(experiment, names)
+        recorded = analysis_fingerprints.read_fingerprints(self.db, str(experiment), names)
+        simulation_class = Simulation if Config.simulation_class is None else Config.simulation_class
+
+        plan = []
+        for f in sim_folders:
+            try:
+                sim = simulation_class(f, lightweight=True)
+                selected = sorted({sim.output_timestep(t) for t in self.select_timesteps(sim)})
+            except Exception as e:
+                logging.error(f"Unable to read {f}: {e}")
+                continue
+            iteration = getattr(sim, 'iteration', None)
+            stats = analysis_fingerprints.source_stats(sim.results_folder, selected)
+            for timestep, (size, mtime_ns) in stats.items():
+                for k, name in enumerate(names):
+                    fingerprint = analysis_fingerprints.fingerprint(size, mtime_ns, parameters[k])
+                    if (iteration, timestep) not in existing[k]: action = 'new'
+                    elif (iteration, timestep, name) not in recorded: action = 'unrecorded'
+                    elif recorded[(iteration, timestep, name)] != fingerprint: action = 'changed'
+                    else: action = 'current'
+                    compute = action == 'new' or (action == 'changed' and self.incremental) or not self.skip_existing
+                    plan.append((iteration, timestep, name, fingerprint, action, compute))
+        return pd.DataFrame(plan, columns=['iteration', 'timestep', 'analysis_name', 'fingerprint', 'action', 'compute'])
+
+    def plan_experiment(self, experiment:Experiment, analyser)->pd.DataFrame:
+        """
+        Dry run of `ingest_experiment`, see `plan_timepoint_ingest`
+        """
+        return self.plan_timepoint_ingest(experiment, experiment.sim_folders, analyser)
+
+    def prepare_timepoint_ingest(self, experiment:Experiment|str, sim_folders:list, analyser)->tuple[list,list[set[tuple[int,int]]],dict|None]:
+        """
+        Analysers as a list, the (iteration, timestep) to skip for each, and the fingerprints of the rows to compute
+        when `incremental`, after loading any spooled analysis
+
+        Parameters
+        ----------
+        experiment : Experiment|str
+            Experiment, or its name
+        sim_folders : list
+            Results folders of the simulations
+        analyser : TimepointAnalyser|list[TimepointAnalyser]
+            One or several analysers
+        """
+        analysers = list(analyser) if isinstance(analyser, (list, tuple)) else [analyser]
+        self.load_spool()
+        if not self.incremental:
+            return analysers, self.get_skip_sim_timepoints_by_analysis(experiment, [str(a) for a in analysers]), None
+
+        plan = self.plan_timepoint_ingest(experiment, sim_folders, analysers)
+        logging.info(f"Incremental ingest of {experiment}: " + ', '.join(f'{n} {action}' for action, n in plan.action.value_counts().items()))
+        unrecorded = plan[plan.action == 'unrecorded']
+        if len(unrecorded):
+            analysis_fingerprints.record_fingerprints(self.db, unrecorded.assign(experiment=str(experiment)).to_dict('records'))
+            self.db.commit()
+        skip = [set() for _ in analysers]
+        index = {str(a):k for k, a in enumerate(analysers)}
+        for iteration, timestep, name in plan.loc[~plan.compute, ['iteration', 'timestep', 'analysis_name']].itertuples(index=False):
+            skip[index[name]].add((int(iteration), int(timestep)))
+        computed = plan[plan.compute]
+        fingerprints = {(int(i), int(t), n):f for i, t, n, f in zip(computed.iteration, computed.timestep, computed.analysis_name, computed.fingerprint)}
+        return analysers, skip, fingerprints
     
+    def stream_timepoint_analysis(self, sim_folders:list, timesteps:typing.Callable[[Simulation],typing.Iterable[int]], analysers:list,
+                                  process_timepoint:typing.Callable, skip:list[set[tuple[int,int]]]|None=None, nproc:int=50,
+                                  fingerprints:dict[tuple[int,int,str],str]|None=None)->int:
+        """
+        Analyse timepoints of many simulations with bounded memory.
+        Only (simulation, timestep) descriptors are produced here, as the pool asks for tasks, each worker reads and analyses
+        its timepoint, and results are written as they arrive (in any order) by an `AnalysisWriter`.
+        Each timepoint is read once for all analysers, and the rows of a timepoint are committed together.
+        When `spool_folder` is set, workers write rows to spool segments instead, see `analysis_spool`.
+
+        Parameters
+        ----------
+        sim_folders : list
+            Results folders of the simulations
+        timesteps : Callable[[Simulation], Iterable[int]]
+            Timesteps to analyse in a simulation, given a lightweight instance of it. Each is resolved to the output read
+            for it (see `Simulation.output_timestep`) before it is compared with `skip`, and is analysed once
+        analysers : list[TimepointAnalyser]
+            Each passed to process_timepoint
+        process_timepoint : Callable
+            Called with (timepoint, analyser, experiment name) in the worker, returns the row to insert or None
+        skip : list[set[tuple[int,int]]]|None, optional
+            (iteration, timestep) already analysed, for each analyser
+        nproc : int, optional (default 50)
+            Maximum number of processes to use
+        fingerprints : dict[tuple[int,int,str],str]|None, optional
+            Source fingerprint of the rows to compute, by (iteration, timestep, analysis name), see `prepare_timepoint_ingest`.
+            Rows with a fingerprint replace existing analysis of the same timepoint and analyser
+
+        Returns
+        -------
+        int
+            Number of rows written
+        """
+        simulation_class = Simulation if Config.simulation_class is None else Config.simulation_class
+        context = scheduler.ScheduleContext(list(sim_folders), [], simulation_class)
+        names = [str(a) for a in analysers]
+
+        def tasks(token:int):
+            for i, f in enumerate(context.sim_folders):
+                try:
+                    sim = simulation_class(f, lightweight=True)
+                    selected = sorted({sim.output_timestep(t) for t in timesteps(sim)})
+                except Exception as e:
+                    logging.error(f"Unable to read {f}: {e}")
+                    continue
+                for timestep in selected:
+                    key = (getattr(sim, 'iteration', None), timestep)
+                    needed = [k for k in range(len(analysers)) if skip is None or key not in skip[k]]
+                    if not needed: continue
+                    yield token, i, timestep, needed, None if fingerprints is None else [fingerprints.get((*key, names[k])) for k in needed]
+
+        spool = None
+        if self.spool_folder is not None:
+            # Reusable loky workers never exit, so they cannot keep rows buffered between tasks
+            loky = (Config.executor_backend or 'process') == 'loky'
+            spool = AnalysisSpool(self.spool_folder, segment_rows=1 if loky else max(1, self.commit_rows // max(1, nproc)), segment_seconds=self.commit_seconds)
+        writer = AnalysisWriter(self.db, self.commit_rows, self.commit_seconds) if spool is None else \
+                 SpoolLoader(self.db, self.spool_folder, self.commit_rows, self.commit_seconds)
+        with writer:
+            # Workers are restarted periodically, as before, to release memory held after reading many timepoints
+            # Process workers write their spooled rows when they exit, so every segment exists once the pool is closed
+            with parallel.context_pool(context, (process_timepoint, list(analysers), spool), maxproc=nproc, maxtasksperchild=64) as p:
+                for result in tqdm.tqdm(p.map(analyse_timestep, tasks(p.token), ordered=False), desc="Performing analysis", unit='timepoint'):
+                    if spool is None: writer.add_many(result)
+                    else: writer.add_spooled(result)
+            if spool is not None: spool.flush(p.token) # Rows of serial and thread workers
+        logging.info(f"Inserted {writer.written} new analysis")
+        return writer.written
+
     def get_skip_sims(self, experiment:Experiment, analysis_name:str)->set[int]:
         """
         Find simulations in experiment where there is already analysis with name analysis_name
@@ -59,7 +343,6 @@ class AnalysisIngest:
         experiment = str(experiment)
         skip_ids = pd.read_sql("SELECT iteration FROM analysis INNER JOIN simulations ON analysis.simulation_id = simulations.id WHERE analysis_name = :analysis_name AND experiment = :experiment",
                     self.db.get_connection(), params=dict(analysis_name = analysis_name, experiment=experiment))
-        self.db.close_connection()
         return set(skip_ids.iteration)
     
     def get_skip_sim_timepoints(self, experiment:Experiment, analysis_name:str)->set[tuple[int,int]]:
@@ -82,6 +365,29 @@ class AnalysisIngest:
         experiment = str(experiment)
         skip_ids = pd.read_sql("SELECT iteration, timestep FROM analysis INNER JOIN simulations ON analysis.simulation_id = simulations.id WHERE analysis_name = :analysis_name AND experiment = :experiment",
                     self.db.get_connection(), params=dict(analysis_name = analysis_name, experiment=experiment))
-        self.db.close_connection()
         return {(int(r[0]), int(r[1])) for _,r in skip_ids.iterrows()}
+
+    def get_skip_sim_timepoints_by_analysis(self, experiment:Experiment, analysis_names:list[str])->list[set[tuple[int,int]]]:
+        """
+        `get_skip_sim_timepoints` for several analyses, with a single query
+
+        Returns
+        -------
+        list[set[tuple[int,int]]]
+            Set of (simulation id, timestep) with existing analysis, for each of analysis_names
+        """
+        if not self.skip_existing: return [set() for _ in analysis_names]
+        return self.get_existing_sim_timepoints(experiment, analysis_names)
+
+    def get_existing_sim_timepoints(self, experiment:Experiment, analysis_names:list[str])->list[set[tuple[int,int]]]:
+        """
+        (simulation id, timestep) with existing analysis for each of analysis_names, regardless of `skip_existing`
+        """
+        names = {f'analysis_name_{i}':name for i, name in enumerate(dict.fromkeys(analysis_names))}
+        skip_ids = pd.read_sql(f"SELECT analysis_name, iteration, timestep FROM analysis INNER JOIN simulations ON analysis.simulation_id = simulations.id WHERE analysis_name IN ({', '.join(':'+k for k in names)}) AND experiment = :experiment",
+                    self.db.get_connection(), params=dict(names, experiment=str(experiment)))
+        skip = {name:set() for name in names.values()}
+        for name, iteration, timestep in zip(skip_ids.analysis_name, skip_ids.iteration, skip_ids.timestep):
+            skip[name].add((int(iteration), int(timestep)))
+        return [skip[name] for name in analysis_names]
     
\ No newline at end of file
@@ -64,7 +64,7 @@ class InfoIngester(AnalysisIngest):
         if batch_size is None: batch_size = len(experiment.sim_ids)
         for i, sims_batch in enumerate(chunk(experiment.sim_ids, batch_size)):
             if is_batched: logging.info(f"Batch {i}...")
-            self.db.add_bulk_simulations([dict(experiment=experiment.name, iteration=int(sim_id)) for sim_id in sims_batch], commit=True, close_connection=True)
+            self.db.add_bulk_simulations([dict(experiment=experiment.name, iteration=int(sim_id)) for sim_id in sims_batch], commit=True, close_connection=False)
             results = []
             for sim_id in tqdm.tqdm(sims_batch, disable=disable_tqdm):
                 info_file = Config.output_folder.joinpath(experiment.name, "info", f'sim_{sim_id}.csv')
@@ -76,7 +76,7 @@ class InfoIngester(AnalysisIngest):
                 elif self.mode == 'parquet': analysis_value = info.to_parquet(index=True)
                 else: raise RuntimeError(f'Mode \"{self.mode}\" not implemented, try "json" or "parquet"')
                 results.append(dict(experiment=experiment.name, iteration=sim_id, timestep=-1, analysis_name="cellcounts", analysis_value=analysis_value))
-            self.db.add_bulk_analysis(results, commit=True, close_connection=True)
+            self.db.add_bulk_analysis(results, commit=True, close_connection=False)
         self.db.commit()
         self.db.close_connection()
             
@@ -9,7 +9,7 @@ import logging
 import tqdm
 import pathlib
 import pandas as pd
-import multiprocessing
+from ... import parallel
 import itertools
 
 
@@ -83,13 +83,13 @@ class SimulationAnalysisIngest(AnalysisIngest):
         for i, sims_batch in enumerate(chunk(experiment.sim_ids, self.batch_size)):
             to_process = [experiment.read_simulation(sim_id) for sim_id in sims_batch if sim_id not in skip_sim_ids]
             logging.info(f"Batch {i}, Performing {len(to_process)} new analysis...")
-            with multiprocessing.Pool(self.nproc, maxtasksperchild=1) as p:
+            with parallel.Executor(self.nproc, maxtasksperchild=1) as p:
                 analysis = list(tqdm.tqdm(
-                    p.imap(process_sim, zip(to_process, itertools.repeat(analyser))),
+                    p.map(process_sim, zip(to_process, itertools.repeat(analyser)), ordered=False),
                     total=len(to_process)))
             analysis = [r for r in analysis if r is not None]
 
-            self.db.add_bulk_analysis(analysis, commit=True, close_connection=True)
+            self.db.add_bulk_analysis(analysis, commit=True, close_connection=False)
         self.db.commit()
         self.db.close_connection()
             
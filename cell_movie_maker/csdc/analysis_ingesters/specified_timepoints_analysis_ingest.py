@@ -11,7 +11,6 @@ import tqdm
 import pathlib
 import pandas as pd
 import enum
-import multiprocessing
 import itertools
 import logging
 import functools
@@ -55,13 +54,12 @@ class SpecifiedTimepointAnalysisIngest(AnalysisIngest):
     """
     Class to analyse a specific list of timesteps from simulations and write analysis to database.  
     Can store data using parquet or json (parquet is significantly faster)  
+    Timepoints are read and analysed by the workers and results are committed as they arrive, see `AnalysisIngest.stream_timepoint_analysis`  
 
     Attributes
     ----------
     timesteps : list[int]
         List of timesteps to analyse from each simulation
-    batch_size : int
-        Number of simulations to process in each batch
     nproc : int
         Number of multiprocesses to use
     mode : str
@@ -82,13 +80,23 @@ class SpecifiedTimepointAnalysisIngest(AnalysisIngest):
             Skip analysis if analysis with matching metadata is already in database
         """
         super().__init__(*args, **kwargs)
-        self.batch_size = 500
         self.timesteps = timesteps
         self.nproc = 50
         self.mode:str = 'parquet'
 
+    @property
+    def process_timepoint(self)->typing.Callable:
+        if self.mode == 'json': return process_timepoint_json
+        elif self.mode == 'parquet': return process_timepoint_parquet
+        else: raise RuntimeError(f'Mode \"{self.mode}\" not implemented, try "json" or "parquet"')
+
+    def select_timesteps(self, sim:Simulation)->list[int]:
+        """
+        `timesteps`, each replaced by the output read for it (see `Simulation.output_timestep`)
+        """
+        return [sim.output_timestep(timestep) for timestep in self.timesteps]
 
-    def ingest_experiment(self, experiment:Experiment, analyser:typing.Type[TimepointAnalyser]):
+    def ingest_experiment(self, experiment:Experiment, analyser:TimepointAnalyser|list[TimepointAnalyser]):
         """
         Perform analysis on simulation timepoints in experiment.  
         Timepoints are selected based on how this class is configured.
@@ -97,51 +105,18 @@ class SpecifiedTimepointAnalysisIngest(AnalysisIngest):
         ----------
         eperiment : Experiment
             Experiment containing simulations to process
-        analyser : TimepointAnalyser
-            TimepointAnalyser class which performs analysis on each SimulationTimepoint
+        analyser : TimepointAnalyser|list[TimepointAnalyser]
+            TimepointAnalyser which performs analysis on each SimulationTimepoint, or several, which share one read of each timepoint
         
         Returns
         -------
         None
         """
-        skip_sim_timepoints = self.get_skip_sim_timepoints(experiment, str(analyser))
-        if self.mode == 'json': process_timepoint = process_timepoint_json
-        elif self.mode == 'parquet': process_timepoint = process_timepoint_parquet
-        else: raise RuntimeError(f'Mode \"{self.mode}\" not implemented, try "json" or "parquet"')
-
-        for i, sims_batch in enumerate(chunk(experiment.sim_ids, self.batch_size)):
-            to_process = []
-            logging.info(f"Batch {i} / {len(experiment.sim_ids)//self.batch_size+1}")
-            # logging.info(f"Batch {i}, Checking {len(sims_batch)} sims...")
-            for sim_id in tqdm.tqdm(sims_batch, desc="Checking sim batch"):
-                timesteps = set()
-                sim = experiment.read_simulation(sim_id)
-                for timestep in self.timesteps:
-                    if timestep > sim.results_timesteps[-1]: timestep = sim.results_timesteps[-1]
-                    if self.skip_existing and (sim_id, timestep) in skip_sim_timepoints: continue
-                    timesteps.add(timestep)
-                
-                for timestep in timesteps:
-                    try:
-                        tp = sim.read_timepoint(timestep)
-                        if self.skip_existing and (sim.iteration, tp.timestep) in skip_sim_timepoints: continue
-                        if tp.ok: to_process.append(tp)
-                    except Exception as e:
-                        logging.error(f"Unable to process sim_{sim_id} {timestep}")
-
-            logging.info(f"Batch {i}, Performing {len(to_process)} new analysis...")
-            with multiprocessing.Pool(self.nproc, maxtasksperchild=1) as p:
-                analysis = list(tqdm.tqdm(
-                    p.imap(process_timepoint, zip(to_process, itertools.repeat(analyser), itertools.repeat(str(experiment)))),
-                    total=len(to_process), desc="Performing analysis"))
-            analysis = [r for r in analysis if r is not None]
+        analysers, skip_sim_timepoints, fingerprints = self.prepare_timepoint_ingest(experiment, experiment.sim_folders, analyser)
+        self.stream_timepoint_analysis(experiment.sim_folders, self.select_timesteps, analysers, self.process_timepoint,
+                                       skip=skip_sim_timepoints, nproc=self.nproc, fingerprints=fingerprints)
 
-            logging.info(f"Batch {i}, Inserting {len(analysis)} new analysis...")
-            self.db.add_bulk_analysis(analysis, commit=True, close_connection=True)
-        self.db.commit()
-        self.db.close_connection()
-
-    def ingest_simulation(self, sim:Simulation, analyser:typing.Type[TimepointAnalyser]):
+    def ingest_simulation(self, sim:Simulation, analyser:TimepointAnalyser|list[TimepointAnalyser]):
         """
         Perform analysis on simulation timepoints in a simulation.  
         Timepoints are selected based on how this class is configured.
@@ -150,37 +125,13 @@ class SpecifiedTimepointAnalysisIngest(AnalysisIngest):
         ----------
         sim : Simulation
             Simulation to process
-        analyser : TimepointAnalyser
-            TimepointAnalyser class which performs analysis on each SimulationTimepoint
+        analyser : TimepointAnalyser|list[TimepointAnalyser]
+            TimepointAnalyser which performs analysis on each SimulationTimepoint, or several, which share one read of each timepoint
         
         Returns
         -------
         None
         """
-        skip_sim_timepoints = self.get_skip_sim_timepoints(sim.name, str(analyser))
-        if self.mode == 'json': process_timepoint = process_timepoint_json
-        elif self.mode == 'parquet': process_timepoint = process_timepoint_parquet
-        else: raise RuntimeError(f'Mode \"{self.mode}\" not implemented, try "json" or "parquet"')
-
-        timepoints = []
-        for timestep in self.timesteps:
-            if timestep > sim.results_timesteps[-1]: timestep = sim.results_timesteps[-1]
-            if self.skip_existing and (sim.iteration, timestep) in skip_sim_timepoints: continue
-            tp = sim.read_timepoint(timestep)
-            if self.skip_existing and (sim.iteration, tp.timestep) in skip_sim_timepoints: continue
-            if not tp.ok: continue
-            timepoints.append(tp)
-
-        with multiprocessing.Pool(self.nproc, maxtasksperchild=1) as p:
-            analysis = list(tqdm.tqdm(
-                p.imap(process_timepoint, zip(timepoints, itertools.repeat(analyser), itertools.repeat(str(sim.name)))),
-                total=len(timepoints), desc="Performing analysis"))
-        analysis = [r for r in analysis if r is not None]
-
-        logging.info(f"Inserting {len(analysis)} new analysis...")
-        self.db.add_bulk_analysis(analysis, commit=True, close_connection=True)
-        self.db.commit()
-        self.db.close_connection()
-
-
-            
+        analysers, skip_sim_timepoints, fingerprints = self.prepare_timepoint_ingest(sim.name, [sim.results_folder], analyser)
+        self.stream_timepoint_analysis([sim.results_folder], self.select_timesteps, analysers, self.process_timepoint,
+                                       skip=skip_sim_timepoints, nproc=self.nproc, fingerprints=fingerprints)
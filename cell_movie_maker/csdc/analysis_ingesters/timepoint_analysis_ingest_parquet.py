@@ -11,7 +11,8 @@ import tqdm
 import pathlib
 import pandas as pd
 import enum
-import multiprocessing
+from ... import parallel
+from ... import shared_timepoints
 import itertools
 import logging
 
@@ -71,9 +72,9 @@ class TimepointAnalysisIngestParquet(AnalysisIngest):
                         logging.error(f"Unable to process sim_{sim_id} {timestep}")
 
             logging.info(f"Batch {i}, Performing {len(to_process)} new analysis...")
-            with multiprocessing.Pool(self.nproc, maxtasksperchild=1) as p:
+            with shared_timepoints.SharedTimepoints() as shared, parallel.Executor(self.nproc, start_method='forkserver', maxtasksperchild=1) as p:
                 analysis = list(tqdm.tqdm(
-                    p.imap(process_timepoint, zip(to_process, itertools.repeat(analyser), itertools.repeat(str(experiment)))),
+                    shared.imap(p, process_timepoint, to_process, analyser, str(experiment)),
                     total=len(to_process), desc="Performing analysis"))
             analysis = [r for r in analysis if r is not None]
 
@@ -91,9 +92,9 @@ class TimepointAnalysisIngestParquet(AnalysisIngest):
             if self.skip_existing and (sim.iteration, timestep) in skip_sim_timepoints: continue
             timepoints.append(sim.read_timepoint(timestep))
 
-        with multiprocessing.Pool(self.nproc, maxtasksperchild=1) as p:
+        with shared_timepoints.SharedTimepoints() as shared, parallel.Executor(self.nproc, start_method='forkserver', maxtasksperchild=1) as p:
             analysis = list(tqdm.tqdm(
-                p.imap(process_timepoint, zip(timepoints, itertools.repeat(analyser), itertools.repeat(str(sim.name)))),
+                shared.imap(p, process_timepoint, timepoints, analyser, str(sim.name)),
                 total=len(timepoints), desc="Performing analysis"))
         analysis = [r for r in analysis if r is not None]
 
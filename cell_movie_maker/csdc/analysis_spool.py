@@ -0,0 +1,242 @@
+"""
+Spooling of analysis rows to local parquet files, loaded into the database by a single writer.
+
+Workers append their rows to segment files in a spool folder instead of returning them to the parent, so analysis
+values are never pickled between processes. A `SpoolLoader` holding one connection bulk-loads the segments in large
+transactions and records which were applied in a checkpoint, so segments left by an interrupted ingest are loaded by
+the next one, exactly once.
+
+Layout of a spool folder::
+
+    segments/      finished segment files, <host>-<pid>-<uuid>.parquet
+    tmp/           segments being written
+    applied.log    names of the segments which have been committed
+    applying.json  segments of the transaction in progress, present only while loading
+"""
+from __future__ import annotations
+import chaste_simulation_database_connector as csdc
+import json
+import logging
+import multiprocessing.util
+import os
+import pathlib
+import socket
+import threading
+import time
+import uuid
+import pandas as pd
+from . import analysis_fingerprints
+
+
+_buffers:dict[tuple[int,int],"_Segment"] = dict() # (token, thread): rows not yet written by this process
+_buffers_lock = threading.Lock()
+_finalizer_pid:int|None = None
+
+
+class _Segment:
+    def __init__(self, spool:AnalysisSpool):
+        self.spool = spool
+        self.rows:list[dict] = []
+        self.started = time.monotonic()
+
+
+class AnalysisSpool:
+    """
+    Writer of segment files, used by the workers of an ingest. Picklable, it is sent to workers with the pool's state.
+    Rows are buffered per worker thread and written to a segment every `segment_rows` rows or `segment_seconds` seconds,
+    and when a process worker exits. Rows buffered in the parent (serial and thread backends) are written by `flush`.
+
+    Parameters
+    ----------
+    folder : str|pathlib.Path
+        Spool folder, preferably on a local disk
+    segment_rows : int, optional (default 100)
+        Rows per segment
+    segment_seconds : float, optional (default 60)
+        Longest time rows are buffered before being written
+    """
+    def __init__(self, folder:str|pathlib.Path, segment_rows:int=100, segment_seconds:float=60):
+        self.folder = pathlib.Path(folder)
+        self.segment_rows = max(1, segment_rows)
+        self.segment_seconds = segment_seconds
+
+    @property
+    def segments_folder(self)->pathlib.Path:
+        return self.folder.joinpath('segments')
+
+    def append(self, token:int, rows:list[dict])->int:
+        """
+        Buffer rows of the ingest identified by token, writing a segment if the buffer is full
+
+        Returns
+        -------
+        int
+            Number of rows written to segments by this call
+        """
+        global _finalizer_pid
+        key = (token, threading.get_ident())
+        with _buffers_lock:
+            if _finalizer_pid != os.getpid():
+                # Process workers write what they hold when they exit, including restarts after maxtasksperchild
+                _finalizer_pid = os.getpid()
+                multiprocessing.util.Finalize(None, _flush_all, exitpriority=10)
+            segment = _buffers.setdefault(key, _Segment(self))
+            segment.rows.extend(rows)
+            if len(segment.rows) < self.segment_rows and time.monotonic() - segment.started < self.segment_seconds: return 0
+            del _buffers[key]
+        return self.write(segment.rows)
+
+    def flush(self, token:int)->int:
+        """
+        Write the rows of the ingest identified by token which are buffered in this process
+        """
+        with _buffers_lock:
+            segments = [_buffers.pop(k) for k in list(_buffers) if k[0] == token]
+        return sum(self.write(s.rows) for s in segments)
+
+    def write(self, rows:list[dict])->int:
+        if not rows: return 0
+        name = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex}.parquet'
+        tmp = self.folder.joinpath('tmp', name)
+        tmp.parent.mkdir(parents=True, exist_ok=True)
+        self.segments_folder.mkdir(parents=True, exist_ok=True)
+        pd.DataFrame(rows).to_parquet(tmp, index=False)
+        os.replace(tmp, self.segments_folder.joinpath(name))
+        return len(rows)
+
+
+def _flush_all():
+    with _buffers_lock:
+        segments = list(_buffers.values())
+        _buffers.clear()
+    for s in segments:
+        try:
+            s.spool.write(s.rows)
+        except Exception as e:
+            logging.error(f"Unable to write spooled analysis: {e}")
+
+
+class SpoolLoader:
+    """
+    Single writer loading the segments of a spool folder into the database.
+    The connection is kept open until the loader is closed. Segments are loaded in transactions of at least
+    `commit_rows` rows (or every `commit_seconds` seconds), then recorded in `applied.log` and deleted.
+    If a load is interrupted between its commit and its checkpoint, rows of its segments which are already in the
+    database are skipped when the segments are loaded again.
+
+    Parameters
+    ----------
+    db : csdc.Connection
+        Database connection
+    folder : str|pathlib.Path
+        Spool folder, see `AnalysisSpool`
+    commit_rows : int, optional (default 1000)
+        Spooled rows after which `add_spooled` loads the spool
+    commit_seconds : float, optional (default 60)
+        Longest time between loads of `add_spooled`
+    """
+    def __init__(self, db:csdc.Connection, folder:str|pathlib.Path, commit_rows:int=1000, commit_seconds:float=60):
+        self.db = db
+        self.folder = pathlib.Path(folder)
+        self.commit_rows = commit_rows
+        self.commit_seconds = commit_seconds
+        self.written = 0
+        self.spooled = 0
+        self._last_commit = time.monotonic()
+        self.folder.joinpath('segments').mkdir(parents=True, exist_ok=True)
+        self.applied = set(self.checkpoint.read_text().split()) if self.checkpoint.exists() else set()
+
+    @property
+    def checkpoint(self)->pathlib.Path:
+        return self.folder.joinpath('applied.log')
+
+    @property
+    def intent(self)->pathlib.Path:
+        return self.folder.joinpath('applying.json')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def pending(self)->list[pathlib.Path]:
+        """
+        Segments which have not been applied
+        """
+        segments = sorted(self.folder.joinpath('segments').glob('*.parquet'))
+        for p in [p for p in segments if p.name in self.applied]:
+            p.unlink(missing_ok=True) # Applied, but removed by a loader which was interrupted
+        return [p for p in segments if p.name not in self.applied]
+
+    def add_spooled(self, n:int):
+        """
+        Note that workers spooled n rows, loading the spool if `commit_rows` or `commit_seconds` is reached
+        """
+        self.spooled += n
+        if self.spooled >= self.commit_rows or (self.spooled and time.monotonic() - self._last_commit >= self.commit_seconds):
+            self.load()
+
+    def load(self)->int:
+        """
+        Load every pending segment, in transactions of at least `commit_rows` rows
+
+        Returns
+        -------
+        int
+            Number of rows inserted
+        """
+        uncertain = set(json.loads(self.intent.read_text())) if self.intent.exists() else set()
+        inserted, batch, rows = 0, [], []
+        for p in self.pending():
+            segment = pd.read_parquet(p).to_dict('records')
+            if p.name in uncertain: segment = self._not_in_database(segment)
+            batch.append(p)
+            rows.extend(segment)
+            if len(rows) >= self.commit_rows:
+                inserted += self._apply(batch, rows)
+                batch, rows = [], []
+        if batch: inserted += self._apply(batch, rows)
+        self.intent.unlink(missing_ok=True)
+        self.spooled = 0
+        self._last_commit = time.monotonic()
+        return inserted
+
+    def _apply(self, segments:list[pathlib.Path], rows:list[dict])->int:
+        self.intent.write_text(json.dumps([p.name for p in segments]))
+        analysis_fingerprints.add_analysis(self.db, rows)
+        self.db.commit()
+        with open(self.checkpoint, 'a') as f:
+            f.write(''.join(f'{p.name}\n' for p in segments))
+            f.flush()
+            os.fsync(f.fileno())
+        self.applied.update(p.name for p in segments)
+        self.intent.unlink()
+        for p in segments: p.unlink(missing_ok=True)
+        self.written += len(rows)
+        logging.debug(f"Loaded {len(rows)} spooled analysis rows from {len(segments)} segments, {self.written} in total")
+        return len(rows)
+
+    def _not_in_database(self, rows:list[dict])->list[dict]:
+        # Rows replacing analysis are committed with their fingerprint, so they are in the database if it was recorded
+        if not rows: return rows
+        names = {f'analysis_name_{i}':name for i, name in enumerate({r['analysis_name'] for r in rows})}
+        existing, recorded = set(), dict()
+        for experiment in {r['experiment'] for r in rows}:
+            df = pd.read_sql(f"SELECT iteration, timestep, analysis_name FROM analysis INNER JOIN simulations ON analysis.simulation_id = simulations.id WHERE analysis_name IN ({', '.join(':'+k for k in names)}) AND experiment = :experiment",
+                             self.db.get_connection(), params=dict(names, experiment=experiment))
+            existing.update((experiment, int(i), int(t), n) for i, t, n in zip(df.iteration, df.timestep, df.analysis_name))
+            recorded.update({(experiment, *k):f for k, f in analysis_fingerprints.read_fingerprints(self.db, experiment, list(names.values())).items()})
+        def applied(r:dict)->bool:
+            key = (r['experiment'], int(r['iteration']), int(r['timestep']), r['analysis_name'])
+            if r.get('source_fingerprint') is not None: return recorded.get(key) == r['source_fingerprint']
+            return key in existing
+        return [r for r in rows if not applied(r)]
+
+    def close(self):
+        """
+        Load the remaining segments and close the connection
+        """
+        self.load()
+        self.db.commit()
+        self.db.close_connection()
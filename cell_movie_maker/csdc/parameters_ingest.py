@@ -2,6 +2,11 @@ import chaste_simulation_database_connector as csdc
 from ..experiment import Experiment
 from ..simulation import Simulation
 from ..simulation_timepoint import SimulationTimepoint
+from .. import parallel
+import itertools
+import json
+import logging
+import pathlib
 import typing
 import tqdm
 
@@ -10,6 +15,30 @@ def chunk(l, n):
     for i in range(0, len(l), n):
         yield l[i:i+n]
 
+def read_params(sim_folder:str|pathlib.Path)->dict|None:
+    """
+    Parameters of a simulation from its params.json, without reading anything else
+    """
+    sim_folder = pathlib.Path(sim_folder)
+    if sim_folder.name == 'results_from_time_0': sim_folder = sim_folder.parent
+    try:
+        with open(sim_folder.joinpath('params.json'), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def varied_parameters(parameters:list[dict])->set[str]:
+    """
+    Names of parameters whose value differs between simulations, or which some simulations do not have
+    """
+    values:dict[str,str] = dict()
+    varied = set()
+    for p in parameters:
+        for k, v in p.items():
+            v = json.dumps(v, sort_keys=True)
+            if values.setdefault(k, v) != v: varied.add(k)
+    return varied | {k for k in values for p in parameters if k not in p}
+
 class ParametersIngest:
     """
     Class to write simulation parameters to database
@@ -19,6 +48,10 @@ class ParametersIngest:
     ----------
     db : csdc.Connection
         CSDC Database connection
+    nthreads : int
+        Threads reading params.json files (default 16)
+    batch_size : int
+        Parameter rows inserted per call to the database (default 10000)
     """
     def __init__(self, db:csdc.Connection):
         """
@@ -30,11 +63,15 @@ class ParametersIngest:
             Database connection
         """
         self.db:csdc.Connection = db
+        self.nthreads = 16
+        self.batch_size = 10000
 
     def ingest_experiment(self, experiment:typing.Type[Experiment], disable_tqdm:bool=False)->None:
         """
         Write parameters of each simulation in experiment to database
         Infers which parameters vary across simulations within experiment
+        Only params.json of each simulation is read, by `nthreads` threads, and rows are inserted in batches of
+        `batch_size` in a single transaction
         
         Arguments
         ---------
@@ -47,18 +84,19 @@ class ParametersIngest:
         -------
         None
         """
-        parameters = []
-        sims_data = []
-        for sim_folder in tqdm.tqdm(experiment.sim_folders, disable=disable_tqdm):
-            sim:Simulation = Simulation(sim_folder)
-            parameters.extend([dict(
-                experiment=experiment.name, iteration=int(sim.iteration),
-                parameter_name=k, parameter_value=v, was_varied=False)
-                for k,v in sim.parameters.items()])
-            sims_data.append(dict(experiment=experiment.name, iteration=int(sim.iteration)))
-        self.db.add_bulk_simulations(sims_data, commit=False, close_connection=False)
-        self.db.add_bulk_parameters(parameters, commit=True, close_connection=True)
-        self.db.interpret_varied_parameters(experiment.name)
+        with parallel.Executor(self.nthreads, backend='thread', chunksize=64) as p:
+            parameters = list(tqdm.tqdm(p.map(read_params, experiment.sim_folders), total=len(experiment.sim_folders), disable=disable_tqdm))
+        for sim_folder in (f for f, params in zip(experiment.sim_folders, parameters) if params is None):
+            logging.warning(f"No params.json for {sim_folder}")
+        varied = varied_parameters([params for params in parameters if params is not None])
+        parameters = [dict() if params is None else params for params in parameters]
+
+        for sims_batch in chunk(experiment.sim_ids, self.batch_size):
+            self.db.add_bulk_simulations([dict(experiment=experiment.name, iteration=int(sim_id)) for sim_id in sims_batch], commit=False, close_connection=False)
+        rows = (dict(experiment=experiment.name, iteration=int(sim_id), parameter_name=k, parameter_value=v, was_varied=k in varied)
+                for sim_id, params in zip(experiment.sim_ids, parameters) for k,v in params.items())
+        while batch := list(itertools.islice(rows, self.batch_size)):
+            self.db.add_bulk_parameters(batch, commit=False, close_connection=False)
         self.db.commit()
         self.db.close_connection()
     
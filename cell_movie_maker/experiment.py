@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from .simulation import Simulation
+import copy
 import pathlib
 import numpy as np
 import pandas as pd
@@ -11,6 +12,11 @@ import multiprocessing
 import itertools
 import tqdm
 from .config import Config
+from . import timepoint_cache
+from . import parallel
+from . import manifest
+from . import scheduler
+from . import sharding
 import errno
 import typing
 
@@ -46,7 +52,10 @@ class Experiment:
 
         self.name:str = self.experiment_folder.name
 
-        sim_folders = sorted([(int(sim_iteration_regex_search.search(str(f))["iteration"]), f) for f in self.experiment_folder.glob("sim_*/results_from_time_0")])
+        if Config.use_manifest:
+            sim_folders = manifest.simulation_folders(self.experiment_folder)
+        else:
+            sim_folders = sorted([(int(sim_iteration_regex_search.search(str(f))["iteration"]), f) for f in self.experiment_folder.glob("sim_*/results_from_time_0")])
         self.sim_folders:list[str] = [f[1] for f in sim_folders]
         self.sim_ids:list[int] = [f[0] for f in sim_folders]
         self.simulations = Experiment.Simulations(self)
@@ -65,12 +74,92 @@ class Experiment:
             case _:
                 raise IndexError
     
-    def for_timepoint(self, func:typing.Callable[[Experiment,int,int],None], start=0, stop=60000, step=600, maxproc=64, disable_tqdm=False):
-        N = len(list(range(start,stop,step)))
-        with multiprocessing.Pool(processes=min(multiprocessing.cpu_count()-1, maxproc)) as pool:
-            _=list(tqdm.tqdm(pool.imap(func, zip(itertools.repeat(self), range(start,stop,step), range(N))),
-                total=N, disable=disable_tqdm))
+    def shard(self, shard:sharding.Shard|str|None=None)->Experiment:
+        """
+        The experiment restricted to the simulations of one shard, balanced by the estimated cost of each simulation.
+        Every process computes the same assignment, see `sharding`.
+
+        Parameters
+        ----------
+        shard : Shard|str|None, optional (default None)
+            Shard, 'index/count', or None for the task of a SLURM array job
+        """
+        shard = sharding.parse_shard(shard)
+        keep = sharding.select(sharding.simulation_costs(self.sim_folders), shard)
+        experiment = copy.copy(self)
+        experiment.sim_folders = [self.sim_folders[i] for i in keep]
+        experiment.sim_ids = [self.sim_ids[i] for i in keep]
+        experiment.simulations = Experiment.Simulations(experiment)
+        return experiment
+
+    def build_timepoint_cache(self, maxproc=None, overwrite:bool=False, disable_tqdm=False)->int:
+        return timepoint_cache.convert_simulations(self.sim_folders, maxproc=maxproc, overwrite=overwrite, reader=Config.vtu_reader, disable_tqdm=disable_tqdm)
+
+    def build_manifest(self, disable_tqdm=False):
+        """
+        Scan every simulation into the experiment manifest, only rescanning simulations whose results folder has changed
+        """
+        for f in tqdm.tqdm(self.sim_folders, disable=disable_tqdm, desc='Building manifest'): manifest.simulation_entry(f)
+
+    def for_timepoint(self, func:typing.Callable[[Experiment,int,int],None], start=0, stop=60000, step=600, maxproc=None, disable_tqdm=False):
+        timesteps = list(range(start,stop,step))
+        with parallel.context_pool(self, func, maxproc=maxproc) as pool:
+            _=list(tqdm.tqdm(parallel.imap_timesteps(pool, timesteps, ordered=False),
+                total=len(timesteps), disable=disable_tqdm))
     
+    def schedule(self, jobs:typing.Callable|list[typing.Callable], start=0, stop=None, step=1, maxproc=None, shard:sharding.Shard|str|None=None,
+                 only:dict[int,set[int]]|None=None, disable_tqdm=False)->pd.DataFrame:
+        """
+        Call each job((sim, timepoint, frame_num)) on the timepoints of every simulation, with one pool for the whole experiment.
+        Tasks from all simulations are mixed and started most expensive first (by point count or file size), so workers stay
+        busy across simulations instead of idling while the last timepoints of each simulation finish.
+
+        Parameters
+        ----------
+        jobs : Callable|list[Callable]
+            Functions taking (sim, timepoint, frame_num), as for `Simulation.for_timepoint`. Jobs on the same timepoint share one read
+        start, stop, step : int, optional
+            Timepoints of each simulation processed, as `sim.timepoints[start:stop:step]`
+        maxproc : int|None, optional (default None)
+            Maximum number of processes to use, None for `Config.executor_max_workers` or one less than the CPU count
+        shard : Shard|str|None, optional (default None)
+            Only run this shard's share of the tasks ('index/count'), for array jobs
+        only : dict[int,set[int]]|None, optional (default None)
+            Only run these frame numbers of each simulation, keyed by index into `sim_folders`
+
+        Returns
+        -------
+        pd.DataFrame
+            One row per task with its results (one per job), estimated cost, time taken and worker.
+            `attrs` holds the wall time, tasks per second and worker utilisation
+        """
+        if callable(jobs): jobs = [jobs]
+        if shard is not None: shard = sharding.parse_shard(shard)
+        return scheduler.run(self.sim_folders, jobs, start=start, stop=stop, step=step, maxproc=maxproc, shard=shard, only=only,
+                             disable_tqdm=disable_tqdm, tqdm_kwargs=dict(desc=self.name))
+
+    def visualise(self, visualisers:list, start=0, stop=None, step=1, clean_dir=True, maxproc=None, shard:sharding.Shard|str|None=None,
+                  incremental:bool|None=None, disable_tqdm=False)->pd.DataFrame:
+        """
+        Render simulation visualisers for every simulation with `schedule`, rather than one pool per simulation and visualiser.
+        When rendering incrementally (default `Config.incremental_frames`) output folders are kept, and only the frames
+        each visualiser's journal does not show as up to date are rendered.
+        Shards split the timepoints of every simulation, so output folders are never cleaned when a shard is given
+        """
+        s = Simulation if Config.simulation_class is None else Config.simulation_class
+        incremental = all([v.set_incremental(incremental) for v in visualisers])
+        for v in visualisers: v.stale = dict() if incremental else None
+        only = dict() if incremental else None
+        for i, f in enumerate(self.sim_folders):
+            sim = s(f, lightweight=True)
+            for v in visualisers:
+                v.create_output_folder(sim, clean_dir=clean_dir and not incremental and shard is None)
+                if incremental:
+                    v.stale[str(sim.results_folder)] = v.frames_to_render(sim, start, stop, step)
+                    only[i] = only.get(i, set()) | v.stale[str(sim.results_folder)]
+        return self.schedule([v._visualise_frame for v in visualisers], start=start, stop=stop, step=step, maxproc=maxproc, shard=shard,
+                             only=only, disable_tqdm=disable_tqdm)
+
     def for_timepoint_single_thread(self, func:typing.Callable[[Experiment,int,int],None], start=0, stop=60000, step=600, disable_tqdm=False):
         N = len(list(range(start,stop,step)))
         _ = [func((self,tp, i)) for i, tp in tqdm.tqdm(enumerate(range(start,stop,step)), total=N, disable=disable_tqdm)]
@@ -93,6 +182,9 @@ def load_experiment(name:str, cls:typing.Type[Experiment]=Experiment):
                 return Experiment(Config.simulations_folder)
             if Config.simulations_folder.joinpath(name).exists():
                 return Experiment(Config.simulations_folder.joinpath(name))
+            if Config.use_manifest:
+                experiment_folder = manifest.find_experiment(Config.simulations_folder, name)
+                if experiment_folder is not None: return cls(experiment_folder)
             try:
                 glob = f'**/{name}'
                 results_folder = next(Config.simulations_folder.glob(glob))
@@ -42,7 +42,7 @@ class AbstractExperimentVisualiser:
             logging.error(f'Error processing frame #{args[1]}: {e}')
             raise e
 
-    def visualise(self, experiment:Experiment, start=0, stop=60000, step=600, clean_dir=True, maxproc=64, auto_execute=True, disable_tqdm=False):
+    def visualise(self, experiment:Experiment, start=0, stop=60000, step=600, clean_dir=True, maxproc=None, auto_execute=True, disable_tqdm=False):
         self.create_output_folder(experiment, clean_dir=clean_dir)
 
         experiment.for_timepoint(self._visualise_frame, start=start, stop=stop, step=step, maxproc=maxproc, disable_tqdm=disable_tqdm)
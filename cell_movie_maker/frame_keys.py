@@ -0,0 +1,89 @@
+import dataclasses
+import hashlib
+import json
+import os
+import pathlib
+import numpy as np
+
+
+def _stable(obj, seen:set):
+    """
+    Representation of obj which is the same in every process, unlike repr of objects which include their address
+    """
+    match obj:
+        case None | bool() | int() | float() | str() | bytes():
+            return repr(obj)
+        case pathlib.PurePath():
+            return f'Path({obj})'
+        case np.ndarray():
+            return f'ndarray({obj.dtype},{obj.shape},{hashlib.sha1(np.ascontiguousarray(obj).tobytes()).hexdigest()})'
+        case np.generic():
+            return repr(obj.item())
+    if id(obj) in seen: return '<cycle>'
+    seen = seen | {id(obj)}
+    match obj:
+        case dict():
+            return '{' + ','.join(sorted(f'{_stable(k, seen)}:{_stable(v, seen)}' for k, v in obj.items())) + '}'
+        case list() | tuple():
+            return f'{type(obj).__name__}(' + ','.join(_stable(v, seen) for v in obj) + ')'
+        case set() | frozenset():
+            return 'set(' + ','.join(sorted(_stable(v, seen) for v in obj)) + ')'
+        case type():
+            return f'{obj.__module__}.{obj.__qualname__}'
+    if dataclasses.is_dataclass(obj):
+        return f'{type(obj).__qualname__}(' + ','.join(f'{f.name}={_stable(getattr(obj, f.name), seen)}' for f in dataclasses.fields(obj)) + ')'
+    if callable(obj) and hasattr(obj, '__qualname__'):
+        owner = getattr(obj, '__self__', None)
+        return f'{getattr(obj, "__module__", "")}.{obj.__qualname__}' + ('' if owner is None or isinstance(owner, type) else f'@{type(owner).__qualname__}')
+    if hasattr(obj, '__dict__'):
+        return f'{type(obj).__qualname__}(' + _stable(vars(obj), seen) + ')'
+    return f'{type(obj).__qualname__}:{obj!r}'
+
+def stable_hash(obj, ignore:set[str]=frozenset())->str:
+    """
+    Hash of the class and attributes of obj, other than those in `ignore`, which is stable between runs and processes
+    """
+    state = {k:v for k,v in vars(obj).items() if k not in ignore}
+    return hashlib.sha1(f'{type(obj).__module__}.{type(obj).__qualname__}{_stable(state, set())}'.encode()).hexdigest()
+
+def source_key(path:str|pathlib.Path)->str:
+    """
+    Size and modification time of a source file, 'missing' if it does not exist
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return 'missing'
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+def frame_key(render_hash:str, results_file:str|pathlib.Path, timestep:int, frame_num:int)->str:
+    return hashlib.sha1(f'{render_hash}:{timestep}:{frame_num}:{source_key(results_file)}'.encode()).hexdigest()
+
+
+def read_journal(path:str|pathlib.Path)->dict[int,str]:
+    """
+    Key of each frame recorded in a journal, the last record of a frame wins. Unreadable lines are ignored
+    """
+    keys = dict()
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    keys[int(record['frame'])] = record['key']
+                except (ValueError, KeyError, TypeError):
+                    continue # Partially written by an interrupted run
+    except FileNotFoundError:
+        pass
+    return keys
+
+def append_journal(path:str|pathlib.Path, frame_num:int, key:str):
+    """
+    Record a rendered frame. Each record is a single short append, so workers can record frames concurrently
+    """
+    line = (json.dumps(dict(frame=frame_num, key=key)) + '\n').encode()
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
@@ -0,0 +1,257 @@
+from .vtu_reader import read_header, UnsupportedVTUError
+import logging
+import math
+import os
+import threading
+import time
+import re
+import json
+import pathlib
+
+
+manifest_version = 2
+results_file_regex = re.compile(r'^results_(\d+)\.vtu$')
+sim_folder_regex = re.compile(r'^sim_(?P<iteration>\d+)$')
+# A lookup which misses rebuilds the index only if it is older than this, and is not retried for this long
+miss_seconds = 60.
+
+# Manifests already read by this process, keyed by path, with the mtime of the file when it was read
+_loaded:dict[pathlib.Path,tuple[int,dict]] = dict()
+# Lookups which missed after the index was rebuilt, with the time of the miss
+_misses:dict[tuple,float] = dict()
+
+
+def manifest_file(experiment_folder:str|pathlib.Path)->pathlib.Path:
+    """
+    Manifest of an experiment, its list of simulations, written in the experiment folder next to the sim_* folders
+    """
+    return pathlib.Path(experiment_folder).joinpath('cmm_cache', 'manifest.json')
+
+def entry_file(results_folder:str|pathlib.Path)->pathlib.Path:
+    """
+    Manifest entry of a simulation, written in its own folder so simulations are recorded independently
+    """
+    return pathlib.Path(results_folder).parent.joinpath('cmm_cache', 'manifest.json')
+
+def index_file(simulations_folder:str|pathlib.Path)->pathlib.Path:
+    """
+    Index of every results folder below the simulations folder
+    """
+    return pathlib.Path(simulations_folder).joinpath('cmm_cache', 'index.json')
+
+def _mtime_ns(path:pathlib.Path)->int|None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+def _read(p:pathlib.Path)->dict|None:
+    mtime = _mtime_ns(p)
+    if mtime is None: return None
+    if p in _loaded and _loaded[p][0] == mtime: return _loaded[p][1]
+    try:
+        with open(p, 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get('version') != manifest_version: return None
+    _loaded[p] = (mtime, data)
+    return data
+
+def _write(p:pathlib.Path, data:dict)->bool:
+    """
+    Written to a temporary file and renamed so concurrent readers never see a partial file.
+    Read only and shared simulation trees are not written, their manifests are scanned again when needed
+
+    Returns
+    -------
+    bool
+        True if the file was written
+    """
+    tmp = p.with_name(f'.{p.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        p.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp, p)
+    except OSError as e:
+        logging.debug(f"Unable to write {p}: {e}")
+        try:
+            tmp.unlink(missing_ok=True)
+        except OSError:
+            pass
+        return False
+    _loaded[p] = (_mtime_ns(p), data)
+    return True
+
+
+def scan_results_folder(results_folder:str|pathlib.Path, previous:dict|None=None)->dict:
+    """
+    Record the results files of a simulation.
+    Point counts and array names are only read from files which are new or whose size or mtime has changed since `previous`.
+
+    Parameters
+    ----------
+    results_folder : str, pathlib.Path
+        `results_from_time_0` folder of the simulation
+    previous : dict|None, optional (default None)
+        Earlier entry for the same folder
+
+    Returns
+    -------
+    dict
+        Entry with the folder mtime and, per timestep in ascending order, file size, mtime, point count and index into `point_arrays`
+    """
+    results_folder = pathlib.Path(results_folder)
+    mtime = _mtime_ns(results_folder)
+    known = dict()
+    if previous is not None:
+        for i,t in enumerate(previous['timesteps']):
+            known[t] = (previous['size'][i], previous['mtime_ns'][i], previous['n_points'][i], previous['point_arrays'][previous['point_arrays_index'][i]])
+
+    timesteps = sorted(int(m[1]) for m in map(results_file_regex.match, os.listdir(results_folder)) if m)
+    entry = dict(folder_mtime_ns=mtime, timesteps=timesteps, size=[], mtime_ns=[], n_points=[], point_arrays=[], point_arrays_index=[])
+    for t in timesteps:
+        stat = os.stat(results_folder.joinpath(f'results_{t}.vtu'))
+        if t in known and known[t][:2] == (stat.st_size, stat.st_mtime_ns):
+            n_points, names = known[t][2:]
+        else:
+            try:
+                n_points, names = read_header(results_folder.joinpath(f'results_{t}.vtu'))
+            except (UnsupportedVTUError, ValueError, TypeError):
+                n_points, names = None, []
+        if names not in entry['point_arrays']: entry['point_arrays'].append(names)
+        entry['size'].append(stat.st_size)
+        entry['mtime_ns'].append(stat.st_mtime_ns)
+        entry['n_points'].append(n_points)
+        entry['point_arrays_index'].append(entry['point_arrays'].index(names))
+    return entry
+
+
+def load_manifest(experiment_folder:str|pathlib.Path)->dict:
+    """
+    Read the manifest of an experiment, refreshing its list of simulations if the experiment folder has changed.
+    Simulation entries are kept in each simulation's folder, see `simulation_entry`.
+    """
+    experiment_folder = pathlib.Path(experiment_folder)
+    p = manifest_file(experiment_folder)
+    try:
+        p.parent.mkdir(exist_ok=True) # Create before reading the folder mtime, creating it later would change the mtime
+    except OSError:
+        pass
+    data = _read(p)
+    if data is None: data = dict(version=manifest_version, folder_mtime_ns=None, sims=[], pending=[])
+
+    mtime = _mtime_ns(experiment_folder)
+    changed = data['folder_mtime_ns'] != mtime
+    if changed:
+        data = dict(data, folder_mtime_ns=mtime, sims=[],
+                    pending=sorted(f.name for f in os.scandir(experiment_folder) if f.is_dir() and sim_folder_regex.match(f.name)))
+    # Simulation folders are created before their results folders, so keep checking until they appear
+    ready = [sim for sim in data['pending'] if experiment_folder.joinpath(sim, 'results_from_time_0').is_dir()]
+    if ready:
+        data = dict(data, sims=sorted(data['sims'] + ready), pending=[sim for sim in data['pending'] if sim not in ready])
+        changed = True
+    # Concurrent writers compute the same list from the folder, so the last to write loses nothing
+    if changed: _write(p, data)
+    return data
+
+def simulation_folders(experiment_folder:str|pathlib.Path)->list[tuple[int,pathlib.Path]]:
+    """
+    (iteration, results folder) of every simulation in an experiment, sorted by iteration
+    """
+    experiment_folder = pathlib.Path(experiment_folder)
+    sims = load_manifest(experiment_folder)['sims']
+    return sorted((int(sim_folder_regex.match(sim)['iteration']), experiment_folder.joinpath(sim, 'results_from_time_0')) for sim in sims)
+
+def simulation_entry(results_folder:str|pathlib.Path)->dict:
+    """
+    Manifest entry for a simulation, rescanning its results folder only if the folder mtime has changed.
+    Each entry is its own file, replaced atomically, so workers recording different simulations do not interfere.
+
+    Parameters
+    ----------
+    results_folder : str, pathlib.Path
+        `results_from_time_0` folder of the simulation
+
+    Returns
+    -------
+    dict
+        See `scan_results_folder`
+    """
+    results_folder = pathlib.Path(results_folder)
+    p = entry_file(results_folder)
+    data = _read(p)
+    entry = None if data is None else data['entry']
+    if entry is not None and entry['folder_mtime_ns'] == _mtime_ns(results_folder): return entry
+    entry = scan_results_folder(results_folder, previous=entry)
+    _write(p, dict(version=manifest_version, entry=entry))
+    return entry
+
+
+def build_index(simulations_folder:str|pathlib.Path)->list[str]:
+    """
+    Walk the simulations folder for results folders and write the index.
+    Only needed when a lookup misses, or to build the index up front.
+
+    Returns
+    -------
+    list[str]
+        Results folders relative to the simulations folder
+    """
+    simulations_folder = pathlib.Path(simulations_folder)
+    results_folders = []
+    for root, dirs, _ in os.walk(simulations_folder):
+        if 'results_from_time_0' in dirs:
+            results_folders.append(os.path.relpath(os.path.join(root, 'results_from_time_0'), simulations_folder))
+        dirs[:] = sorted(d for d in dirs if d not in ('results_from_time_0', 'cmm_cache'))
+    if not _write(index_file(simulations_folder), dict(version=manifest_version, results_folders=results_folders)):
+        _loaded[index_file(simulations_folder)] = (time.time_ns(), dict(version=manifest_version, results_folders=results_folders))
+    return results_folders
+
+def _find(simulations_folder:pathlib.Path, key:tuple, match)->pathlib.Path|None:
+    def search(results_folders):
+        for f in results_folders:
+            if match(pathlib.PurePath(f)) and simulations_folder.joinpath(f).is_dir(): return simulations_folder.joinpath(f)
+
+    p = index_file(simulations_folder)
+    data = _read(p)
+    if data is None and p in _loaded: data = _loaded[p][1] # Index of a read only tree, kept in memory
+    found = None if data is None else search(data['results_folders'])
+    if found is not None: return found
+
+    key = (simulations_folder, *key)
+    now = time.time()
+    if now - _misses.get(key, -math.inf) < miss_seconds: return None
+    built = _loaded[p][0] if p in _loaded else _mtime_ns(p)
+    # A recent index is not rebuilt, so a burst of lookups for missing simulations walks the tree at most once
+    if data is None or built is None or now - built/1e9 >= miss_seconds:
+        found = search(build_index(simulations_folder))
+    if found is None: _misses[key] = now
+    return found
+
+def find_simulation(simulations_folder:str|pathlib.Path, *parents:str)->pathlib.Path|None:
+    """
+    Find a results folder whose parent folders end with `parents`, e.g. ('experiment', 'sim_0') or ('sim_0',).
+    The index is rebuilt if there is no match and it is older than `miss_seconds`, so simulations added since it was
+    written are still found.
+
+    Returns
+    -------
+    pathlib.Path|None
+        Results folder, or None if there is no match
+    """
+    return _find(pathlib.Path(simulations_folder), ('simulation', *parents), lambda f: f.parent.parts[-len(parents):] == parents)
+
+def find_experiment(simulations_folder:str|pathlib.Path, name:str)->pathlib.Path|None:
+    """
+    Find an experiment folder, a folder called `name` containing simulation folders.
+    The index is rebuilt if there is no match, as for `find_simulation`.
+
+    Returns
+    -------
+    pathlib.Path|None
+        Experiment folder, or None if there is no match
+    """
+    results_folder = _find(pathlib.Path(simulations_folder), ('experiment', name), lambda f: f.parent.parent.name == name)
+    return None if results_folder is None else results_folder.parent.parent
@@ -1,6 +1,6 @@
 import pathlib
 import cell_movie_maker.svg
-import multiprocessing
+from .. import parallel
 import matplotlib.pylab as plt
 import tqdm
 import re
@@ -73,8 +73,8 @@ class AbstractMultisimStitcher:
         else: stop = min(max_n, stop)
         
         if maxproc > 1:
-            with multiprocessing.Pool(processes=min(multiprocessing.cpu_count()-1, maxproc)) as pool:
-                _=list(tqdm.tqdm(pool.imap(self.process_frame, range(start, stop, step)),
+            with parallel.Executor(parallel.n_processes(maxproc)) as pool:
+                _=list(tqdm.tqdm(pool.map(self.process_frame, range(start, stop, step), ordered=False),
                                  total=(stop-start)//step, disable=disable_tqdm))
         else:
             for i in tqdm.tqdm(range(start, stop, step), total=(stop-start)//step):
@@ -0,0 +1,242 @@
+import collections
+import concurrent.futures
+import functools
+import itertools
+import multiprocessing
+import multiprocessing.pool
+import threading
+import typing
+from .config import Config
+
+
+backends = ('serial', 'thread', 'process', 'loky')
+
+# State installed in each worker by `_initialise_worker`, keyed by the token of the `context_pool` that installed it,
+# so serial and thread pools in the same process do not overwrite each other
+_worker_state = dict()
+_tokens = itertools.count()
+
+def _initialise_worker(token:int, context, func:typing.Callable):
+    _worker_state[token] = (context, func)
+
+def _call_with_timepoint(args:tuple[int,int,int]):
+    token, timestep, i = args
+    sim, func = _worker_state[token]
+    return func((sim, sim.read_timepoint(timestep), i))
+
+def _call_with_timestep(args:tuple[int,int,int]):
+    token, timestep, i = args
+    context, func = _worker_state[token]
+    return func((context, timestep, i))
+
+def _call_chunk(func:typing.Callable, chunk:list)->list:
+    return [func(item) for item in chunk]
+
+def _chunks(iterable:typing.Iterable, n:int)->typing.Iterator[list]:
+    it = iter(iterable)
+    while chunk := list(itertools.islice(it, n)):
+        yield chunk
+
+
+def n_processes(maxproc:int|None)->int|None:
+    """
+    Workers for a loop allowed maxproc processes, at most one less than the CPU count. None is passed through, so the
+    executor uses `Config.executor_max_workers`
+    """
+    if maxproc is None: return None
+    return max(1, min(multiprocessing.cpu_count()-1, maxproc))
+
+
+class Executor:
+    """
+    Runs the parallel loops of the package on a configurable backend.
+    Options a loop does not pass (None) are taken from the `Config.executor_*` settings when they are set, so throughput
+    can be tuned once for a machine without changing loops which chose an option on purpose.
+
+    Backends are 'serial' (in this process, useful for debugging and profiling), 'thread', 'process' (multiprocessing,
+    with the 'fork', 'spawn' or 'forkserver' start method) and 'loky' (joblib's reusable process pool, needs joblib).
+
+    Parameters
+    ----------
+    max_workers : int|None, optional (default None)
+        Number of workers, None for `Config.executor_max_workers` or one less than the CPU count
+    backend : str|None, optional (default None)
+        One of `backends`, None for `Config.executor_backend` or 'process'
+    start_method : str|None, optional (default None)
+        Start method of the process backend, None for `Config.executor_start_method` or the platform default
+    chunksize : int|None, optional (default None)
+        Tasks sent to a worker at a time, None for `Config.executor_chunksize` or 1
+    maxtasksperchild : int|None, optional (default None)
+        Restart process workers after this many chunks, None for `Config.executor_maxtasksperchild` or to keep workers
+        for the whole loop. Not supported by loky
+    initializer : Callable|None, optional (default None)
+        Called with `initargs` once in each worker before it runs any task
+    """
+    def __init__(self, max_workers:int|None=None, backend:str|None=None, start_method:str|None=None, chunksize:int|None=None,
+                 maxtasksperchild:int|None=None, initializer:typing.Callable|None=None, initargs:tuple=()):
+        def option(value, setting, default):
+            return value if value is not None else setting if setting is not None else default
+        self.backend = option(backend, Config.executor_backend, 'process')
+        if self.backend not in backends: raise ValueError(f'Unknown executor backend {self.backend!r}, expected one of {backends}')
+        self.start_method = option(start_method, Config.executor_start_method, None)
+        self.max_workers = max(1, option(max_workers, Config.executor_max_workers, multiprocessing.cpu_count()-1))
+        self.chunksize = max(1, option(chunksize, Config.executor_chunksize, 1))
+        self.maxtasksperchild = option(maxtasksperchild, Config.executor_maxtasksperchild, None)
+        self.cancelled = threading.Event()
+        self._closers:list[typing.Callable[[],None]] = []
+
+        match self.backend:
+            case 'serial':
+                self._pool = None
+                if initializer is not None: initializer(*initargs)
+            case 'thread':
+                self._pool = concurrent.futures.ThreadPoolExecutor(self.max_workers, thread_name_prefix='cmm-executor', initializer=initializer, initargs=initargs)
+            case 'process':
+                context = multiprocessing.get_context(self.start_method)
+                self.start_method = context.get_start_method()
+                self._pool = context.Pool(self.max_workers, initializer=initializer, initargs=initargs, maxtasksperchild=self.maxtasksperchild)
+            case 'loky':
+                try:
+                    from joblib.externals import loky
+                except ImportError as e:
+                    raise ImportError("The loky executor backend requires joblib, install it with `pip install joblib`") from e
+                self._pool = loky.get_reusable_executor(self.max_workers, initializer=initializer, initargs=initargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None: self.cancel()
+        self.close()
+
+    def map(self, func:typing.Callable, iterable:typing.Iterable, ordered:bool=True)->typing.Iterator:
+        """
+        Iterate over func(item) for each item, computed by the workers
+
+        Parameters
+        ----------
+        func : Callable
+            Function of one argument, must be picklable for the process and loky backends
+        iterable : Iterable
+            Arguments
+        ordered : bool, optional (default True)
+            Yield results in the order of `iterable`, otherwise as soon as each is ready
+
+        Raises
+        ------
+        concurrent.futures.CancelledError
+            When the executor is cancelled while results are still pending
+        """
+        match self.backend:
+            case 'serial':
+                return self._map_serial(func, iterable)
+            case 'process':
+                return self._map_pool(func, iterable, ordered)
+            case _:
+                return self._map_futures(func, iterable, ordered)
+
+    def _check_cancelled(self):
+        if self.cancelled.is_set(): raise concurrent.futures.CancelledError()
+
+    def _map_serial(self, func, iterable):
+        for item in iterable:
+            self._check_cancelled()
+            yield func(item)
+
+    def _map_pool(self, func, iterable, ordered):
+        # Chunks are formed here rather than by imap, whose chunked iterator cannot be polled with a timeout
+        it = (self._pool.imap if ordered else self._pool.imap_unordered)(functools.partial(_call_chunk, func), _chunks(iterable, self.chunksize))
+        while True:
+            # Poll so a cancel from another thread is noticed while waiting for a result
+            try:
+                chunk = it.next(timeout=0.1)
+            except StopIteration:
+                return
+            except multiprocessing.TimeoutError:
+                self._check_cancelled()
+                continue
+            yield from chunk
+
+    def _map_futures(self, func, iterable, ordered):
+        # A bounded window of chunks is in flight, refilled as chunks complete, so tasks are only produced as workers need them
+        chunks = _chunks(iterable, self.chunksize)
+        pending = collections.deque()
+        def refill():
+            for c in itertools.islice(chunks, max(0, 2*self.max_workers - len(pending))):
+                pending.append(self._pool.submit(_call_chunk, func, c))
+        try:
+            refill()
+            while pending:
+                if ordered:
+                    done = [pending[0]] if concurrent.futures.wait([pending[0]], timeout=0.1).done else []
+                else:
+                    done = list(concurrent.futures.wait(pending, timeout=0.1, return_when=concurrent.futures.FIRST_COMPLETED).done)
+                self._check_cancelled()
+                for f in done:
+                    pending.remove(f)
+                    refill()
+                    yield from f.result()
+        finally:
+            for f in pending: f.cancel()
+
+    def cancel(self):
+        """
+        Stop the loop, tasks not yet started are dropped and `map` raises CancelledError. Safe to call from another thread
+        """
+        self.cancelled.set()
+        match self.backend:
+            case 'thread':
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            case 'process':
+                self._pool.terminate()
+            case 'loky':
+                self._pool.shutdown(wait=False, kill_workers=True)
+
+    def close(self):
+        match self.backend:
+            case 'thread':
+                self._pool.shutdown(wait=True)
+            case 'process':
+                if self.cancelled.is_set(): self._pool.terminate()
+                else: self._pool.close()
+                self._pool.join()
+            # loky executors are reused by later loops
+        for closer in self._closers: closer()
+
+
+def context_pool(context, func:typing.Callable, maxproc:int|None=None, **kwargs)->Executor:
+    """
+    Executor whose workers receive `context` (a Simulation or Experiment) and `func` once, when they start.
+    Tasks submitted with `imap_timepoints` or `imap_timesteps` then only carry (timestep, frame_num).
+
+    Parameters
+    ----------
+    context : Simulation|Experiment
+        Object passed as the first element of every call to func
+    func : Callable
+        Function called by each task
+    maxproc : int|None, optional (default None)
+        Maximum number of processes to use, None for the executor's default
+    **kwargs
+        Passed to `Executor`
+    """
+    token = next(_tokens)
+    executor = Executor(n_processes(maxproc), initializer=_initialise_worker, initargs=(token, context, func), **kwargs)
+    executor.token = token
+    # Serial and thread workers share this process's state
+    executor._closers.append(lambda: _worker_state.pop(token, None))
+    return executor
+
+def imap_timepoints(executor:Executor, timesteps:list[int], ordered:bool=True, frame_nums:list[int]|None=None):
+    """
+    Call func((sim, sim.read_timepoint(timestep), frame_num)) in the workers of a `context_pool`.
+    Frames are numbered from 0 unless `frame_nums` are given
+    """
+    if frame_nums is None: frame_nums = range(len(timesteps))
+    return executor.map(_call_with_timepoint, zip(itertools.repeat(executor.token), timesteps, frame_nums), ordered=ordered)
+
+def imap_timesteps(executor:Executor, timesteps:list[int], ordered:bool=True):
+    """
+    Call func((context, timestep, frame_num)) in the workers of a `context_pool`
+    """
+    return executor.map(_call_with_timestep, zip(itertools.repeat(executor.token), timesteps, range(len(timesteps))), ordered=ordered)
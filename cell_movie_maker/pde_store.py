@@ -0,0 +1,187 @@
+from .vtu_reader import read_vtu
+import os
+import contextlib
+import re
+import json
+import time
+import pathlib
+import threading
+import numpy as np
+import pandas as pd
+
+
+store_version = 1
+stale_lock_seconds = 600
+
+
+def store_folder(results_folder:str|pathlib.Path)->pathlib.Path:
+    """
+    Folder holding stacked PDE fields for a simulation, written next to `results_from_time_0`
+    """
+    return pathlib.Path(results_folder).parent.joinpath('cmm_cache', 'pde')
+
+def store_file(results_folder:str|pathlib.Path, file:str, chemokine:str)->pathlib.Path:
+    return store_folder(results_folder).joinpath(f'{file}.{chemokine}.npy')
+
+def _mtime_ns(path:pathlib.Path)->int|None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def is_current(results_folder:str|pathlib.Path, file:str, chemokine:str)->bool:
+    """
+    Whether a store exists and was built after the last change to the results folder
+    """
+    p = store_file(results_folder, file, chemokine)
+    try:
+        with open(p.with_suffix('.json'), 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return index.get('version') == store_version and index.get('folder_mtime_ns') == _mtime_ns(pathlib.Path(results_folder)) and p.exists()
+
+
+class PDEStore:
+    """
+    Every timestep of one PDE field stacked into a single (T, ny, nx) array, memory mapped from `cmm_cache/pde`.
+    Built from the `pde_results_<file>_<timestep>.vtu` files the first time it is opened, and rebuilt when the results
+    folder changes.
+
+    Attributes
+    ----------
+    results_folder : pathlib.Path
+        `results_from_time_0` folder of the simulation
+    file : str
+        PDE file name, as in `pde_results_<file>_<timestep>.vtu`
+    chemokine : str
+        Point data array within the file
+    timesteps : np.ndarray
+        Timesteps in the store, ascending
+    fields : np.ndarray
+        Read only (T, ny, nx) memory mapped array of field values
+    """
+    def __init__(self, results_folder:str|pathlib.Path, file:str, chemokine:str|None=None, reader:str='vtk'):
+        self.results_folder = pathlib.Path(results_folder)
+        self.file = file
+        self.chemokine = file if chemokine is None else chemokine
+        self.reader = reader
+        self._open()
+
+    @property
+    def path(self)->pathlib.Path:
+        return store_file(self.results_folder, self.file, self.chemokine)
+
+    @property
+    def index_path(self)->pathlib.Path:
+        return self.path.with_suffix('.json')
+
+    def __getstate__(self):
+        # Reopen the memory map rather than pickling the fields
+        return dict(results_folder=self.results_folder, file=self.file, chemokine=self.chemokine, reader=self.reader)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def _open(self):
+        if not is_current(self.results_folder, self.file, self.chemokine): self.build()
+        with open(self.index_path, 'r') as f:
+            index = json.load(f)
+        self.timesteps:np.ndarray = np.array(index['timesteps'], dtype=int)
+        self.fields:np.ndarray = np.load(self.path, mmap_mode='r')
+        self._index:dict[int,int] = {t:i for i,t in enumerate(index['timesteps'])}
+
+    def source_timesteps(self)->list[int]:
+        p = re.compile(rf'^pde_results_{re.escape(self.file)}_(\d+)\.vtu$')
+        return sorted(int(m[1]) for m in map(p.match, os.listdir(self.results_folder)) if m)
+
+    def build(self):
+        """
+        Read every timestep of the field and write the stacked array and its timestep index.
+        Written to temporary files and renamed so concurrent readers never see a partial store.
+        """
+        folder_mtime = _mtime_ns(self.results_folder)
+        timesteps, fields = [], None
+        candidates = self.source_timesteps()
+        for t in candidates:
+            output = read_vtu(self.results_folder.joinpath(f'pde_results_{self.file}_{t}.vtu'), reader=self.reader, lazy=True)
+            if output is None: continue
+            n = int(np.sqrt(output.GetNumberOfPoints()))
+            values = output.PointData[self.chemokine].reshape((n, n))
+            if fields is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.path.with_name(f'.{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+                fields = np.lib.format.open_memmap(tmp, mode='w+', dtype=values.dtype, shape=(len(candidates), n, n))
+            if values.shape != fields.shape[1:]:
+                raise ValueError(f'{self.file} {self.chemokine} changes shape from {fields.shape[1:]} to {values.shape} at timestep {t}')
+            fields[len(timesteps)] = values
+            timesteps.append(t)
+        if fields is None: raise FileNotFoundError(f'No pde_results_{self.file}_*.vtu files in {self.results_folder}')
+
+        # Drop the slots of files which could not be read
+        if len(timesteps) < len(candidates):
+            trimmed = np.lib.format.open_memmap(str(tmp)+'.trim', mode='w+', dtype=fields.dtype, shape=(len(timesteps),)+fields.shape[1:])
+            trimmed[:] = fields[:len(timesteps)]
+            trimmed.flush()
+            del fields
+            os.replace(str(tmp)+'.trim', tmp)
+        else:
+            fields.flush()
+            del fields
+        os.replace(tmp, self.path)
+
+        tmp = self.index_path.with_name(f'.{self.index_path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(dict(version=store_version, folder_mtime_ns=folder_mtime, timesteps=timesteps), f)
+        os.replace(tmp, self.index_path)
+
+    def __contains__(self, timestep:int)->bool:
+        return timestep in self._index
+
+    def __getitem__(self, timestep:int)->np.ndarray:
+        """
+        Read only (ny, nx) view of the field at timestep
+        """
+        return self.fields[self._index[timestep]]
+
+    def __len__(self)->int:
+        return len(self.timesteps)
+
+    def global_max(self)->float:
+        return float(np.nanmax(self.fields))
+
+    def global_min(self)->float:
+        return float(np.nanmin(self.fields))
+
+    def means(self)->pd.Series:
+        """
+        Mean of the field at each timestep
+        """
+        return pd.Series(np.nanmean(self.fields.reshape(len(self.timesteps), -1), axis=1), index=pd.Index(self.timesteps, name='timestep'), name=self.chemokine)
+
+
+def open_store(results_folder:str|pathlib.Path, file:str, chemokine:str|None=None, reader:str='vtk')->PDEStore|None:
+    """
+    Open a PDE store, building it if needed.
+    Returns None while another process is building the same store, so callers can read the .vtu file directly instead
+    of every worker of a pool building it at once.
+    """
+    if chemokine is None: chemokine = file
+    if is_current(results_folder, file, chemokine): return PDEStore(results_folder, file, chemokine, reader=reader)
+
+    lock = store_file(results_folder, file, chemokine).with_suffix('.lock')
+    lock.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        mtime = _mtime_ns(lock)
+        if mtime is not None and time.time() - mtime/1e9 < stale_lock_seconds: return None
+        # Left behind by a process which stopped while building
+        with contextlib.suppress(FileNotFoundError): os.remove(lock)
+        return open_store(results_folder, file, chemokine, reader=reader)
+    try:
+        os.close(fd)
+        return PDEStore(results_folder, file, chemokine, reader=reader)
+    finally:
+        os.remove(lock)
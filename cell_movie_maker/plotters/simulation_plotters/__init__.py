@@ -0,0 +1 @@
+from .kymograph_plotter import KymographPlotter
@@ -0,0 +1,30 @@
+import numpy as np
+import matplotlib
+import matplotlib.pyplot as plt
+import dataclasses
+
+
+class KymographPlotter:
+    """
+    Position against time image of a 1D simulation, drawn from `Simulation1D.kymograph` in place of per-timepoint frames
+    """
+    @dataclasses.dataclass
+    class Config:
+        quantity:str='pressure'
+        bins:int=200
+        cmap:str|matplotlib.colors.LinearSegmentedColormap='cividis'
+        vmin:float|None=None
+        vmax:float|None=None
+        xlim:tuple[float]=None
+        draw_colorbar:bool=True
+
+    def plot(fig:plt.Figure, ax:plt.Axes, sim, *, config:Config=None):
+        if config is None: config = KymographPlotter.Config()
+        image, times, edges = sim.kymograph(config.quantity, bins=config.bins, xlim=config.xlim)
+
+        cm = ax.imshow(image, origin='lower', aspect='auto', interpolation='nearest', cmap=config.cmap, vmin=config.vmin, vmax=config.vmax,
+                       extent=(edges[0], edges[-1], times.min(initial=0), times.max(initial=0)))
+        ax.set_title(f'{sim.name}/{sim.id} {config.quantity.capitalize()}')
+        ax.set_xlabel('Position')
+        ax.set_ylabel('Time')
+        if config.draw_colorbar: fig.colorbar(cm, ax=ax, label=config.quantity)
@@ -0,0 +1,64 @@
+import collections
+import concurrent.futures
+import typing
+
+
+_end = object()
+
+def timepoint_bytes(tp)->int:
+    return 0 if tp is None else tp.memory_usage()
+
+def prefetch(read:typing.Callable[[typing.Any],typing.Any], keys:typing.Iterable, depth:int=2, max_bytes:int|None=None,
+             size:typing.Callable[[typing.Any],int]=timepoint_bytes)->typing.Iterator:
+    """
+    Iterate over read(key) for each key in order, reading up to `depth` keys ahead on background threads.
+    Reading (mostly file IO and decompression, which release the GIL) then overlaps with processing the current item.
+
+    Parameters
+    ----------
+    read : Callable
+        Function reading one item, e.g. `Simulation.read_timepoint`
+    keys : Iterable
+        Keys to read, in order
+    depth : int, optional (default 2)
+        Maximum number of items read ahead. 0 reads each item when it is requested, without threads
+    max_bytes : int|None, optional (default None)
+        Stop reading ahead while the items read but not yet consumed use at least this much memory
+    size : Callable, optional
+        Memory used by an item, defaults to the DataFrame memory of a timepoint
+
+    Yields
+    ------
+    Any
+        read(key) for each key, exceptions raised by read are raised when their item is reached
+    """
+    if depth <= 0:
+        yield from map(read, keys)
+        return
+
+    keys = iter(keys)
+    pending:collections.deque[concurrent.futures.Future] = collections.deque()
+    sizes:dict[concurrent.futures.Future,int] = dict()
+
+    def buffered_bytes()->int:
+        for f in pending:
+            if f not in sizes and f.done() and f.exception() is None: sizes[f] = size(f.result())
+        return sum(sizes.values())
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=depth, thread_name_prefix='cmm-prefetch')
+    try:
+        def fill():
+            while len(pending) < depth and (len(pending) == 0 or max_bytes is None or buffered_bytes() < max_bytes):
+                key = next(keys, _end)
+                if key is _end: return
+                pending.append(executor.submit(read, key))
+
+        fill()
+        while pending:
+            f = pending.popleft()
+            sizes.pop(f, None)
+            item = f.result()
+            fill()
+            yield item
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -25,8 +25,8 @@ class AbstractPreprocessor:
 
     def _process_internal(self, sim, start=0, stop=None, step=1, disable_tqdm=False):
         data = pd.DataFrame(columns=['timestep'] + [a.name for a in self.analysers], dtype=int).set_index('timestep')
-        for t in tqdm.tqdm(sim.results_timesteps[start:stop:step], disable=disable_tqdm):
-            tp = sim.read_timepoint(t)
+        timesteps = sim.results_timesteps[start:stop:step]
+        for t, tp in tqdm.tqdm(zip(timesteps, sim.prefetch_timepoints(timesteps)), total=len(timesteps), disable=disable_tqdm):
             if not tp.ok: continue
             data.loc[t] = [analyser.analyse(tp, sim) for analyser in self.analysers]
         data.to_csv(self.output_folder.joinpath(sim.name, self.name, f'{sim.id}.csv'))
@@ -0,0 +1,146 @@
+from __future__ import annotations
+import collections
+import logging
+import os
+import pathlib
+import re
+import threading
+import time
+import typing
+import pandas as pd
+import tqdm
+from .config import Config
+from . import manifest
+from . import parallel
+from . import sharding
+
+
+results_file_regex = re.compile(r'^results_(\d+)\.vtu$')
+
+
+class Task(typing.NamedTuple):
+    sim:int # Index into the experiment's sim_folders
+    timestep:int
+    frame_num:int
+    cost:float
+
+
+class ScheduleContext:
+    """
+    Sent to each worker once, holds the jobs and opens each simulation the first time one of its timepoints is processed.
+    Workers keep the most recently used simulations open, so consecutive tasks of one simulation do not re-read its folder.
+    """
+    def __init__(self, sim_folders:list[pathlib.Path], jobs:list[typing.Callable], simulation_class:type, max_open:int=8):
+        self.sim_folders = sim_folders
+        self.jobs = jobs
+        self.simulation_class = simulation_class
+        self.max_open = max_open
+        self._open = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_open=collections.OrderedDict())
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def simulation(self, i:int):
+        with self._lock:
+            if i in self._open:
+                self._open.move_to_end(i)
+                return self._open[i]
+        sim = self.simulation_class(self.sim_folders[i])
+        with self._lock:
+            self._open[i] = sim
+            while len(self._open) > self.max_open: self._open.popitem(last=False)
+        return sim
+
+
+def _run_task(args:tuple[int,int,int,int]):
+    token, i, timestep, frame_num = args
+    context, _ = parallel._worker_state[token]
+    t0 = time.perf_counter()
+    sim = context.simulation(i)
+    tp = sim.read_timepoint(timestep)
+    # Every job shares one read of the timepoint
+    results = [job((sim, tp, frame_num)) for job in context.jobs]
+    return i, timestep, time.perf_counter()-t0, os.getpid(), results
+
+
+def estimate_costs(results_folder:pathlib.Path)->tuple[list[int],list[float]]:
+    """
+    Timesteps of a simulation and the estimated cost of processing each, the point count from the manifest when
+    `Config.use_manifest` is set, otherwise the size of the results file
+    """
+    if Config.use_manifest:
+        entry = manifest.simulation_entry(results_folder)
+        return list(entry['timesteps']), [float(n if n is not None else s) for n, s in zip(entry['n_points'], entry['size'])]
+    timesteps, costs = [], []
+    for f in os.scandir(results_folder):
+        m = results_file_regex.match(f.name)
+        if m:
+            timesteps.append(int(m[1]))
+            costs.append(float(f.stat().st_size))
+    order = sorted(range(len(timesteps)), key=timesteps.__getitem__)
+    return [timesteps[i] for i in order], [costs[i] for i in order]
+
+def plan(sim_folders:list[pathlib.Path], start=0, stop=None, step=1, shard:sharding.Shard|None=None,
+         only:dict[int,set[int]]|None=None)->list[Task]:
+    """
+    Every (simulation, timestep) task of an experiment, grouped by simulation, most expensive first.
+    Timesteps are selected per simulation as `sim.timepoints[start:stop:step]`, and numbered in that order.
+    Simulations are ordered by their total cost and the tasks of each by cost, so the longest tasks start first and the
+    run ends with a tail of small timepoints, while workers move through the simulations together and each only keeps
+    a few open (see `ScheduleContext`) instead of reopening a simulation for almost every task.
+    If a shard is given, only its share of the tasks, balanced by cost, see `sharding.balance`.
+    If `only` is given, only the frame numbers it lists for each simulation index. It is applied after sharding, so every
+    shard splits the same task list whatever each has left to do.
+    """
+    tasks = []
+    for i, f in enumerate(sim_folders):
+        timesteps, costs = estimate_costs(pathlib.Path(f))
+        selected = list(range(len(timesteps)))[start:stop:step]
+        tasks.extend(Task(i, timesteps[j], frame_num, costs[j]) for frame_num, j in enumerate(selected))
+    if shard is not None:
+        tasks = [tasks[i] for i in sharding.select([t.cost for t in tasks], shard)]
+    if only is not None:
+        tasks = [t for t in tasks if t.frame_num in only.get(t.sim, ())]
+    by_sim = collections.defaultdict(list)
+    for t in tasks: by_sim[t.sim].append(t)
+    blocks = sorted(by_sim.values(), key=lambda block: (-sum(t.cost for t in block), block[0].sim))
+    return [t for block in blocks for t in sorted(block, key=lambda t: t.cost, reverse=True)]
+
+def run(sim_folders:list[pathlib.Path], jobs:list[typing.Callable], start=0, stop=None, step=1, maxproc=None,
+        simulation_class:type|None=None, shard:sharding.Shard|None=None, only:dict[int,set[int]]|None=None, disable_tqdm=False,
+        tqdm_kwargs=dict())->pd.DataFrame:
+    """
+    Run jobs on every timepoint of many simulations with a single pool, see `Experiment.schedule`
+    """
+    if simulation_class is None:
+        from .simulation import Simulation
+        simulation_class = Simulation if Config.simulation_class is None else Config.simulation_class
+    tasks = plan(sim_folders, start=start, stop=stop, step=step, shard=shard, only=only)
+    context = ScheduleContext(list(sim_folders), list(jobs), simulation_class)
+
+    records = []
+    t0 = time.perf_counter()
+    with parallel.context_pool(context, None, maxproc=maxproc) as pool:
+        n_workers = pool.max_workers
+        for r in tqdm.tqdm(pool.map(_run_task, ((pool.token, t.sim, t.timestep, t.frame_num) for t in tasks), ordered=False),
+                           total=len(tasks), disable=disable_tqdm, unit='task', **tqdm_kwargs):
+            records.append(r)
+    wall = time.perf_counter() - t0
+
+    costs = {(t.sim, t.timestep): (t.frame_num, t.cost) for t in tasks}
+    report = pd.DataFrame([dict(sim=sim_folders[i], timestep=timestep, frame_num=costs[(i, timestep)][0], cost=costs[(i, timestep)][1],
+                                seconds=seconds, pid=pid, results=results) for i, timestep, seconds, pid, results in records],
+                          columns=['sim', 'timestep', 'frame_num', 'cost', 'seconds', 'pid', 'results'])
+    report.attrs.update(wall_seconds=wall, workers=n_workers, tasks_per_second=len(report)/wall if wall > 0 else float('nan'),
+                        utilisation=float(report.seconds.sum())/(wall*n_workers) if wall > 0 else float('nan'))
+    logging.info(f"Scheduled {len(report)} tasks on {n_workers} workers in {wall:.1f}s, "
+                 f"{report.attrs['tasks_per_second']:.2f} tasks/s, {report.attrs['utilisation']:.0%} utilisation")
+    return report
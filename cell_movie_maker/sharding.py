@@ -0,0 +1,162 @@
+"""
+Deterministic sharding of experiments for HPC array jobs.
+
+Every shard of a job computes the same balanced assignment from the experiment's results files, so shards need no
+coordination: shard i of n processes its part and writes a completion marker, a retried shard whose marker exists
+returns immediately, and `merge` finalises the job once every marker is present.
+
+Example SLURM array job, rendering then making videos once every shard has finished::
+
+    #SBATCH --array=0-15
+    python -m cell_movie_maker visualise EXPERIMENT cell_movie_maker.SimulationVisualiser --step 10
+
+    python -m cell_movie_maker merge EXPERIMENT --count 16 --visualiser cell_movie_maker.SimulationVisualiser
+"""
+from __future__ import annotations
+import heapq
+import json
+import logging
+import os
+import pathlib
+import socket
+import threading
+import time
+import typing
+
+
+class Shard(typing.NamedTuple):
+    index:int
+    count:int
+
+    def __str__(self):
+        return f'{self.index}/{self.count}'
+
+
+def parse_shard(spec:str|Shard|None=None)->Shard:
+    """
+    Shard from 'i/n', or from the SLURM array job environment when spec is None.
+    SLURM arrays must be contiguous (e.g. `--array=0-15` or `--array=1-16`), shards are numbered from the first task id.
+    """
+    if isinstance(spec, Shard): return spec
+    if spec is None:
+        if 'SLURM_ARRAY_TASK_ID' not in os.environ: raise ValueError('No shard given and SLURM_ARRAY_TASK_ID is not set')
+        index = int(os.environ['SLURM_ARRAY_TASK_ID']) - int(os.environ.get('SLURM_ARRAY_TASK_MIN', 0))
+        count = int(os.environ['SLURM_ARRAY_TASK_COUNT'])
+    else:
+        try:
+            index, count = map(int, spec.split('/'))
+        except ValueError:
+            raise ValueError(f'Bad shard {spec!r}, expected "index/count"')
+    if not 0 <= index < count: raise ValueError(f'Shard index {index} is not in [0, {count})')
+    return Shard(index, count)
+
+
+def balance(costs:typing.Sequence[float], count:int)->list[int]:
+    """
+    Shard of each item, assigning the most expensive items first to the least loaded shard.
+    Ties are broken by item and shard order, so every process computes the same assignment from the same costs.
+    """
+    loads = [(0., s) for s in range(count)]
+    assignment = [0]*len(costs)
+    for i in sorted(range(len(costs)), key=lambda i: (-costs[i], i)):
+        load, s = heapq.heappop(loads)
+        assignment[i] = s
+        heapq.heappush(loads, (load + costs[i], s))
+    return assignment
+
+def select(costs:typing.Sequence[float], shard:Shard)->list[int]:
+    """
+    Indices of the items of a shard, in their original order
+    """
+    return [i for i, s in enumerate(balance(costs, shard.count)) if s == shard.index]
+
+
+def simulation_costs(sim_folders:list[str|pathlib.Path])->list[float]:
+    """
+    Estimated cost of each simulation, the total of its timepoints' costs (see `scheduler.estimate_costs`)
+    """
+    from . import scheduler
+    return [float(sum(scheduler.estimate_costs(pathlib.Path(f))[1])) for f in sim_folders]
+
+def shard_frames(results_folder:str|pathlib.Path, timesteps:list[int], shard:Shard)->set[int]:
+    """
+    Frame numbers of a shard, for frames rendering `timesteps` of one simulation
+    """
+    from . import scheduler
+    known = dict(zip(*scheduler.estimate_costs(pathlib.Path(results_folder))))
+    default = max(known.values(), default=1.)
+    return set(select([known.get(t, default) for t in timesteps], shard))
+
+
+def marker_folder(experiment_folder:str|pathlib.Path, job:str)->pathlib.Path:
+    return pathlib.Path(experiment_folder).joinpath('cmm_cache', 'shards', job)
+
+def marker_file(experiment_folder:str|pathlib.Path, job:str, shard:Shard)->pathlib.Path:
+    # The count is part of the name, so markers of a job run with a different number of shards are not mistaken for these
+    return marker_folder(experiment_folder, job).joinpath(f'{shard.index}_of_{shard.count}.json')
+
+def is_complete(experiment_folder:str|pathlib.Path, job:str, shard:Shard)->bool:
+    return marker_file(experiment_folder, job, shard).exists()
+
+def mark_complete(experiment_folder:str|pathlib.Path, job:str, shard:Shard, **info):
+    """
+    Write the completion marker of a shard, with `info` recorded in it
+    """
+    p = marker_file(experiment_folder, job, shard)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_name(f'.{p.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(dict(job=job, shard=shard.index, count=shard.count, host=socket.gethostname(), finished=time.time(), **info), f)
+    os.replace(tmp, p)
+
+def missing_shards(experiment_folder:str|pathlib.Path, job:str, count:int)->list[int]:
+    return [i for i in range(count) if not is_complete(experiment_folder, job, Shard(i, count))]
+
+def run_shard(experiment_folder:str|pathlib.Path, job:str, shard:Shard, func:typing.Callable[[],typing.Any], force:bool=False)->bool:
+    """
+    Call func unless the shard is already complete, then mark it complete.
+    A shard which fails is not marked, so the array task can simply be resubmitted.
+
+    Returns
+    -------
+    bool
+        True if func was called
+    """
+    if not force and is_complete(experiment_folder, job, shard):
+        logging.info(f'Shard {shard} of {job} is already complete')
+        return False
+    t0 = time.perf_counter()
+    func()
+    mark_complete(experiment_folder, job, shard, seconds=time.perf_counter()-t0)
+    return True
+
+
+def merge(experiment, job:str, count:int, *, visualisers:list=(), ingest=None, analyser=None, framerate:int=30):
+    """
+    Finalise a sharded job once every shard is complete.
+    Videos are made for each visualiser and simulation from the frames of all shards. For an ingest, a final pass over
+    the whole experiment with `skip_existing` inserts any analysis a shard did not, then the connection is closed.
+
+    Raises
+    ------
+    RuntimeError
+        If a shard has not completed
+    """
+    missing = missing_shards(experiment.experiment_folder, job, count)
+    if missing: raise RuntimeError(f'Shards {missing} of {count} of {job} have not completed')
+    finalise(experiment, visualisers=visualisers, ingest=ingest, analyser=analyser, framerate=framerate)
+
+def finalise(experiment, *, visualisers:list=(), ingest=None, analyser=None, framerate:int=30):
+    """
+    Make videos for each visualiser and simulation, and finish an ingest with a pass over the whole experiment, see `merge`
+    """
+    for i in range(len(experiment.simulations) if visualisers else 0):
+        sim = experiment.simulations[i]
+        for v in visualisers:
+            v.create_ffcat(sim, framerate=framerate)
+            v.generate_mp4_from_ffcat(sim, framerate=framerate)
+    if ingest is not None:
+        ingest.skip_existing = True
+        ingest.ingest_experiment(experiment, analyser)
+        ingest.db.commit()
+        ingest.db.close_connection()
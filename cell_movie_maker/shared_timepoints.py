@@ -0,0 +1,262 @@
+from __future__ import annotations
+import collections
+import copy
+import functools
+import itertools
+import threading
+import typing
+import multiprocessing.resource_tracker
+import multiprocessing.shared_memory
+import numpy as np
+import pandas as pd
+
+
+_alignment = 64
+# Blocks whose arrays were still referenced when the task finished, closed once they are released
+_lingering:list[multiprocessing.shared_memory.SharedMemory] = []
+
+
+class SharedTimepoint:
+    """
+    Picklable descriptor of a timepoint whose `data` columns are held in a shared memory block.
+    Only the descriptor is sent to a worker, `open` rebuilds the timepoint around read only views of the block.
+
+    Attributes
+    ----------
+    key : int
+        Identifies the block within its `SharedTimepoints`
+    block : str
+        Name of the shared memory block
+    columns : list[tuple]
+        (name, kind, offset, dtype, length, categories) of each column held in the block
+    order : list[str]
+        Column order of `data`
+    inline : dict
+        Columns which cannot be shared (object and extension dtypes), pickled with the descriptor
+    """
+    def __init__(self, key:int, block:str, template, order:list[str], columns:list[tuple], inline:dict, index:tuple):
+        self.key = key
+        self.block = block
+        self.template = template
+        self.order = order
+        self.columns = columns
+        self.inline = inline
+        self.index = index
+
+    def open(self):
+        """
+        The timepoint, with `data` backed by the shared block. Columns are read only, assign a new column or
+        `tp.data = tp.data.copy()` to modify them
+        """
+        shm = multiprocessing.shared_memory.SharedMemory(name=self.block)
+        arrays = dict()
+        for name, kind, offset, dtype, length, categories in self.columns:
+            values = np.ndarray((length,), dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+            values.flags.writeable = False
+            arrays[name] = pd.Categorical.from_codes(values, dtype=pd.CategoricalDtype(categories), validate=False) if kind == 'categorical' else values
+        arrays.update(self.inline)
+        match self.index:
+            case ('range', args): index = pd.RangeIndex(*args)
+            case ('block', (offset, dtype, length)): index = pd.Index(np.ndarray((length,), dtype=np.dtype(dtype), buffer=shm.buf, offset=offset), copy=False)
+            case ('values', values): index = values
+
+        tp = copy.copy(self.template)
+        tp.data = pd.DataFrame({c:arrays[c] for c in self.order}, index=index, copy=False)
+        tp._shared_block = shm
+        return tp
+
+    @staticmethod
+    def close(tp):
+        """
+        Detach a timepoint returned by `open` from its block
+        """
+        shm = tp.__dict__.pop('_shared_block', None)
+        tp.data = None
+        if shm is None: return
+        _lingering.append(shm)
+        for s in list(_lingering):
+            try:
+                s.close()
+                _lingering.remove(s)
+            except BufferError:
+                pass # Views are still referenced by the caller
+
+
+def _call_shared(func:typing.Callable, args:tuple):
+    shared, *rest = args
+    tp = shared.open()
+    try:
+        return shared.key, func((tp, *rest))
+    finally:
+        SharedTimepoint.close(tp)
+        del tp
+
+
+class SharedTimepoints:
+    """
+    Owner of the shared memory blocks of timepoints sent to process workers.
+    Each block is reference counted: sharing the same timepoint again reuses its block, and a block is unlinked once
+    every task using it has returned. Blocks left by failed tasks are unlinked when the context exits.
+
+    Create it before the executor: workers must share this process's resource tracker, a worker started before the
+    tracker runs its own, which unlinks the blocks it attached when the worker exits.
+    Process workers must be started with 'spawn' or 'forkserver': blocks are registered with the tracker while the pool
+    may be starting workers, and a worker forked then can inherit the tracker's lock held and hang on its first block.
+
+    Example
+    -------
+    >>> with SharedTimepoints() as shared, parallel.Executor(8, start_method='forkserver') as executor:
+    ...     results = list(shared.imap(executor, analyse, timepoints, analyser))
+    """
+    def __init__(self):
+        self.blocks:dict[int,multiprocessing.shared_memory.SharedMemory] = dict()
+        self.descriptors:dict[int,SharedTimepoint] = dict()
+        self.refs:collections.Counter[int] = collections.Counter()
+        self.lock = threading.Lock() # Process pools share timepoints from their task feeding thread
+        self._keys = itertools.count()
+        self._by_timepoint:dict[int,tuple[int,typing.Any]] = dict() # id(tp): (key, tp), holding tp so its id is not reused
+        multiprocessing.resource_tracker.ensure_running()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def nbytes(self)->int:
+        with self.lock:
+            return sum(b.size for b in self.blocks.values())
+
+    def share(self, tp)->SharedTimepoint:
+        """
+        Copy the columns of `tp.data` into a shared block, or reuse the block already holding them
+        """
+        with self.lock:
+            if id(tp) in self._by_timepoint:
+                key = self._by_timepoint[id(tp)][0]
+                self.refs[key] += 1
+                return self.descriptors[key]
+
+        data:pd.DataFrame = tp.data
+        layout, inline, size = [], dict(), 0
+        for name in data.columns:
+            column = data[name]
+            if isinstance(column.dtype, pd.CategoricalDtype):
+                values, kind, categories = column.cat.codes.to_numpy(), 'categorical', list(column.cat.categories)
+            elif isinstance(column.dtype, np.dtype) and column.dtype.kind in 'biufcmM':
+                values, kind, categories = column.to_numpy(), 'array', None
+            else:
+                inline[name] = column.to_numpy()
+                continue
+            layout.append((name, kind, size, values, categories))
+            size += -(-values.nbytes // _alignment) * _alignment
+        if isinstance(data.index, pd.RangeIndex):
+            index = ('range', (data.index.start, data.index.stop, data.index.step))
+        elif isinstance(data.index.dtype, np.dtype) and data.index.dtype.kind in 'biuf':
+            values = data.index.to_numpy()
+            index = ('block', (size, values.dtype.str, len(values)))
+            size += values.nbytes
+        else:
+            index = ('values', data.index.to_numpy())
+
+        shm = multiprocessing.shared_memory.SharedMemory(create=True, size=max(size, 1))
+        if index[0] == 'block':
+            np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf, offset=index[1][0])[:] = values
+        columns = []
+        for name, kind, offset, values, categories in layout:
+            np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf, offset=offset)[:] = values
+            columns.append((name, kind, offset, values.dtype.str, len(values), categories))
+
+        template = copy.copy(tp)
+        template._data = None
+        with self.lock:
+            key = next(self._keys)
+            self.blocks[key] = shm
+            self.descriptors[key] = SharedTimepoint(key, shm.name, template, list(data.columns), columns, inline, index)
+            self.refs[key] += 1
+            self._by_timepoint[id(tp)] = (key, tp)
+            return self.descriptors[key]
+
+    def release(self, key:int):
+        """
+        Drop one reference to a block, unlinking it when no task still uses it
+        """
+        with self.lock:
+            self.refs[key] -= 1
+            if self.refs[key] > 0: return
+            del self.refs[key]
+            self.descriptors.pop(key)
+            self._by_timepoint = {k:v for k,v in self._by_timepoint.items() if v[0] != key}
+            shm = self.blocks.pop(key)
+        shm.close()
+        shm.unlink()
+
+    def close(self):
+        with self.lock:
+            blocks = list(self.blocks.values())
+            self.blocks.clear()
+            self.descriptors.clear()
+            self.refs.clear()
+            self._by_timepoint.clear()
+        for shm in blocks:
+            shm.close()
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+
+    def imap(self, executor, func:typing.Callable, timepoints:typing.Iterable, *args, ordered:bool=False, depth:int|None=None,
+             max_bytes:int|None=None)->typing.Iterator:
+        """
+        Iterate over func((tp, *args)) for each timepoint, run by `executor`.
+        Process backends receive each timepoint as a `SharedTimepoint` descriptor, serial and thread backends receive the
+        timepoint itself since it does not need to leave the process.
+
+        Timepoints are shared as the executor takes tasks. A process pool takes them eagerly on its task feeding thread,
+        which waits while `depth` shared timepoints have no result yet, or while the blocks in use hold at least
+        `max_bytes`, as `prefetch.prefetch` bounds reading ahead. Executors which take tasks on the consuming thread
+        bound them with their own window.
+
+        Parameters
+        ----------
+        depth : int|None, optional (default None)
+            Timepoints shared but without a result, defaults to twice the tasks the executor's workers hold at once
+        max_bytes : int|None, optional (default None)
+            Stop sharing timepoints while the shared blocks use at least this much memory, None for no limit
+        """
+        rest = [itertools.repeat(a) for a in args]
+        if executor.backend not in ('process', 'loky'):
+            yield from executor.map(func, zip(timepoints, *rest), ordered=ordered)
+            return
+        if executor.backend == 'process' and executor.start_method == 'fork':
+            raise ValueError("SharedTimepoints needs process workers started with 'spawn' or 'forkserver', not 'fork'")
+        # A chunk is only sent once it is full, so the feeder must be able to share a whole chunk
+        depth = max(executor.chunksize, 2*executor.max_workers*executor.chunksize if depth is None else depth)
+        in_flight = 0
+        returned = threading.Condition()
+        stopped = threading.Event()
+        consumer = threading.get_ident()
+
+        def shared():
+            nonlocal in_flight
+            for tp in timepoints:
+                with returned:
+                    # Waiting on the consuming thread would deadlock, results are only released by it
+                    while (threading.get_ident() != consumer and in_flight > 0 and not stopped.is_set() and not executor.cancelled.is_set()
+                           and (in_flight >= depth or (max_bytes is not None and self.nbytes >= max_bytes))):
+                        returned.wait(0.1)
+                    if stopped.is_set(): return
+                    in_flight += 1
+                yield self.share(tp)
+
+        try:
+            for key, result in executor.map(functools.partial(_call_shared, func), zip(shared(), *rest), ordered=ordered):
+                self.release(key)
+                with returned:
+                    in_flight -= 1
+                    returned.notify()
+                yield result
+        finally:
+            stopped.set()
+            with returned: returned.notify_all()
@@ -1,5 +1,5 @@
 
-from .simulation_timepoint import SimulationTimepoint, MacrophageSimulationTimepoint, LiverMetSimulationTimepoint
+from .simulation_timepoint import SimulationTimepoint, MacrophageSimulationTimepoint, LiverMetSimulationTimepoint, dtype_policies, read_vessel_locations
 import os
 import re
 import multiprocessing
@@ -11,7 +11,18 @@ import errno
 import typing
 import itertools
 import bisect
+import time
+import collections.abc
+import functools
+import numpy as np
 import pandas as pd
+from . import timepoint_cache
+from . import parallel
+from . import manifest
+from .timepoint_lru import TimepointLRU
+from .prefetch import prefetch
+from . import pde_store
+from .cellages import CellIds
 
 
 sim_iteration_regex = re.compile(r'sim_(?P<iteration>\d+)')
@@ -21,16 +32,47 @@ class Simulation:
         def __init__(self, simulation):
             self.sim = simulation
 
-        def __getitem__(self, index:int):
+        def __getitem__(self, index:int|slice):
             match index:
                 case int():
                     return self.sim.read_timepoint(self.sim.results_timesteps[index])
                 case slice():
-                    return [self.sim.read_timepoint(tp) for tp in self.sim.results_timesteps[index]]
+                    return Simulation.TimepointSequence(self.sim, self.sim.results_timesteps[index])
                 case _:
                     raise IndexError
 
-    def __init__(self, results_folder:str|pathlib.Path, sampling_timestep_multiple:int=60, timesteps_per_hour:int=120, lightweight:bool=False):
+        def __len__(self):
+            return len(self.sim.results_timesteps)
+
+    class TimepointSequence(collections.abc.Sequence):
+        """
+        Lazy sequence of timepoints returned by slicing `Simulation.timepoints`.
+        Only holds timesteps, each timepoint is read when it is accessed so iterating holds one timepoint at a time.
+
+        Attributes
+        ----------
+        sim : Simulation
+            Simulation the timepoints are read from
+        timesteps : list[int]
+            Timesteps in the sequence
+        """
+        def __init__(self, simulation, timesteps:list[int]):
+            self.sim = simulation
+            self.timesteps:list[int] = list(timesteps)
+
+        def __getitem__(self, index:int|slice):
+            match index:
+                case int():
+                    return self.sim.read_timepoint(self.timesteps[index])
+                case slice():
+                    return Simulation.TimepointSequence(self.sim, self.timesteps[index])
+                case _:
+                    raise IndexError
+
+        def __len__(self):
+            return len(self.timesteps)
+
+    def __init__(self, results_folder:str|pathlib.Path, sampling_timestep_multiple:int=60, timesteps_per_hour:int=120, lightweight:bool=False, use_cache:bool=None, reader:str=None, lru_bytes:int=None, use_pde_store:bool=None, dtype_policy:str=None):
         self.results_folder:pathlib.Path = pathlib.Path(results_folder)
         if not self.results_folder.name == 'results_from_time_0': self.results_folder = self.results_folder.joinpath('results_from_time_0')
         assert self.results_folder.is_dir(), f'{self.results_folder} does not exist, or is a file.'
@@ -42,30 +84,54 @@ class Simulation:
 
         self.sampling_timestep_multiple = sampling_timestep_multiple
         self.timesteps_per_hour = timesteps_per_hour
+        self.use_cache:bool = Config.use_timepoint_cache if use_cache is None else use_cache # Load timepoints through the columnar cache in cmm_cache/
+        self.vtu_reader:str = Config.vtu_reader if reader is None else reader # 'vtk' or 'numpy', see vtu_reader.read_vtu
+        self.use_pde_store:bool = Config.use_pde_store if use_pde_store is None else use_pde_store # Read PDE fields from stacked arrays in cmm_cache/pde
+        self.pde_stores:dict[tuple[str,str],pde_store.PDEStore] = dict()
+        self.dtype_policy:str = Config.dtype_policy if dtype_policy is None else dtype_policy # 'default' or 'compact' (float32 values, int32 ids)
+        if self.dtype_policy not in dtype_policies: raise ValueError(f'Unknown dtype_policy {self.dtype_policy!r}, expected one of {list(dtype_policies)}')
+        self.timepoint_lru = TimepointLRU(Config.timepoint_lru_bytes if lru_bytes is None else lru_bytes) # Decoded timepoints kept in memory, disabled when 0
         
         self.get_filenames()
         self.read_parameters()
         self.timepoints = Simulation.Timepoints(self)
+        self.cell_ids = dict()
         if not lightweight:
             self.read_cellages()
 
     def read_cellages(self):
-        self.cell_ids = dict()
-        file = self.results_folder.joinpath("cellages.dat")
-        if not file.exists(): return
-        with file.open('r') as f:
-            for line in f:
-                if len(line.strip()) < 0: continue
-                line = line.strip().split('\t')
-                if not len(line)==2: continue
-                self.cell_ids[int(float(line[0])*120)] = [int(i) for i in line[1].split(' ')[::4]]
+        """
+        Set up `cell_ids`, cellages.dat is parsed (or read from its sidecar in cmm_cache) on first use
+        """
+        self.cell_ids = CellIds(self.results_folder)
         
+    @property
+    def all_files(self)->list[str]:
+        return os.listdir(self.results_folder)
+
     def get_filenames(self):
-        self.all_files = os.listdir(self.results_folder)
+        if Config.use_manifest:
+            self.results_timesteps = list(manifest.simulation_entry(self.results_folder)['timesteps'])
+            return
 
         p = re.compile(r'^results_(\d+)\.vtu$')
         self.results_timesteps = sorted(list(
             map(lambda x: int(p.match(x)[1]), filter(p.match, self.all_files))))
+
+    def read_manifest(self)->pd.DataFrame:
+        """
+        Per-timestep file size, mtime, point count and point data array names from the experiment manifest
+
+        Returns
+        -------
+        pd.DataFrame
+            Indexed by timestep
+        """
+        entry = manifest.simulation_entry(self.results_folder)
+        return pd.DataFrame(dict(
+            size=entry['size'], mtime_ns=entry['mtime_ns'], n_points=entry['n_points'],
+            point_arrays=[entry['point_arrays'][i] for i in entry['point_arrays_index']]),
+            index=pd.Index(entry['timesteps'], name='timestep'))
     
     def read_parameters(self):
         self.parameters = None
@@ -74,30 +140,175 @@ class Simulation:
             with open(params_path, 'r') as f:
                 self.parameters = json.load(f)
     
-    def _read_timepoint(self, timestep:int):
-        if timestep > max(self.results_timesteps):
-            return SimulationTimepoint(self.id, self.name, self.results_folder, max(self.results_timesteps), self)
-        if timestep not in self.results_timesteps:
-            return self.read_timepoint(self.results_timesteps[max(0, bisect.bisect(self.results_timesteps, timestep)-1)])
-        return SimulationTimepoint(self.id, self.name, self.results_folder, timestep, self)
+    def output_timestep(self, timestep:int)->int:
+        """
+        Timestep of the output `read_timepoint` reads for timestep, the latest output at or before it
+        """
+        return self.results_timesteps[max(0, bisect.bisect(self.results_timesteps, timestep)-1)]
+
+    def _read_timepoint(self, timestep:int, columns:list[str]|None=None):
+        return SimulationTimepoint(self.id, self.name, self.results_folder, self.output_timestep(timestep), self, columns=columns)
+
+    def _load_timepoint(self, timestep:int, columns:list[str]|None=None):
+        tp = self._read_timepoint(timestep, columns=columns)
+        if not tp.lazy and tp.timestep in self.cell_ids:
+            tp.data['cell_id'] = np.asarray(self.cell_ids[tp.timestep], dtype=tp.id_dtype)
+        return tp
     
-    def read_timepoint(self, timestep:int):
-        tp = self._read_timepoint(timestep)
-        if tp.timestep in self.cell_ids:
-            tp.data['cell_id'] = self.cell_ids[tp.timestep]
+    def read_timepoint(self, timestep:int, columns:list[str]|None=None):
+        """
+        Read a timepoint, or the latest timepoint before it if there is no output at timestep.
+        Served from `timepoint_lru` when it is enabled and holds the timepoint.
+
+        Parameters
+        ----------
+        timestep : int
+            Timestep to read
+        columns : list[str]|None, optional (default None)
+            Only load these columns (plus x, y, z), other columns are loaded on first access through `tp[column]`.
+            If None every column is loaded.
+        """
+        if not self.timepoint_lru.enabled: return self._load_timepoint(timestep, columns=columns)
+        # Keyed by the output read, so every timestep which resolves to it shares one entry
+        timestep = self.output_timestep(timestep)
+        # A fully loaded timepoint also serves requests for a subset of columns
+        for key in [(timestep, False)] if columns is None else [(timestep, False), (timestep, True)]:
+            tp = self.timepoint_lru.get(key)
+            if tp is not None:
+                with self.timepoint_lru.lock: self.timepoint_lru.hits += 1
+                if columns is not None: tp.load_columns(columns)
+                return tp
+        with self.timepoint_lru.lock: self.timepoint_lru.misses += 1
+        tp = self._load_timepoint(timestep, columns=columns)
+        self.timepoint_lru.put((timestep, columns is not None), tp)
         return tp
 
-    def for_timepoint(self, func, start=0, stop=None, step=1, maxproc=64, disable_tqdm=False, tqdm_kwargs=dict()):
-        N = len(self.results_timesteps[slice(start, stop, step)])
+    def prefetch_timepoints(self, timesteps:typing.Iterable[int]|None=None, depth:int|None=None, max_bytes:int|None=-1, columns:list[str]|None=None):
+        """
+        Iterate over timepoints in order, reading the next few on background threads while the current one is processed
+
+        Parameters
+        ----------
+        timesteps : Iterable[int]|None, optional (default None)
+            Timesteps to read, defaults to all `results_timesteps`
+        depth : int|None, optional (default None)
+            Number of timepoints read ahead, defaults to `Config.prefetch_depth`. 0 disables prefetching
+        max_bytes : int|None, optional
+            Stop reading ahead while this much memory is held by timepoints read but not yet processed.
+            Defaults to `Config.prefetch_max_bytes`, None for no limit
+        columns : list[str]|None, optional (default None)
+            Only load these columns, see `read_timepoint`
+
+        Yields
+        ------
+        SimulationTimepoint
+        """
+        if timesteps is None: timesteps = self.results_timesteps
+        if depth is None: depth = Config.prefetch_depth
+        if max_bytes == -1: max_bytes = Config.prefetch_max_bytes
+        return prefetch(lambda t: self.read_timepoint(t, columns=columns), timesteps, depth=depth, max_bytes=max_bytes)
+
+    def iter_timepoint_pairs(self, delta:int, start=0, stop=None, step=1, columns:list[str]|None=None):
+        """
+        Iterate over (tp, tp_delta) pairs, where tp_delta is read at tp.timestep + delta (clamped at 0).
+        Frames are decoded once and reused while they are still needed, so a sweep where tp_delta is a later frame of the
+        same sweep reads each results file once.
+
+        Parameters
+        ----------
+        delta : int
+            Offset in timesteps of the second timepoint, may be negative
+        start, stop, step : int, optional
+            Slice of `results_timesteps` to iterate over
+        columns : list[str]|None, optional (default None)
+            Only load these columns, see `read_timepoint`
+
+        Yields
+        ------
+        tuple[SimulationTimepoint, SimulationTimepoint]
+            Copies, so either timepoint can be modified
+        """
+        window:dict[int,SimulationTimepoint] = dict() # Keyed by output timestep, see `output_timestep`
+        def get(timestep:int):
+            if timestep not in window: window[timestep] = self.read_timepoint(timestep, columns=columns)
+            return window[timestep]
+        for t in self.results_timesteps[start:stop:step]:
+            t_delta = self.output_timestep(max(0, t + delta))
+            for k in [k for k in window if k < min(t, t_delta)]: del window[k]
+            tp, tp_delta = get(t), get(t_delta)
+            yield tp.copy(), tp_delta.copy()
+
+    def pde_store(self, file:str, chemokine:str|None=None, wait:bool=True)->pde_store.PDEStore|None:
+        """
+        Stacked (T, ny, nx) array of a PDE field over every timestep, built on first use
+
+        Parameters
+        ----------
+        file : str
+            PDE file name, as in `pde_results_<file>_<timestep>.vtu`
+        chemokine : str|None, optional (default None)
+            Point data array within the file, defaults to file
+        wait : bool, optional (default True)
+            If another process is building the store wait for it, otherwise return None
+
+        Returns
+        -------
+        PDEStore|None
+        """
+        if chemokine is None: chemokine = file
+        if (file, chemokine) not in self.pde_stores:
+            store = pde_store.open_store(self.results_folder, file, chemokine, reader=self.vtu_reader)
+            while store is None and wait:
+                time.sleep(1)
+                store = pde_store.open_store(self.results_folder, file, chemokine, reader=self.vtu_reader)
+            if store is None: return None
+            self.pde_stores[(file, chemokine)] = store
+        return self.pde_stores[(file, chemokine)]
+
+    def pde_means(self, fields:typing.Sequence[str|tuple[str,str]]=('oxygen', 'ccl5', 'cxcl9', 'ifn-gamma', ('tcellpdes', 'density')))->pd.DataFrame:
+        """
+        Mean of PDE fields at every timestep, fields which have no output are skipped
+
+        Parameters
+        ----------
+        fields : Sequence[str|tuple[str,str]], optional
+            PDE files, or (file, chemokine) pairs. Defaults to oxygen, CCL5, CXCL9, IFN-gamma and ECM density
+
+        Returns
+        -------
+        pd.DataFrame
+            Indexed by timestep, one column per chemokine
+        """
+        means = []
+        for field in fields:
+            file, chemokine = field if isinstance(field, tuple) else (field, field)
+            try:
+                means.append(self.pde_store(file, chemokine).means())
+            except FileNotFoundError:
+                continue
+        return pd.concat(means, axis=1) if len(means) > 0 else pd.DataFrame(index=pd.Index([], name='timestep'))
+
+    def build_timepoint_cache(self, overwrite:bool=False)->int:
+        return timepoint_cache.convert_simulation(self.results_folder, overwrite=overwrite, reader=self.vtu_reader)
+
+    def for_timepoint(self, func, start=0, stop=None, step=1, maxproc=None, disable_tqdm=False, tqdm_kwargs=dict(), only:typing.Container[int]|None=None):
+        """
+        Call func((sim, timepoint, frame_num)) for each timepoint in parallel.
+        The simulation and func are sent to each worker once when it starts, tasks only carry (timestep, frame_num)
+        and each timepoint is read inside the worker that processes it.
+        If `only` is given, only those frame numbers are processed, frames keep the numbers they have in the full loop.
+        """
+        timesteps = self.timepoints[start:stop:step].timesteps
+        frame_nums = [i for i in range(len(timesteps)) if only is None or i in only]
         r = None
-        with multiprocessing.Pool(processes=min(multiprocessing.cpu_count()-1, maxproc)) as pool:
-            r=list(tqdm.tqdm(pool.imap(func, zip(itertools.repeat(self), self.timepoints[start:stop:step], range(N))),
-                total=N, **tqdm_kwargs))
+        with parallel.context_pool(self, func, maxproc=maxproc) as pool:
+            r=list(tqdm.tqdm(parallel.imap_timepoints(pool, [timesteps[i] for i in frame_nums], frame_nums=frame_nums),
+                total=len(frame_nums), disable=disable_tqdm, **tqdm_kwargs))
         return r
     
     def for_timepoint_single_thread(self, func, start=0, stop=None, step=1, disable_tqdm=False):
-        N = len(self.results_timesteps[start:step:step])
-        r = [func((self,tp, i)) for i, tp in tqdm.tqdm(enumerate(self.timepoints[start:stop:step]), total=N, disable=disable_tqdm)]
+        timesteps = self.timepoints[start:stop:step].timesteps
+        r = [func((self,tp, i)) for i, tp in tqdm.tqdm(enumerate(self.prefetch_timepoints(timesteps)), total=len(timesteps), disable=disable_tqdm)]
         return r
 
     def for_final_timepoint(self, func):
@@ -105,18 +316,29 @@ class Simulation:
 
 
 class MacrophageSimulation(Simulation):
-    def read_timepoint(self, timestep:int):
+    @functools.cached_property
+    def vessel_locations(self)->np.ndarray:
+        """
+        (N, 2) point vessel locations, parsed from results.parameters on first use and shared by every timepoint
+        """
+        return read_vessel_locations(self.results_folder)
+
+    def output_timestep(self, timestep:int)->int:
+        # Timesteps between outputs are not resolved to an earlier output, `read_timepoint` returns None for them
+        return min(timestep, max(self.results_timesteps))
+
+    def _load_timepoint(self, timestep:int, columns:list[str]|None=None):
         if timestep > max(self.results_timesteps):
-            return MacrophageSimulationTimepoint(self.id, self.name, self.results_folder, max(self.results_timesteps), self)
+            return MacrophageSimulationTimepoint(self.id, self.name, self.results_folder, max(self.results_timesteps), self, columns=columns)
         if timestep not in self.results_timesteps: return None
-        return MacrophageSimulationTimepoint(self.id, self.name, self.results_folder, timestep, self)
+        return MacrophageSimulationTimepoint(self.id, self.name, self.results_folder, timestep, self, columns=columns)
 
 class LiverMetSimulation(Simulation):
-    def read_timepoint(self, timestep:int):
+    def _load_timepoint(self, timestep:int, columns:list[str]|None=None):
         if timestep > max(self.results_timesteps):
-            return LiverMetSimulationTimepoint(self.id, self.name, self.results_folder, max(self.results_timesteps), self)
+            return LiverMetSimulationTimepoint(self.id, self.name, self.results_folder, max(self.results_timesteps), self, columns=columns)
         if timestep not in self.results_timesteps: return None
-        return LiverMetSimulationTimepoint(self.id, self.name, self.results_folder, timestep, self)
+        return LiverMetSimulationTimepoint(self.id, self.name, self.results_folder, timestep, self, columns=columns)
     
     def read_parameters(self):
         pass
@@ -128,26 +350,21 @@ def load_simulation(experiment:str, id:int|str=None, cls:typing.Type[Simulation]
     assert issubclass(cls, Simulation)
     match experiment,id:
         case str(), str():
-            try:
-                glob = f'**/{experiment}/{id}/results_from_time_0'
-                results_folder = next(Config.simulations_folder.glob(glob))
-                return cls(results_folder)
-            except StopIteration:
-                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), pathlib.Path(Config.simulations_folder, glob))
+            glob = f'**/{experiment}/{id}/results_from_time_0'
+            parents = (experiment, id)
         case int(), None:
-            try:
-                glob = f'**/sim_{experiment}/results_from_time_0'
-                results_folder = next(Config.simulations_folder.glob(glob))
-                return cls(results_folder)
-            except StopIteration:
-                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), pathlib.Path(Config.simulations_folder, glob))
+            glob = f'**/sim_{experiment}/results_from_time_0'
+            parents = (f'sim_{experiment}',)
         case str(), None:
-            try:
-                glob = f'**/{experiment}/results_from_time_0'
-                results_folder = next(Config.simulations_folder.glob(glob))
-                return cls(results_folder)
-            except StopIteration:
-                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), pathlib.Path(Config.simulations_folder, glob))
+            glob = f'**/{experiment}/results_from_time_0'
+            parents = (experiment,)
         case _:
             raise RuntimeError("Bad arguments")
-    
\ No newline at end of file
+    if Config.use_manifest:
+        results_folder = manifest.find_simulation(Config.simulations_folder, *parents)
+        if results_folder is not None: return cls(results_folder)
+    try:
+        results_folder = next(Config.simulations_folder.glob(glob))
+        return cls(results_folder)
+    except StopIteration:
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), pathlib.Path(Config.simulations_folder, glob))
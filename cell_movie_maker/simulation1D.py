@@ -1,11 +1,85 @@
 from .simulation import Simulation
 
 import functools
+import numpy as np
 import pandas as pd
 import os
 import pathlib
 
 
+class RaggedData:
+    """
+    Rows of differing length stored as one flat array, as written to Chaste `.viznodes`/`.dat` files (`<time>\\t<v0> <v1> ...`)
+
+    Attributes
+    ----------
+    times : np.ndarray
+        (T,) time of each row
+    offsets : np.ndarray
+        (T+1,) start of each row in `values`, row i is values[offsets[i]:offsets[i+1]]
+    values : np.ndarray
+        Values of every row, concatenated
+    """
+    def __init__(self, times:np.ndarray, offsets:np.ndarray, values:np.ndarray):
+        self.times = times
+        self.offsets = offsets
+        self.values = values
+
+    @classmethod
+    def read(cls, file:str|pathlib.Path):
+        times, tokens, counts = [], [], []
+        for line in pathlib.Path(file).read_bytes().splitlines():
+            line = line.split(b'\t')
+            if len(line) < 2: continue
+            times.append(line[0])
+            row = line[1].split()
+            tokens.extend(row)
+            counts.append(len(row))
+        # Raises ValueError on a token which is not a number, e.g. a line still being written
+        values = np.array(tokens, dtype=float) if len(tokens) else np.empty(0)
+        return cls(np.array(times, dtype=float), np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]), values)
+
+    def __len__(self)->int:
+        return len(self.times)
+
+    def __getitem__(self, i:int)->np.ndarray:
+        return self.values[self.offsets[i]:self.offsets[i+1]]
+
+    @property
+    def lengths(self)->np.ndarray:
+        return np.diff(self.offsets)
+
+    def row_index(self, lengths:np.ndarray|None=None)->tuple[np.ndarray,np.ndarray]:
+        """
+        Row and position within the row of every value, or of the first `lengths` values of each row
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            row and column of each value
+        """
+        if lengths is None: lengths = self.lengths
+        rows = np.repeat(np.arange(len(self)), lengths)
+        columns = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return rows, columns
+
+    def flat_index(self, lengths:np.ndarray)->np.ndarray:
+        """
+        Positions in `values` of the first `lengths` values of each row
+        """
+        rows, columns = self.row_index(lengths)
+        return self.offsets[rows] + columns
+
+    def to_frame(self)->pd.DataFrame:
+        """
+        Rows indexed by time, padded with NaN to the longest row
+        """
+        rows, columns = self.row_index()
+        padded = np.full((len(self), self.lengths.max(initial=0)), np.nan)
+        padded[rows, columns] = self.values
+        return pd.DataFrame(padded, index=self.times)
+
+
 class Simulation1D(Simulation):
     def __init__(self, results_folder:str):
         self.results_folder = pathlib.Path(results_folder) # Path to results_from_time_0
@@ -13,29 +87,80 @@ class Simulation1D(Simulation):
 
         self.id = os.path.basename(os.path.dirname(self.results_folder))
         self.name = os.path.basename(os.path.dirname(os.path.dirname(self.results_folder)))
-        
+
         self.read_parameters()
         self.load_data()
 
     def load_data(self):
-        with open(pathlib.Path(self.results_folder, 'results.viznodes'), 'r') as f:
-            self.position_data = pd.DataFrame.from_dict({float(l.split('\t')[0].strip()): [float(x) for x in l.split('\t')[1].strip().split(' ')] for l in f.readlines()}, orient='index')
-    
+        self.positions = RaggedData.read(pathlib.Path(self.results_folder, 'results.viznodes'))
         pressure_file = pathlib.Path(self.results_folder, 'celldata_pressure.dat')
-        if pressure_file.exists():
-            with open(pressure_file, 'r') as f:
-                self.pressure_data = pd.DataFrame.from_dict({float(l.split('\t')[0].strip()): [float(x) for x in l.split('\t')[1].strip().split(' ')] for l in f.readlines()}, orient='index')
-        else:
-            self.pressure_data = None
+        self.pressures = RaggedData.read(pressure_file) if pressure_file.exists() else None
+
+    @functools.cached_property
+    def position_data(self)->pd.DataFrame:
+        return self.positions.to_frame()
+
+    @functools.cached_property
+    def pressure_data(self)->pd.DataFrame|None:
+        return None if self.pressures is None else self.pressures.to_frame()
 
     @property
     def timepoints(self)->list[float]:
-        return self.position_data.index.to_list()
-    
+        return self.positions.times.tolist()
+
     def read_timepoint(self, timepoint:float)->pd.DataFrame:
+        i = int(np.flatnonzero(self.positions.times == timepoint)[0])
+        x = self.positions[i]
+        pressure = self.pressures[int(np.flatnonzero(self.pressures.times == timepoint)[0])]
         return pd.DataFrame({
-            'x':self.position_data.loc[timepoint, :],
-            'pressure':self.pressure_data.loc[timepoint,:],
+            'x':pd.Series(x),
+            'pressure':pd.Series(pressure),
             })
-    
 
+    def kymograph(self, quantity:str='pressure', bins:int=200, xlim:tuple[float,float]|None=None)->tuple[np.ndarray,np.ndarray,np.ndarray]:
+        """
+        Rasterise every timepoint into one (T, bins) image in a single pass
+
+        Parameters
+        ----------
+        quantity : str, optional (default 'pressure')
+            'pressure' for the mean pressure of the cells in each bin, 'density' for the number of cells in each bin
+        bins : int, optional (default 200)
+            Number of position bins
+        xlim : tuple[float, float]|None, optional (default None)
+            Range of positions binned, defaults to the range of all positions
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray, np.ndarray]
+            image (T, bins), NaN where a bin holds no cells, times (T,) and bin edges (bins+1,)
+        """
+        match quantity:
+            case 'pressure':
+                if self.pressures is None: raise FileNotFoundError(pathlib.Path(self.results_folder, 'celldata_pressure.dat'))
+                if not np.array_equal(self.positions.times, self.pressures.times): raise ValueError('Positions and pressures are written at different times')
+                # Pair each pressure with the position of the same index, as in read_timepoint
+                lengths = np.minimum(self.positions.lengths, self.pressures.lengths)
+                x = self.positions.values[self.positions.flat_index(lengths)]
+                weights = self.pressures.values[self.pressures.flat_index(lengths)]
+            case 'density':
+                lengths = self.positions.lengths
+                x = self.positions.values
+                weights = None
+            case _:
+                raise ValueError(f'Unknown kymograph quantity {quantity!r}, expected pressure or density')
+
+        rows, _ = self.positions.row_index(lengths)
+        if xlim is None: xlim = (np.nanmin(x), np.nanmax(x)) if len(x) else (0., 1.)
+        edges = np.linspace(*xlim, bins+1)
+        column = np.clip(np.searchsorted(edges, x, side='right')-1, 0, bins-1)
+        keep = (x >= edges[0]) & (x <= edges[-1])
+        flat = (rows*bins + column)[keep]
+        counts = np.bincount(flat, minlength=len(self.positions)*bins).reshape((-1, bins)).astype(float)
+        if weights is None:
+            image = counts
+        else:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                image = np.bincount(flat, weights=weights[keep], minlength=len(self.positions)*bins).reshape((-1, bins)) / counts
+        image[counts == 0] = np.nan
+        return image, self.positions.times, edges
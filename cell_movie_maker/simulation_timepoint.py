@@ -1,16 +1,87 @@
 
-import vtk
-from vtk.numpy_interface import dataset_adapter as dsa
 import numpy as np
 import pandas as pd
 import pathlib
 import xml.etree.ElementTree
+import os
+import errno
+import copy
+import re
+import logging
+from .vtu_reader import VTUData, read_vtu
+from . import timepoint_cache
 
 class Simulation:
     pass
 
+
+def categorise_cell_types(values, names:dict[int,str], unknown:str='Unknown')->pd.Categorical:
+    """
+    Map integer cell type labels to a Categorical of cell type names using a lookup table
+
+    Parameters
+    ----------
+    values : array_like
+        Raw cell type labels, may be float with NaN for missing values
+    names : dict[int, str]
+        Name for each known label, several labels may share a name
+    unknown : str, optional (default 'Unknown')
+        Name given to labels not in `names`
+
+    Returns
+    -------
+    pd.Categorical
+        Cell type names, with categories in the order of `names` followed by `unknown`
+    """
+    categories = list(dict.fromkeys([*names.values(), unknown]))
+    unknown_code = categories.index(unknown)
+    table = np.full(max(names)+1, unknown_code, dtype=np.int8)
+    for label, name in names.items(): table[label] = categories.index(name)
+
+    values = np.asarray(values, dtype=float)
+    with np.errstate(invalid='ignore'):
+        known = (values >= 0) & (values < len(table)) & (values == np.floor(values))
+    codes = np.full(values.shape, unknown_code, dtype=np.int8)
+    codes[known] = table[values[known].astype(np.intp)]
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+
+# Column dtypes of `SimulationTimepoint.data` under each `Simulation.dtype_policy`.
+# A float dtype of None keeps the dtype the values are stored with in the results file. Cell types are always int8 coded Categoricals
+dtype_policies = {
+    'default': dict(float=None, id=np.int64),
+    'compact': dict(float=np.float32, id=np.int32),
+}
+
+
+def read_vessel_locations(results_folder:str|pathlib.Path)->np.ndarray:
+    """
+    Point vessel locations of a macrophage simulation, from `mVesselLocations` in results.parameters
+
+    Returns
+    -------
+    np.ndarray
+        (N, 2) array of vessel x, y locations
+    """
+    p = pathlib.Path(results_folder, "results.parameters")
+    tree = xml.etree.ElementTree.parse(p)
+    raw = tree.find('SimulationModifiers/EllipticBoxDomainPdeModifier_VariableTimestep_PointVesselBCs-2/mVesselLocations')
+    assert raw is not None, f"Could not find vessel locations in {p}"
+    # Written as [x,y,],[x,y,],...
+    locations = [[float(x) for x in v.split(',') if x.strip()][:2] for v in re.findall(r'\[([^\]]*)\]', raw.text or '')]
+    return np.array(locations, dtype=float).reshape((-1, 2))
+
+
 class SimulationTimepoint:
-    def __init__(self, id, name, results_folder:pathlib.Path, timestep:int, sim:Simulation):
+    # Columns loaded when no column projection is requested, in order
+    default_columns = ['volume', 'radius', 'Ages', 'potency', 'damage', 'oxygen', 'ccl5', 'cxcl9', 'ifn-gamma', 'density',
+                       'cell_type', 'damping_coefficient', 'friction', 'pressure', 'target_radius', 'tissue_stress', 'exhaustion %']
+    # Names of the integer cell_type labels written by Chaste
+    cell_type_names = {0: 'Stroma', 1: 'Tumour', 2: 'T Cell', 3: 'Macrophage', 4: 'Blood Vessel'}
+    # Alternative labelling from potency, kept for older simulations without a cell_type array
+    # potency >= 0: 'T Cell', -1: 'Stroma', -2: 'Tumour', -3: 'Macrophage', -4: 'Blood Vessel'
+
+    def __init__(self, id, name, results_folder:pathlib.Path, timestep:int, sim:Simulation, columns:list[str]|None=None):
         self.id = id # e.g. sim_0
         self.name = name # experiment name
         self.results_folder = pathlib.Path(results_folder)
@@ -18,99 +89,197 @@ class SimulationTimepoint:
         self.timestep = timestep
         self.sim = sim
         self.ok = False
-        raw = self.read_data()
+        self._cell_type_index = None
+        self.lazy = columns is not None # Only materialise requested columns, others are loaded on first access
+        raw = self.read_data(lazy=self.lazy)
         self.n_points = raw.GetNumberOfPoints()
         self.data = pd.DataFrame(
-            index=np.arange(self.n_points))
+            index=np.arange(self.n_points) if self.float_dtype is None else pd.RangeIndex(self.n_points))
         self.columns = set()
         self.load_locations(raw)
-        self.load_data(raw.PointData)
-
-    def read_data(self):
-        reader = vtk.vtkXMLUnstructuredGridReader()
-        reader.SetFileName(str(self.results_file))
-        self.ok = reader.CanReadFile(str(self.results_file))
-        if self.ok: reader.Update()
-        return dsa.WrapDataObject(reader.GetOutput())
+        self._raw = raw.PointData if self.lazy else None
+        if self.lazy: self.load_columns(columns)
+        else: self.load_data(raw.PointData)
+
+    @property
+    def data(self)->pd.DataFrame:
+        return self._data
+
+    @data.setter
+    def data(self, data:pd.DataFrame):
+        self._data = data
+        self._cell_type_index = None
+
+    @property
+    def float_dtype(self)->np.dtype|None:
+        return dtype_policies[getattr(self.sim, 'dtype_policy', 'default')]['float']
+
+    @property
+    def id_dtype(self)->np.dtype:
+        return dtype_policies[getattr(self.sim, 'dtype_policy', 'default')]['id']
+
+    def as_float(self, values):
+        """
+        Cast float values to the dtype of the simulation's `dtype_policy`, other values are returned unchanged
+        """
+        values = np.asarray(values)
+        if self.float_dtype is None or values.dtype.kind != 'f': return values
+        return values.astype(self.float_dtype, copy=False)
+
+    def memory_usage(self)->int:
+        """
+        Bytes used by `data`, including the index and categories, and by the source retained by lazily loaded timepoints
+        """
+        raw = 0
+        if self._raw is not None:
+            raw = getattr(self._raw, 'nbytes', None)
+            if raw is None: raw = sum(getattr(v, 'nbytes', 0) for v in self._raw.values())
+        return int(self.data.memory_usage(deep=True).sum()) + raw
+
+    def read_data(self, lazy:bool=False)->VTUData:
+        if self.sim.use_cache:
+            raw = timepoint_cache.read_cached(self.results_file, lazy=lazy)
+            if raw is not None:
+                self.ok = True
+                return raw
+        raw = read_vtu(self.results_file, reader=self.sim.vtu_reader, lazy=lazy)
+        self.ok = raw is not None
+        if not self.ok: return VTUData.empty()
+        if self.sim.use_cache:
+            try:
+                timepoint_cache.write_cached(self.results_file, raw)
+            except OSError as e:
+                # Read only simulation folders and full disks are read from the VTU every time
+                logging.warning(f"Unable to cache {self.results_file}: {e}")
+        return raw
     
     def load_locations(self, raw):
-        self.data.loc[:,["x", "y", "z"]] = raw.Points
+        if self.float_dtype is None:
+            self.data.loc[:,["x", "y", "z"]] = raw.Points
+        else:
+            points = self.as_float(raw.Points).reshape((-1, 3))
+            for i, c in enumerate(["x", "y", "z"]): self.data[c] = points[:,i]
         self.columns = set()
 
     def load_data(self, raw):
-        self.load_value(raw, 'volume')
-        self.data['radius'] = np.sqrt(self.data.volume/np.pi)
-        self.load_value(raw, 'Ages')
-        self.load_value(raw, "potency")
-        self.load_value(raw, "damage", 0)
-        self.load_value(raw, "oxygen")
-        self.load_value(raw, "ccl5")
-        self.load_value(raw, "cxcl9")
-        self.load_value(raw, "ifn-gamma")
-        self.load_value(raw, "density")
-        self.load_value(raw, "cell_type")
-        self.load_value(raw, "damping_coefficient")
-        self.load_value(raw, "friction")
-        self.load_value(raw, "pressure")
-        self.load_value(raw, "target_radius")
-
-        def interpret_cell_type(cell_type):
-            if cell_type == 0: return 'Stroma'
-            elif cell_type == 1: return 'Tumour'
-            elif cell_type == 2: return 'T Cell'
-            elif cell_type == 3: return 'Macrophage'
-            elif cell_type == 4: return 'Blood Vessel'
-            else: return 'Unknown'
-        def potency_map(potency):
-            if potency >= 0: return 'T Cell'
-            elif potency == -1: return 'Stroma'
-            elif potency == -2: return 'Tumour'
-            elif potency == -3: return 'Macrophage'
-            elif potency == -4: return 'Blood Vessel'
-            else: return 'Unknown'
-        self.data['cell_type'] = list(map(interpret_cell_type, self.data.cell_type))
-        #self.data['cell_type'] = list(map(potency_map, self.data.potency))
-        self.data.loc[self.data.potency < 0, 'potency'] = np.nan
-        self.data.loc[self.data.damage < 0, 'damage'] = np.nan
-
-        self.data['tissue_stress'] = 1 - self.data['radius']/self.data['target_radius']
-        self.data.loc[~np.isfinite(self.data.tissue_stress), 'tissue_stress'] = -1
-
-        if self.sim.parameters and 'potency' in self.data and 'CD8InitialPotency' in self.sim.parameters:
-            self.data['exhaustion %'] = 1-self.data['potency']/self.sim.parameters['CD8InitialPotency']
+        for column in self.default_columns: self.load_column(raw, column)
+
+    def load_columns(self, columns:list[str]):
+        """
+        Materialise columns which are not yet in `data`.
+        Only has an effect on lazily loaded timepoints, eagerly loaded timepoints already hold every column.
+        """
+        if self._raw is None: return
+        for column in columns:
+            if column not in self.data: self.load_column(self._raw, column)
+
+    def load_column(self, raw, key:str):
+        """
+        Load a single column into `data`, along with any columns it is derived from
+        """
+        match key:
+            case 'radius':
+                if 'volume' not in self.data: self.load_column(raw, 'volume')
+                self.data['radius'] = np.sqrt(self.data.volume/np.pi)
+            case 'potency':
+                self.load_value(raw, "potency")
+                self.data.loc[self.data.potency < 0, 'potency'] = np.nan
+            case 'damage':
+                self.load_value(raw, "damage", 0)
+                self.data.loc[self.data.damage < 0, 'damage'] = np.nan
+            case 'cell_type':
+                self.load_value(raw, "cell_type")
+                self.data['cell_type'] = categorise_cell_types(self.data.cell_type, self.cell_type_names)
+                self._cell_type_index = None
+            case 'tissue_stress':
+                for c in ['radius', 'target_radius']:
+                    if c not in self.data: self.load_column(raw, c)
+                self.data['tissue_stress'] = 1 - self.data['radius']/self.data['target_radius']
+                self.data.loc[~np.isfinite(self.data.tissue_stress), 'tissue_stress'] = -1
+            case 'exhaustion %':
+                if self.sim.parameters and 'CD8InitialPotency' in self.sim.parameters:
+                    if 'potency' not in self.data: self.load_column(raw, 'potency')
+                    self.data['exhaustion %'] = 1-self.data['potency']/self.sim.parameters['CD8InitialPotency']
+            case 'cell_id':
+                cell_ids = getattr(self.sim, 'cell_ids', dict())
+                if self.timestep in cell_ids: self.data['cell_id'] = np.asarray(cell_ids[self.timestep], dtype=self.id_dtype)
+            case _:
+                self.load_value(raw, key)
 
-    
     def load_value(self, raw, name, default=np.nan, new_key=None):
         if new_key is None: new_key = name
         if name in raw.keys():
-            self.data[new_key] = raw[name]
-        else:
+            self.data[new_key] = self.as_float(raw[name])
+        elif self.float_dtype is None:
             self.data[new_key] = default
+        else:
+            self.data[new_key] = np.full(len(self.data), default, dtype=self.float_dtype)
         self.columns.add(new_key)
 
+    def copy(self):
+        """
+        Copy of the timepoint with its own `data`, lazily loaded columns are still read from the same source
+        """
+        tp = copy.copy(self)
+        tp.data = self.data.copy()
+        tp._cell_type_index = self._cell_type_index
+        tp.columns = set(self.columns)
+        return tp
+
+    def __getitem__(self, key:str|list[str]):
+        """
+        Column access which loads columns of lazily loaded timepoints on first access
+        """
+        self.load_columns([key] if isinstance(key, str) else key)
+        return self.data[key]
+
+    @property
+    def cell_type_index(self)->dict[str,np.ndarray]:
+        """
+        Row positions of each cell type in `data`, computed once and reused by the cell type subset properties.
+        Reset when `data` is replaced, call `reset_cell_type_index` after editing rows or cell types in place.
+        """
+        if self._cell_type_index is None:
+            self.load_columns(['cell_type'])
+            cell_type = self.data.cell_type
+            if isinstance(cell_type.dtype, pd.CategoricalDtype):
+                codes, categories = cell_type.cat.codes.to_numpy(), cell_type.cat.categories
+            else:
+                codes, categories = pd.factorize(cell_type)
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(categories)+1))
+            self._cell_type_index = {c: order[bounds[i]:bounds[i+1]] for i,c in enumerate(categories)}
+        return self._cell_type_index
+
+    def reset_cell_type_index(self):
+        self._cell_type_index = None
+
+    def _cell_type_data(self, cell_type:str)->pd.DataFrame:
+        return self.data.iloc[self.cell_type_index.get(cell_type, np.empty(0, dtype=np.intp))]
+
     @property
     def cytotoxic_data(self):
-        return self.data.loc[self.data.cell_type == 'T Cell']
+        return self._cell_type_data('T Cell')
     
     @property
     def stroma_data(self):
-        return self.data.loc[self.data.cell_type == 'Stroma']
+        return self._cell_type_data('Stroma')
 
     @property
     def tumour_data(self):
-        return self.data.loc[self.data.cell_type == 'Tumour']
+        return self._cell_type_data('Tumour')
     
     @property
     def macrophages_data(self):
-        return self.data.loc[self.data.cell_type == 'Macrophage']
+        return self._cell_type_data('Macrophage')
     
     @property
     def macrophage_data(self):
-        return self.data.loc[self.data.cell_type == 'Macrophage']
+        return self._cell_type_data('Macrophage')
     
     @property
     def blood_vessel_data(self):
-        return self.data.loc[self.data.cell_type == 'Blood Vessel']
+        return self._cell_type_data('Blood Vessel')
 
     @property
     def ccl5_data(self):
@@ -134,13 +303,16 @@ class SimulationTimepoint:
 
     def read_pde(self, file, chemokine=None):
         if (chemokine is None): chemokine = file
+        if getattr(self.sim, 'use_pde_store', False):
+            try:
+                store = self.sim.pde_store(file, chemokine, wait=False)
+            except FileNotFoundError:
+                store = None
+            if store is not None and self.timestep in store: return store[self.timestep]
         p = pathlib.Path(self.results_folder, f"pde_results_{file}_{self.timestep}.vtu")
-        reader = vtk.vtkXMLUnstructuredGridReader()
-        reader.SetFileName(str(p))
-        reader.Update()
-        output = dsa.WrapDataObject(reader.GetOutput())
-        shape = output.Points.max(axis=0)
-        shape = (int(np.sqrt(output.Points.shape[0])), int(np.sqrt(output.Points.shape[0])))
+        output = read_vtu(p, reader=self.sim.vtu_reader, lazy=True)
+        if output is None: raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), p)
+        shape = (int(np.sqrt(output.GetNumberOfPoints())), int(np.sqrt(output.GetNumberOfPoints())))
         #shape = (51,51)
         return output.PointData[chemokine].reshape(shape)
     
@@ -158,39 +330,26 @@ class SimulationTimepoint:
 
 
 class MacrophageSimulationTimepoint(SimulationTimepoint):
-    def __init__(self, id, name, results_folder:pathlib.Path, timestep:int, sim:Simulation):
-        super().__init__(id, name ,results_folder, timestep, sim)
-
-    def load_data(self, raw):
-        self.load_value(raw, 'csf1')
-        self.load_value(raw, 'csf1_grad_x')
-        self.load_value(raw, 'csf1_grad_y')
-        self.load_value(raw, 'cxcl12')
-        self.load_value(raw, 'cxcl12_grad_x')
-        self.load_value(raw, 'cxcl12_grad_y')
-        self.load_value(raw, 'egf')
-        self.load_value(raw, 'egf_grad_x')
-        self.load_value(raw, 'egf_grad_y')
-        self.load_value(raw, 'oxygen')
-        self.load_value(raw, 'phenotype')
-        self.load_value(raw, 'tgf')
-        self.load_value(raw, 'tgf_grad_x')
-        self.load_value(raw, 'tgf_grad_y')
-        self.load_value(raw, 'volume')
-        self.load_value(raw, 'target_radius')
-        self.load_value(raw, 'pressure')
-        self.data['radius'] = np.sqrt(self.data.volume / np.pi)
-
-        self.load_value(raw, "cell_type", new_key="cell_type_raw")
-        self.load_value(raw, "cell_type")
-        def interpret_cell_type(cell_type):
-            if cell_type == 0: return 'Stroma'
-            elif cell_type == 1: return 'Tumour'
-            elif cell_type == 4: return 'Blood Vessel'
-            elif cell_type == 7: return 'Macrophage'
-            elif cell_type == 3: return 'Macrophage'
-            else: return 'Unknown'
-        self.data['cell_type'] = list(map(interpret_cell_type, self.data.cell_type))
+    default_columns = ['csf1', 'csf1_grad_x', 'csf1_grad_y', 'cxcl12', 'cxcl12_grad_x', 'cxcl12_grad_y', 'egf', 'egf_grad_x', 'egf_grad_y',
+                       'oxygen', 'phenotype', 'tgf', 'tgf_grad_x', 'tgf_grad_y', 'volume', 'target_radius', 'pressure', 'radius', 'cell_type_raw', 'cell_type']
+    cell_type_names = {0: 'Stroma', 1: 'Tumour', 3: 'Macrophage', 4: 'Blood Vessel', 7: 'Macrophage'}
+
+    def __init__(self, id, name, results_folder:pathlib.Path, timestep:int, sim:Simulation, columns:list[str]|None=None):
+        super().__init__(id, name ,results_folder, timestep, sim, columns=columns)
+
+    def load_column(self, raw, key:str):
+        match key:
+            case 'radius':
+                if 'volume' not in self.data: self.load_column(raw, 'volume')
+                self.data['radius'] = np.sqrt(self.data.volume / np.pi)
+            case 'cell_type_raw':
+                self.load_value(raw, "cell_type", new_key="cell_type_raw")
+            case 'cell_type':
+                self.load_value(raw, "cell_type")
+                self.data['cell_type'] = categorise_cell_types(self.data.cell_type, self.cell_type_names)
+                self._cell_type_index = None
+            case _:
+                self.load_value(raw, key)
 
     @property
     def cxcl12_data(self):
@@ -209,55 +368,61 @@ class MacrophageSimulationTimepoint(SimulationTimepoint):
         return self.read_pde('tgf')
     
     def read_vessels(self):
-        p = pathlib.Path(self.results_folder, f"results.parameters")
-        tree = xml.etree.ElementTree.parse(p)
-        raw = tree.find('SimulationModifiers/EllipticBoxDomainPdeModifier_VariableTimestep_PointVesselBCs-2/mVesselLocations')
-        assert raw is not None, f"Could not find vessel locations in {p}"
-        vesselLocations = [[float(x) for x in p.strip('[], \t').split(',')] for p in raw.text.strip(' ,\t').split('],[')]
-        for xy in vesselLocations: self.data.loc[len(self.data), ['x', 'y', 'cell_type', 'oxygen', 'radius']] =\
-            [xy[0], xy[1], 'Blood Vessel', 1, .5]
+        """
+        Append a 'Blood Vessel' row for each point vessel of the simulation, see `read_vessel_locations`.
+        Locations are cached on a `MacrophageSimulation`, so results.parameters is only parsed once per simulation.
+        """
+        locations = self.sim.vessel_locations if hasattr(self.sim, 'vessel_locations') else read_vessel_locations(self.results_folder)
+        n = len(locations)
+        if n == 0: return
+        cell_type = ['Blood Vessel']*n
+        if 'cell_type' in self.data and isinstance(self.data.cell_type.dtype, pd.CategoricalDtype):
+            cell_type = pd.Categorical(cell_type, categories=self.data.cell_type.cat.categories)
+        float_dtype = float if self.float_dtype is None else self.float_dtype
+        vessels = pd.DataFrame({
+            'x': locations[:,0].astype(float_dtype), 'y': locations[:,1].astype(float_dtype), 'cell_type': cell_type,
+            'oxygen': np.ones(n, dtype=float_dtype), 'radius': np.full(n, .5, dtype=float_dtype)},
+            index=pd.RangeIndex(len(self.data), len(self.data)+n))
+        self.data = pd.concat([self.data, vessels])
 
 
 
 class LiverMetSimulationTimepoint(SimulationTimepoint):
-    def __init__(self, id, name, results_folder:pathlib.Path, timestep:int, sim:Simulation):
-        super().__init__(id, name ,results_folder, timestep, sim)
-
-    def load_data(self, raw):
-        self.load_value(raw, 'oxygen')
-        self.load_value(raw, 'CXCL8')
-        self.load_value(raw, 'volume')
-        self.data['radius'] = .5#np.sqrt(self.data.volume / np.pi)
-
-        self.load_value(raw, 'Legacy Cell types', new_key='cell_type')
-        def interpret_cell_type(cell_type):
-            match cell_type:
-                case 10: return 'T-Cell'
-                case 11: return 'Background'
-                case 12: return 'Met'
-                case 13: return 'Neutrophil'
-                case 14: return 'Fibroblast'
-                case _: return 'Unknown'
-        self.data['cell_type'] = list(map(interpret_cell_type, self.data.cell_type))
+    default_columns = ['oxygen', 'CXCL8', 'volume', 'radius', 'cell_type']
+    cell_type_names = {10: 'T-Cell', 11: 'Background', 12: 'Met', 13: 'Neutrophil', 14: 'Fibroblast'}
+
+    def __init__(self, id, name, results_folder:pathlib.Path, timestep:int, sim:Simulation, columns:list[str]|None=None):
+        super().__init__(id, name ,results_folder, timestep, sim, columns=columns)
+
+    def load_column(self, raw, key:str):
+        match key:
+            case 'radius':
+                self.data['radius'] = self.as_float(np.full(len(self.data), .5))#np.sqrt(self.data.volume / np.pi)
+            case 'cell_type':
+                self.load_value(raw, 'Legacy Cell types', new_key='cell_type')
+                self.data['cell_type'] = categorise_cell_types(self.data.cell_type, self.cell_type_names)
+                self._cell_type_index = None
+            case _:
+                self.load_value(raw, key)
 
     @property
     def tcell_data(self):
-        return self.data.loc[self.data.cell_type == 'T-Cell']
+        return self._cell_type_data('T-Cell')
         
     @property
     def background_data(self):
-        return self.data.loc[self.data.cell_type == 'Background']
+        return self._cell_type_data('Background')
 
     @property
     def met_data(self):
-        return self.data.loc[self.data.cell_type == 'Met']
+        return self._cell_type_data('Met')
 
     @property
     def neutrophil_data(self):
-        return self.data.loc[self.data.cell_type == 'Neutrophil']
+        return self._cell_type_data('Neutrophil')
 
     @property
     def fibroblast_data(self):
-        return self.data.loc[self.data.cell_type == 'Fibroblast']
+        return self._cell_type_data('Fibroblast')
 
 
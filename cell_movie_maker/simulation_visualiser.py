@@ -12,11 +12,19 @@ import re
 import subprocess
 import errno
 from .config import Config
+from . import frame_keys
+from . import sharding
 
 
 class AbstractSimulationVisualiser:
+    # Attributes which do not change the rendered frames, left out of `render_hash`
+    render_hash_ignore = {'output_folder', 'incremental', 'render_hash', 'stale', 'start', 'stop', 'step'}
+
     def __init__(self, visualisation_name = 'abstract', output_parent_folder = None, make_folder_if_not_exists=False):
         self.visualisation_name = visualisation_name
+        self.incremental = False
+        self.render_hash:str|None = None
+        self.stale:dict[str,set[int]]|None = None # Stale frame numbers by results folder, when rendering an experiment incrementally
         self.figsize = (8,8)
         self.postprocess = None
 
@@ -27,14 +35,62 @@ class AbstractSimulationVisualiser:
         if (not os.path.exists(self.output_folder)): raise FileNotFoundError(self.output_folder)
 
         
+    def frame_files(self, sim:Simulation, timestep:int, frame_num:int)->list[pathlib.Path]:
+        """
+        Files written for a frame, a frame is only up to date if all of them exist
+        """
+        return [self.output_folder.joinpath(sim.name, sim.id, self.visualisation_name, 'frame_{}.png'.format(timestep if self.label_frames_with_timestep else frame_num))]
+
     def post_frame(self, sim:Simulation, timepoint:SimulationTimepoint, frame_num:int, fig:plt.Figure, ax:plt.Axes|np.ndarray[plt.Axes]):
-        fig.savefig(self.output_folder.joinpath(sim.name, sim.id, self.visualisation_name, 'frame_{}.png'.format(timepoint.timestep if self.label_frames_with_timestep else frame_num)),
+        fig.savefig(self.frame_files(sim, timepoint.timestep, frame_num)[0],
                     bbox_inches='tight', pad_inches=0, dpi=300)
 
+    def journal_file(self, sim:Simulation)->pathlib.Path:
+        """
+        Keys of the rendered frames, see `stale_frames`
+        """
+        return self.output_folder.joinpath(sim.name, sim.id, f'.{self.visualisation_name}.frames.jsonl')
+
+    def set_incremental(self, incremental:bool|None=None)->bool:
+        """
+        Set `incremental`, defaulting to `Config.incremental_frames`, and compute `render_hash` from the current configs.
+        Called by every entry point before frames are planned or rendered, so workers receive the hash with the visualiser
+        """
+        self.incremental = Config.incremental_frames if incremental is None else incremental
+        self.render_hash = frame_keys.stable_hash(self, ignore=self.render_hash_ignore) if self.incremental else None
+        return self.incremental
+
+    def frame_key(self, sim:Simulation, timestep:int, frame_num:int)->str:
+        if self.render_hash is None: self.render_hash = frame_keys.stable_hash(self, ignore=self.render_hash_ignore)
+        return frame_keys.frame_key(self.render_hash, pathlib.Path(sim.results_folder, f'results_{timestep}.vtu'), timestep, frame_num)
+
+    def frames_to_render(self, sim:Simulation, start=0, stop=None, step=1)->set[int]|None:
+        """
+        Stale frame numbers when rendering incrementally, None to render every frame
+        """
+        if not self.incremental: return None
+        return self.stale_frames(sim, sim.timepoints[start:stop:step].timesteps)
+
+    def stale_frames(self, sim:Simulation, timesteps:list[int])->set[int]:
+        """
+        Frame numbers which need rendering, because a file of the frame is missing or its key has changed.
+        A frame's key combines `render_hash` (the visualiser and its configs) with the size and mtime of the timepoint's results file.
+        The journal is only read here and appended to by workers, never rewritten, so shards and queue workers rendering the
+        same simulation concurrently do not lose each other's records.
+        """
+        recorded = frame_keys.read_journal(self.journal_file(sim))
+        stale = set()
+        for frame_num, timestep in enumerate(timesteps):
+            key = self.frame_key(sim, timestep, frame_num)
+            if recorded.get(frame_num) != key or not all(f.exists() for f in self.frame_files(sim, timestep, frame_num)):
+                stale.add(frame_num)
+        return stale
+
     def visualise_frame(self, sim:Simulation, timepoint:SimulationTimepoint, frame_num:int)->tuple[plt.Figure,plt.Axes|np.ndarray[plt.Axes]]:
         raise NotImplementedError()
     
     def _visualise_frame(self, args:tuple[Simulation,SimulationTimepoint,int]):
+        if self.stale is not None and args[2] not in self.stale.get(str(args[0].results_folder), ()): return
         try:
             fig, ax = self.visualise_frame(*args)
             if fig is not None:
@@ -42,14 +98,35 @@ class AbstractSimulationVisualiser:
                     self.postprocess(fig, ax, *args)
                 self.post_frame(*args, fig, ax)
                 plt.close(fig)
+            if self.incremental:
+                sim, timepoint, frame_num = args
+                frame_keys.append_journal(self.journal_file(sim), frame_num, self.frame_key(sim, timepoint.timestep, frame_num))
         except Exception as e:
             logging.error(f'Error processing frame #{args[1]}: {e}')
             raise e
 
-    def visualise(self, sim, start=0, stop=None, step=1, clean_dir=True, maxproc=64, auto_execute=True, disable_tqdm=False):
-        self.create_output_folder(sim, clean_dir=clean_dir)
+    def visualise(self, sim, start=0, stop=None, step=1, clean_dir=True, maxproc=None, auto_execute=True, disable_tqdm=False, incremental:bool=None,
+                  shard:sharding.Shard|str|None=None):
+        """
+        Render a frame for each timepoint in `sim.timepoints[start:stop:step]`
+
+        Parameters
+        ----------
+        incremental : bool, optional (default Config.incremental_frames)
+            Keep the output folder (ignoring clean_dir) and only render frames which are missing or stale, see `stale_frames`
+        shard : Shard|str|None, optional (default None)
+            Only render this shard's share of the frames ('index/count'), for array jobs. The output folder is kept
+        """
+        self.set_incremental(incremental)
+        self.stale = None
+        self.create_output_folder(sim, clean_dir=clean_dir and not self.incremental and shard is None)
 
-        sim.for_timepoint(self._visualise_frame, start=start, stop=stop, step=step, maxproc=maxproc, disable_tqdm=disable_tqdm, tqdm_kwargs=dict(desc=f'{self.visualisation_name}'))
+        only = self.frames_to_render(sim, start=start, stop=stop, step=step)
+        if shard is not None:
+            frames = sharding.shard_frames(sim.results_folder, sim.timepoints[start:stop:step].timesteps, sharding.parse_shard(shard))
+            only = frames if only is None else only & frames
+        if only is not None and len(only) == 0: return
+        sim.for_timepoint(self._visualise_frame, start=start, stop=stop, step=step, maxproc=maxproc, disable_tqdm=disable_tqdm, tqdm_kwargs=dict(desc=f'{self.visualisation_name}'), only=only)
     
     def create_output_folder(self, sim, *, clean_dir:bool):
         output_folder:pathlib.Path = self.output_folder.joinpath(sim.name, sim.id, self.visualisation_name)
@@ -4,7 +4,7 @@ import os
 import pathlib
 import re
 import tqdm
-import multiprocessing
+from .. import parallel
 import pandas as pd
 from ..simulation_timepoint import SimulationTimepoint
 
@@ -49,8 +49,8 @@ class SVGStitcher:
         else: stop = min(max_n, stop)
         
         if maxproc > 1:
-            with multiprocessing.Pool(processes=min(multiprocessing.cpu_count()-1, maxproc)) as pool:
-                _=list(tqdm.tqdm(pool.imap(self.process_frame, range(start, stop, step)),
+            with parallel.Executor(parallel.n_processes(maxproc)) as pool:
+                _=list(tqdm.tqdm(pool.map(self.process_frame, range(start, stop, step), ordered=False),
                                  total=(stop-start)//step))
         else:
             for i in tqdm.tqdm(range(start, stop, step), total=(stop-start)//step):
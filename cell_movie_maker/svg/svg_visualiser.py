@@ -6,10 +6,12 @@ import os
 import shutil
 import pathlib
 import logging
+from ..config import Config
 
 class SVGVisualiser(AbstractSimulationVisualiser):
     def __init__(self, visualisation_name='svg', width=100, height=100, **kwargs):
         super().__init__(visualisation_name=visualisation_name, **kwargs)
+        self.offset = 0
         self.writers = [
             SVGWriter(width, height),
             TumourSVGWriter(width=width, height=height),
@@ -20,28 +22,42 @@ class SVGVisualiser(AbstractSimulationVisualiser):
             DensitySVGWriter(width=width, height=height),
         ]
 
+    def frame_files(self, sim:Simulation, timestep:int, frame_num:int)->list[pathlib.Path]:
+        return [self.output_folder.joinpath(sim.name, sim.id, w.name, f'frame_{frame_num+self.offset}.svg') for w in self.writers]
+
     def visualise_frame(self, sim:Simulation, tp:SimulationTimepoint, frame_num:int):
-        for w in self.writers:
+        for w, p in zip(self.writers, self.frame_files(sim, tp.timestep, frame_num)):
             svg = w.to_svg(tp, sim)
-            p = pathlib.Path(self.output_folder, w.name)
-            if not p.exists():
-                p.mkdir(exist_ok=True)
-            with open(pathlib.Path(p, f'frame_{frame_num}.svg'), 'w') as f:
+            if not p.parent.exists():
+                p.parent.mkdir(parents=True, exist_ok=True)
+            with open(p, 'w') as f:
                 f.write(svg)
+        return None, None
+
+    def visualise(self, sim, auto_execute=True, maxproc=None, start=0, stop=None, step=1, clean_dir=True,
+                  disable_tqdm=False, offset=0, incremental:bool=None):
+        """
+        Write an svg per writer for each timepoint in `sim.timepoints[start:stop:step]`, numbered from `offset`
 
-    def visualise(self, sim, auto_execute=True, maxproc=64, start=0, stop=None, step=1, clean_dir=True,
-                  disable_tqdm=False, offset=0):
+        Parameters
+        ----------
+        incremental : bool, optional (default Config.incremental_frames)
+            Keep existing frames (ignoring clean_dir) and only write frames which are missing or stale
+        """
+        self.offset = offset
+        self.set_incremental(incremental)
+        self.stale = None
         if auto_execute:
             for w in self.writers:
-                if os.path.exists(self.output_folder.joinpath(sim.name, sim.id, w.name)) and clean_dir:
+                if os.path.exists(self.output_folder.joinpath(sim.name, sim.id, w.name)) and clean_dir and not self.incremental:
                     shutil.rmtree(self.output_folder.joinpath(sim.name, sim.id, w.name))
-                pathlib.Path(os.path.join(self.output_folder, w.name)).mkdir(exist_ok=True,parents=True)
+                self.output_folder.joinpath(sim.name, sim.id, w.name).mkdir(exist_ok=True,parents=True)
         
         self.start = start
         self.stop = stop
         self.step = step
 
         if auto_execute:
-            sim.for_timepoint(self.visualise_frame, start=self.start, stop=self.stop, step=self.step, maxproc=maxproc, disable_tqdm=disable_tqdm, offset=offset)
-
-
+            only = self.frames_to_render(sim, start=self.start, stop=self.stop, step=self.step)
+            if only is not None and len(only) == 0: return
+            sim.for_timepoint(self._visualise_frame, start=self.start, stop=self.stop, step=self.step, maxproc=maxproc, disable_tqdm=disable_tqdm, only=only)
@@ -0,0 +1,421 @@
+"""
+Task queue held in a folder on a shared filesystem, for any number of workers on any number of nodes.
+
+Each task is a small JSON file, and every change of state is a single rename, which is atomic on POSIX filesystems
+(including NFS and Lustre within one folder tree)::
+
+    pending/<key>__<attempt>.json           -> leased/<key>__<attempt>__<worker>.json   (claim)
+    leased/<key>__<attempt>__<worker>.json  -> done/<key>.json                          (complete)
+                                            -> pending/<key>__<attempt+1>.json          (fail, or lease expired)
+                                            -> failed/<key>.json                        (out of attempts)
+
+Only one worker's rename of a file can succeed, so a task is leased by one worker at a time. Workers renew their
+lease by touching the leased file, and any worker requeues leases which have not been renewed for `lease_seconds`,
+so tasks of workers which died are picked up again. Lease ages are measured against the filesystem's own clock,
+so clocks of different nodes need not agree. Tasks should be idempotent, a worker which lost its lease may still
+finish a task which is also run by another worker.
+
+Workers can be started and stopped at any time during a run, e.g. with `python -m cell_movie_maker visualise --queue`.
+"""
+from __future__ import annotations
+import collections
+import functools
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import re
+import shutil
+import socket
+import threading
+import time
+import typing
+from .config import Config
+from . import parallel
+from . import scheduler
+
+
+# <order>-<hash of the task>, attempt and, while leased, the worker holding the lease
+task_file_regex = re.compile(r'^(?P<key>\d+-[0-9a-f]+)(?:__(?P<attempt>\d+)(?:__(?P<worker>.+))?)?\.json$')
+
+
+def worker_name()->str:
+    return f'{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}'.replace('__', '_')
+
+
+class Lease:
+    """
+    A claimed task, hold it by calling `renew` more often than every `lease_seconds`
+    """
+    def __init__(self, queue:TaskQueue, path:pathlib.Path, key:str, attempt:int, task:dict):
+        self.queue = queue
+        self.path = path
+        self.key = key
+        self.attempt = attempt
+        self.task = task
+
+    def renew(self)->bool:
+        """
+        Extend the lease, False if it has been lost to another worker
+        """
+        try:
+            os.utime(self.path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self)->bool:
+        """
+        Mark the task done, False if the lease had been lost
+        """
+        try:
+            os.rename(self.path, self.queue.folder.joinpath('done', f'{self.key}.json'))
+            return True
+        except FileNotFoundError:
+            logging.warning(f'Lease of task {self.key} was lost before it completed')
+            return False
+
+    def fail(self, error:str='')->bool:
+        """
+        Requeue the task, or move it to failed/ with the error once it has used `max_attempts`
+        """
+        return self.queue._retry(self.path, self.key, self.attempt, error)
+
+
+class TaskQueue:
+    """
+    Queue of JSON tasks in a folder, see the module documentation
+
+    Parameters
+    ----------
+    folder : str|pathlib.Path
+        Folder of the queue, on a filesystem shared by every worker
+    lease_seconds : float, optional (default 600)
+        Time after which a lease which has not been renewed is requeued
+    max_attempts : int, optional (default 3)
+        Attempts at a task before it is moved to failed/
+    """
+    states = ('pending', 'leased', 'done', 'failed')
+
+    def __init__(self, folder:str|pathlib.Path, lease_seconds:float=600, max_attempts:int=3):
+        self.folder = pathlib.Path(folder)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._pending:collections.deque[str] = collections.deque() # Names listed in pending/ not yet tried by this worker
+        self._requeued = -float('inf') # time.monotonic() of the last requeue_expired
+        for d in (*self.states, 'tmp', 'workers'): self.folder.joinpath(d).mkdir(parents=True, exist_ok=True)
+
+    @property
+    def planned(self)->bool:
+        return self.folder.joinpath('planned').exists()
+
+    def put(self, tasks:typing.Iterable[dict])->int:
+        """
+        Add tasks, which are claimed in the order they are added. A task which is already queued, leased, done or failed
+        is not added again
+
+        Returns
+        -------
+        int
+            Number of tasks added
+        """
+        existing = {m['key'].split('-')[1] for d in self.states for m in map(task_file_regex.match, os.listdir(self.folder.joinpath(d))) if m}
+        n = len(existing)
+        for task in tasks:
+            content = json.dumps(task, sort_keys=True)
+            digest = hashlib.sha1(content.encode()).hexdigest()[:16]
+            if digest in existing: continue
+            # Numbered so pending tasks sort in the order they were added
+            key = f'{len(existing):09d}-{digest}'
+            tmp = self.folder.joinpath('tmp', f'{key}.{os.getpid()}.{threading.get_ident()}')
+            tmp.write_text(content)
+            os.rename(tmp, self.folder.joinpath('pending', f'{key}__0.json'))
+            existing.add(digest)
+        return len(existing) - n
+
+    def plan_once(self, tasks:typing.Callable[[],typing.Iterable[dict]], poll:float=1.)->bool:
+        """
+        Add the tasks of a run exactly once, whichever worker starts first plans while the others wait for it.
+        If the planning worker dies before finishing, remove the queue folder and start again.
+
+        Returns
+        -------
+        bool
+            True if this call planned the run
+        """
+        if self.planned: return False
+        try:
+            self.folder.joinpath('planning').mkdir()
+        except FileExistsError:
+            while not self.planned: time.sleep(poll)
+            return False
+        n = self.put(tasks())
+        self.folder.joinpath('planned').write_text(json.dumps(dict(tasks=n, worker=worker_name(), time=time.time())))
+        logging.info(f'Planned {n} tasks in {self.folder}')
+        return True
+
+    def _now(self)->float:
+        # Current time of the filesystem, from a file touched by this worker, which also records the worker as alive
+        p = self.folder.joinpath('workers', worker_name())
+        p.touch()
+        return p.stat().st_mtime
+
+    def _retry(self, path:pathlib.Path, key:str, attempt:int, error:str='')->bool:
+        try:
+            if attempt+1 < self.max_attempts:
+                os.rename(path, self.folder.joinpath('pending', f'{key}__{attempt+1}.json'))
+            else:
+                os.rename(path, self.folder.joinpath('failed', f'{key}.json'))
+                if error: self.folder.joinpath('failed', f'{key}.error').write_text(error)
+            return True
+        except FileNotFoundError:
+            return False # Requeued or completed by another worker
+
+    def requeue_expired(self)->int:
+        """
+        Requeue leases which have not been renewed for `lease_seconds`
+
+        Returns
+        -------
+        int
+            Number of leases requeued by this call
+        """
+        now, n = self._now(), 0
+        self._requeued = time.monotonic()
+        for f in os.scandir(self.folder.joinpath('leased')):
+            m = task_file_regex.match(f.name)
+            if m is None or m['worker'] is None: continue
+            try:
+                age = now - f.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if age > self.lease_seconds and self._retry(pathlib.Path(f.path), m['key'], int(m['attempt']), f'Lease of {m["worker"]} expired'):
+                logging.warning(f'Requeued task {m["key"]}, the lease of {m["worker"]} expired')
+                n += 1
+        return n
+
+    def claim(self)->Lease|None:
+        """
+        Lease the next pending task, None if there is none.
+        pending/ is listed once and tasks are claimed from that listing until it is used up, rather than listing the
+        folder for every claim. Tasks of the listing which other workers have claimed since fail to rename and are skipped,
+        tasks added or requeued since are found when the listing is used up.
+        """
+        listed = False
+        if not self._pending or time.monotonic() - self._requeued > self.lease_seconds/4: self.requeue_expired()
+        worker = worker_name()
+        while True:
+            if not self._pending:
+                if listed: return None
+                self._pending.extend(sorted(os.listdir(self.folder.joinpath('pending'))))
+                listed = True
+                continue
+            try:
+                name = self._pending.popleft()
+            except IndexError:
+                continue # Taken by another thread of this worker
+            m = task_file_regex.match(name)
+            if m is None or m['attempt'] is None: continue
+            leased = self.folder.joinpath('leased', f'{m["key"]}__{m["attempt"]}__{worker}.json')
+            try:
+                os.rename(self.folder.joinpath('pending', name), leased)
+            except FileNotFoundError:
+                continue # Claimed by another worker
+            os.utime(leased)
+            return Lease(self, leased, m['key'], int(m['attempt']), json.loads(leased.read_text()))
+
+    def counts(self)->dict[str,int]:
+        return {d:sum(1 for f in os.listdir(self.folder.joinpath(d)) if f.endswith('.json')) for d in self.states}
+
+    def finished(self)->bool:
+        counts = self.counts()
+        return self.planned and counts['pending'] == 0 and counts['leased'] == 0
+
+    def work(self, handler:typing.Callable[[dict],typing.Any], poll:float=5., stop_when_empty:bool=True)->int:
+        """
+        Claim and run tasks until the queue is finished, renewing each lease while its task runs.
+        A task whose handler raises is retried, up to `max_attempts`.
+
+        Parameters
+        ----------
+        handler : Callable[[dict], Any]
+            Called with each task
+        poll : float, optional (default 5)
+            Seconds between checks for new or expired tasks while other workers hold the remaining leases
+        stop_when_empty : bool, optional (default True)
+            Return once the queue is finished, otherwise keep waiting for new tasks
+
+        Returns
+        -------
+        int
+            Number of tasks completed by this worker
+        """
+        n = 0
+        while True:
+            lease = self.claim()
+            if lease is None:
+                if stop_when_empty and self.finished(): return n
+                time.sleep(poll)
+                continue
+
+            stop = threading.Event()
+            def heartbeat():
+                while not stop.wait(self.lease_seconds/4):
+                    if not lease.renew(): return
+            t = threading.Thread(target=heartbeat, daemon=True, name='cmm-lease')
+            t.start()
+            try:
+                handler(lease.task)
+            except Exception as e:
+                logging.error(f'Task {lease.key} failed: {e!r}')
+                lease.fail(repr(e))
+                continue
+            finally:
+                stop.set()
+                t.join()
+            n += lease.complete()
+
+    def reset(self):
+        """
+        Remove the queue, including its record of completed tasks
+        """
+        shutil.rmtree(self.folder)
+        self.__init__(self.folder, self.lease_seconds, self.max_attempts)
+
+
+def experiment_queue(experiment, job:str, **kwargs)->TaskQueue:
+    """
+    Queue of a job on an experiment, kept in the experiment's cmm_cache
+    """
+    return TaskQueue(pathlib.Path(experiment.experiment_folder).joinpath('cmm_cache', 'queues', job), **kwargs)
+
+
+class QueueContext(scheduler.ScheduleContext):
+    """
+    Simulations and jobs of a worker, tasks name their simulation by results folder so they do not depend on the order
+    of simulations seen by each worker
+    """
+    def simulation_of(self, task:dict):
+        folder = task['sim']
+        if not hasattr(self, '_folder_index'): self._folder_index = {str(f):i for i, f in enumerate(self.sim_folders)}
+        if folder not in self._folder_index:
+            self.sim_folders.append(folder)
+            self._folder_index[folder] = len(self.sim_folders)-1
+        return self.simulation(self._folder_index[folder])
+
+def _run_frame(context:QueueContext, task:dict):
+    sim = context.simulation_of(task)
+    tp = sim.read_timepoint(task['timestep'])
+    # Tasks planned incrementally list the jobs whose frames are stale
+    for i, job in enumerate(context.jobs):
+        if 'jobs' not in task or i in task['jobs']: job((sim, tp, task['frame_num']))
+
+def _run_simulation(context:QueueContext, task:dict):
+    sim = context.simulation_of(task)
+    for job in context.jobs: job(sim)
+
+def _work(args:tuple[TaskQueue,QueueContext,typing.Callable]):
+    queue, context, handler = args
+    return queue.work(lambda task: handler(context, task))
+
+def run(queue:TaskQueue, context:QueueContext, handler:typing.Callable[[QueueContext,dict],typing.Any], workers:int=1)->int:
+    """
+    Run `workers` worker processes on this node until the queue is finished
+
+    Returns
+    -------
+    int
+        Number of tasks completed on this node
+    """
+    if workers <= 1: return _work((queue, context, handler))
+    with parallel.Executor(workers) as executor:
+        return sum(executor.map(_work, [(queue, context, handler)]*workers, ordered=False))
+
+
+def _simulation_class():
+    from .simulation import Simulation
+    return Simulation if Config.simulation_class is None else Config.simulation_class
+
+def visualise(experiment, visualisers:list, start=0, stop=None, step=1, workers:int=8, job:str|None=None, incremental:bool|None=None, **kwargs)->int:
+    """
+    Render frames of every simulation as a worker of the experiment's queue, one task per timepoint.
+    Frames are planned by the first worker as in `Experiment.visualise`, most expensive first.
+    Output folders are kept, frames already rendered by other workers are not removed.
+
+    Parameters
+    ----------
+    workers : int, optional (default 8)
+        Worker processes on this node
+    job : str|None, optional (default None)
+        Name of the queue, defaults to visualise-<visualisation names>
+    incremental : bool, optional (default Config.incremental_frames)
+        Only plan the frames which the visualisers' journals do not show as up to date, each task naming the visualisers to run
+    **kwargs
+        Passed to `TaskQueue`
+    """
+    if job is None: job = 'visualise-' + '-'.join(v.visualisation_name for v in visualisers)
+    queue = experiment_queue(experiment, job, **kwargs)
+    sim_folders = [str(f) for f in experiment.sim_folders]
+    s = _simulation_class()
+    incremental = all([v.set_incremental(incremental) for v in visualisers])
+    for v in visualisers: v.stale = None
+    for f in sim_folders:
+        sim = s(f, lightweight=True)
+        for v in visualisers: v.create_output_folder(sim, clean_dir=False)
+    def tasks():
+        if not incremental:
+            return (dict(sim=sim_folders[t.sim], timestep=t.timestep, frame_num=t.frame_num)
+                    for t in scheduler.plan(experiment.sim_folders, start=start, stop=stop, step=step))
+        stale = dict()
+        for i, f in enumerate(sim_folders):
+            sim = s(f, lightweight=True)
+            stale[i] = [v.frames_to_render(sim, start, stop, step) for v in visualisers]
+        only = {i:set().union(*frames) for i, frames in stale.items()}
+        return (dict(sim=sim_folders[t.sim], timestep=t.timestep, frame_num=t.frame_num, jobs=[j for j, frames in enumerate(stale[t.sim]) if t.frame_num in frames])
+                for t in scheduler.plan(experiment.sim_folders, start=start, stop=stop, step=step, only=only))
+    queue.plan_once(tasks)
+    context = QueueContext(sim_folders, [v._visualise_frame for v in visualisers], s)
+    return run(queue, context, _run_frame, workers=workers)
+
+def preprocess(experiment, preprocessor, start=0, stop=None, step=1, workers:int=8, job:str|None=None, **kwargs)->int:
+    """
+    Run a preprocessor on every simulation as a worker of the experiment's queue, one task per simulation
+
+    Parameters
+    ----------
+    workers : int, optional (default 8)
+        Worker processes on this node
+    job : str|None, optional (default None)
+        Name of the queue, defaults to preprocess-<preprocessor name>
+    **kwargs
+        Passed to `TaskQueue`
+    """
+    if job is None: job = f'preprocess-{preprocessor.name}'
+    queue = experiment_queue(experiment, job, **kwargs)
+    sim_folders = [str(f) for f in experiment.sim_folders]
+    def tasks():
+        costs = [sum(scheduler.estimate_costs(pathlib.Path(f))[1]) for f in sim_folders]
+        return (dict(sim=sim_folders[i]) for i in sorted(range(len(sim_folders)), key=lambda i: -costs[i]))
+    queue.plan_once(tasks)
+    context = QueueContext(sim_folders, [functools.partial(preprocessor.process, start=start, stop=stop, step=step, disable_tqdm=True)], _simulation_class())
+    return run(queue, context, _run_simulation, workers=workers)
+
+def ingest(experiment, ingest, analyser, job:str|None=None, **kwargs)->int:
+    """
+    Ingest analysis of every simulation as a worker of the experiment's queue, one task per simulation.
+    Runs one worker in this process, `ingest_simulation` parallelises each simulation with `ingest.nproc` processes.
+
+    Parameters
+    ----------
+    job : str|None, optional (default None)
+        Name of the queue, defaults to ingest-<analyser classes>
+    **kwargs
+        Passed to `TaskQueue`
+    """
+    if job is None: job = 'ingest-' + '-'.join(type(a).__name__ for a in (analyser if isinstance(analyser, (list, tuple)) else [analyser]))
+    queue = experiment_queue(experiment, job, **kwargs)
+    sim_folders = [str(f) for f in experiment.sim_folders]
+    queue.plan_once(lambda: (dict(sim=f) for f in sim_folders))
+    context = QueueContext(sim_folders, [functools.partial(ingest.ingest_simulation, analyser=analyser)], _simulation_class(), max_open=1)
+    return run(queue, context, _run_simulation, workers=1)
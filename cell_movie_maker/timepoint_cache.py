@@ -0,0 +1,196 @@
+from .vtu_reader import VTUData, LazyPointData, read_vtu
+import os
+import threading
+import re
+import pathlib
+from . import parallel
+import itertools
+import tqdm
+import numpy as np
+
+
+cache_version = 1
+results_file_regex = re.compile(r'^results_(\d+)\.vtu$')
+points_column = '_points'
+
+
+def cache_folder(results_folder:str|pathlib.Path)->pathlib.Path:
+    """
+    Folder holding cached timepoints for a simulation, written next to `results_from_time_0`
+    """
+    return pathlib.Path(results_folder).parent.joinpath('cmm_cache', 'timepoints')
+
+def cache_file(results_file:str|pathlib.Path)->pathlib.Path:
+    results_file = pathlib.Path(results_file)
+    return cache_folder(results_file.parent).joinpath(results_file.with_suffix('.parquet').name)
+
+def source_signature(results_file:str|pathlib.Path)->dict[bytes,bytes]:
+    """
+    Metadata identifying the version of the source file a cache entry was built from.
+    A cache entry is only used while the size and mtime of the source file are unchanged.
+    """
+    stat = os.stat(results_file)
+    return {
+        b'cmm_cache_version': str(cache_version).encode(),
+        b'cmm_source_size': str(stat.st_size).encode(),
+        b'cmm_source_mtime_ns': str(stat.st_mtime_ns).encode(),
+    }
+
+def _is_current(metadata:dict[bytes,bytes]|None, results_file:pathlib.Path)->bool:
+    if metadata is None: return False
+    return all(metadata.get(k) == v for k,v in source_signature(results_file).items())
+
+def is_cached(results_file:str|pathlib.Path)->bool:
+    """
+    Check whether an up to date cache entry exists for a results file
+    """
+    import pyarrow.parquet as pq
+    p = cache_file(results_file)
+    if not p.exists(): return False
+    try:
+        return _is_current(pq.read_schema(p).metadata, pathlib.Path(results_file))
+    except Exception:
+        return False
+
+def _to_numpy(column)->np.ndarray:
+    column = column.combine_chunks()
+    if hasattr(column.type, 'list_size'):
+        return column.flatten().to_numpy(zero_copy_only=False).reshape(-1, column.type.list_size)
+    return column.to_numpy(zero_copy_only=False)
+
+
+class CachedColumns:
+    """
+    Picklable reader for a subset of the columns of a cache entry
+    """
+    def __init__(self, path:pathlib.Path):
+        self.path = pathlib.Path(path)
+
+    def __call__(self, names:list[str])->dict[str,np.ndarray]:
+        import pyarrow.parquet as pq
+        table = pq.read_table(self.path, columns=list(names))
+        return {name: _to_numpy(table.column(name)) for name in table.column_names}
+
+
+def read_cached(results_file:str|pathlib.Path, lazy:bool=False)->VTUData|None:
+    """
+    Load a timepoint from the cache
+
+    Parameters
+    ----------
+    results_file : str, pathlib.Path
+        Path to the source `results_<timestep>.vtu` file
+    lazy : bool, optional (default False)
+        Only read point locations now, point data columns are read when first accessed
+
+    Returns
+    -------
+    VTUData|None
+        Cached arrays, or None if there is no cache entry or it is out of date
+    """
+    import pyarrow.parquet as pq
+    p = cache_file(results_file)
+    if not p.exists(): return None
+    try:
+        if lazy:
+            schema = pq.read_schema(p)
+            if not _is_current(schema.metadata, pathlib.Path(results_file)): return None
+            columns = CachedColumns(p)
+            names = [name for name in schema.names if name != points_column]
+            return VTUData(columns([points_column])[points_column], LazyPointData(names, columns))
+        table = pq.read_table(p)
+    except Exception:
+        return None
+    if not _is_current(table.schema.metadata, pathlib.Path(results_file)): return None
+
+    point_data = {name: _to_numpy(table.column(name)) for name in table.column_names if name != points_column}
+    return VTUData(_to_numpy(table.column(points_column)), point_data)
+
+def write_cached(results_file:str|pathlib.Path, data:VTUData):
+    """
+    Write decoded timepoint arrays to the cache.
+    Written to a temporary file and renamed so concurrent readers never see a partial file.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    p = cache_file(results_file)
+    p.parent.mkdir(parents=True, exist_ok=True)
+
+    def to_arrow(array:np.ndarray):
+        array = np.ascontiguousarray(array)
+        if array.ndim == 1: return pa.array(array)
+        return pa.FixedSizeListArray.from_arrays(pa.array(array.reshape(-1)), array.shape[1])
+
+    columns = {points_column: to_arrow(data.Points)}
+    columns.update({k: to_arrow(v) for k,v in data.PointData.items()})
+    table = pa.table(columns).replace_schema_metadata(source_signature(results_file))
+
+    tmp = p.with_name(f'.{p.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        pq.write_table(table, tmp)
+        os.replace(tmp, p)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def convert_simulation(results_folder:str|pathlib.Path, overwrite:bool=False, reader:str='vtk')->int:
+    """
+    Build the timepoint cache for every results file in a simulation
+
+    Parameters
+    ----------
+    results_folder : str, pathlib.Path
+        Simulation folder or its `results_from_time_0` folder
+    overwrite : bool, optional (default False)
+        Rebuild entries even if they are up to date
+    reader : str, optional (default 'vtk')
+        Reader used to decode .vtu files, see `vtu_reader.read_vtu`
+
+    Returns
+    -------
+    int
+        Number of cache entries written
+    """
+    results_folder = pathlib.Path(results_folder)
+    if not results_folder.name == 'results_from_time_0': results_folder = results_folder.joinpath('results_from_time_0')
+    n = 0
+    for f in sorted(filter(results_file_regex.match, os.listdir(results_folder))):
+        results_file = results_folder.joinpath(f)
+        if not overwrite and is_cached(results_file): continue
+        data = read_vtu(results_file, reader=reader)
+        if data is None: continue
+        write_cached(results_file, data)
+        n += 1
+    return n
+
+def _convert_simulation(args:tuple[pathlib.Path,bool,str])->int:
+    return convert_simulation(*args)
+
+def convert_simulations(results_folders:list[str|pathlib.Path], maxproc:int|None=None, overwrite:bool=False, reader:str='vtk', disable_tqdm:bool=False)->int:
+    """
+    Build the timepoint cache for many simulations, one simulation per process
+
+    Parameters
+    ----------
+    results_folders : list[str|pathlib.Path]
+        Simulation folders to convert
+    maxproc : int|None, optional (default None)
+        Maximum number of processes to use, None for `Config.executor_max_workers` or one less than the CPU count
+    overwrite : bool, optional (default False)
+        Rebuild entries even if they are up to date
+    reader : str, optional (default 'vtk')
+        Reader used to decode .vtu files, see `vtu_reader.read_vtu`
+    disable_tqdm : bool, optional (default False)
+        If true disables tqdm printing a progress bar
+
+    Returns
+    -------
+    int
+        Number of cache entries written
+    """
+    results_folders = list(results_folders)
+    with parallel.Executor(parallel.n_processes(maxproc)) as pool:
+        r = list(tqdm.tqdm(pool.map(_convert_simulation, zip(results_folders, itertools.repeat(overwrite), itertools.repeat(reader)), ordered=False),
+            total=len(results_folders), disable=disable_tqdm, desc='Building timepoint cache'))
+    return sum(r)
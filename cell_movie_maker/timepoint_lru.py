@@ -0,0 +1,93 @@
+import collections
+import threading
+import typing
+
+
+class TimepointLRU:
+    """
+    Least recently used cache of decoded timepoints, bounded by the memory used by their DataFrames.
+    Timepoints are copied on the way out, so callers can add columns or edit rows without changing the cached frame.
+
+    Attributes
+    ----------
+    max_bytes : int
+        Memory budget, timepoints are evicted oldest first once it is exceeded. 0 disables the cache
+    hits : int
+        Number of reads served from the cache
+    misses : int
+        Number of reads that had to decode the timepoint
+    evictions : int
+        Number of timepoints evicted to stay within the budget
+    """
+    def __init__(self, max_bytes:int=0):
+        self.max_bytes:int = max_bytes
+        self.entries:collections.OrderedDict[typing.Hashable,tuple[typing.Any,int]] = collections.OrderedDict()
+        self.bytes:int = 0
+        self.hits:int = 0
+        self.misses:int = 0
+        self.evictions:int = 0
+        self.lock = threading.RLock() # Timepoints may be read from prefetch threads
+
+    def __getstate__(self):
+        # Cached frames are not sent to other processes
+        state = self.__dict__.copy()
+        state.update(entries=collections.OrderedDict(), bytes=0)
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key)->bool:
+        return key in self.entries
+
+    @property
+    def enabled(self)->bool:
+        return self.max_bytes > 0
+
+    def get(self, key:typing.Hashable):
+        """
+        Copy of the cached timepoint for key, or None if it is not cached
+        """
+        with self.lock:
+            if key not in self.entries: return None
+            self.entries.move_to_end(key)
+            tp = self.entries[key][0]
+        return tp.copy()
+
+    def put(self, key:typing.Hashable, tp):
+        """
+        Cache a copy of tp, evicting the least recently used timepoints to stay within `max_bytes`
+        """
+        if not self.enabled or tp is None: return
+        size = tp.memory_usage()
+        if size > self.max_bytes: return
+        tp = tp.copy()
+        with self.lock:
+            self.discard(key)
+            self.entries[key] = (tp, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def discard(self, key:typing.Hashable):
+        with self.lock:
+            if key in self.entries: self.bytes -= self.entries.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def info(self)->dict:
+        """
+        Hit/miss statistics and current memory use
+        """
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    timepoints=len(self.entries), bytes=self.bytes, max_bytes=self.max_bytes)
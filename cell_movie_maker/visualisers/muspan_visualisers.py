@@ -16,7 +16,7 @@ class AbstractMuspanVisualiser(AbstractSimulationVisualiser):
         self.muspan_pcf_config = MuspanPCFPlotter.Config()
 
     def visualise_frame(self, sim:Simulation, tp:SimulationTimepoint, frame_num:int)->tuple[plt.Figure,plt.Axes|np.ndarray[plt.Axes]]:
-        tp.data['tmp'] = tp.data.cell_type
+        tp.data['tmp'] = tp.data.cell_type.astype(str)
         tp.data.loc[(tp.data.cell_type=='Tumour') & (tp.data.damage > 1), 'tmp'] = 'Dead Tumour'
         pc = ms.pointcloud.generatePointCloud('Test',tp.data[['x', 'y']].to_numpy())
         pc.addLabels('Celltype', 'categorical', tp.data.cell_type.to_numpy())
@@ -7,7 +7,7 @@ import shutil
 import numpy as np
 import pathlib
 import logging
-import multiprocessing
+from .. import parallel
 import tqdm
 from ..config import Config
 import re
@@ -70,9 +70,9 @@ class RowVisualiser:
         self.postprocess_grid = postprocess
 
         times = list(range(start, stop, step))
-        with multiprocessing.Pool(processes=maxproc, maxtasksperchild=8) as p:
-            _ = list(tqdm.tqdm(p.imap(
-                self._visualise_frame, zip(range(len(times)), times, itertools.repeat(name))),
+        with parallel.Executor(maxproc, maxtasksperchild=8) as p:
+            _ = list(tqdm.tqdm(p.map(
+                self._visualise_frame, zip(range(len(times)), times, itertools.repeat(name)), ordered=False),
                 total=len(times), disable=disable_tqdm))
         
         
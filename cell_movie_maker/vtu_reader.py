@@ -0,0 +1,355 @@
+import numpy as np
+import pathlib
+import collections.abc
+import typing
+import binascii
+import zlib
+import lzma
+import xml.etree.ElementTree
+
+
+class VTUData:
+    """
+    Point locations and named point data arrays decoded from a results file.
+    Exposes the same `Points`, `PointData` and `GetNumberOfPoints` interface as the VTK dataset adapter,
+    so `SimulationTimepoint` can load from any reader without knowing where the arrays came from.
+
+    Attributes
+    ----------
+    Points : np.ndarray
+        (n_points, 3) array of point locations
+    PointData : dict[str, np.ndarray]
+        Point data arrays keyed by name
+    """
+    def __init__(self, points:np.ndarray, point_data:dict[str,np.ndarray]):
+        self.Points:np.ndarray = points
+        self.PointData:dict[str,np.ndarray] = point_data
+
+    def GetNumberOfPoints(self)->int:
+        return self.Points.shape[0]
+
+    @staticmethod
+    def empty():
+        return VTUData(np.empty((0,3)), dict())
+
+
+class LazyPointData(collections.abc.Mapping):
+    """
+    Point data arrays which are only decoded when first accessed.
+    Used by lazily loaded timepoints so that arrays which are never requested are never read.
+
+    Attributes
+    ----------
+    names : list[str]
+        Names of all point data arrays available in the source
+    fetch : Callable[[list[str]], dict[str, np.ndarray]]
+        Picklable callable which decodes the named arrays from the source
+    """
+    def __init__(self, names:list[str], fetch:typing.Callable[[list[str]],dict[str,np.ndarray]]):
+        self.names:list[str] = list(names)
+        self.fetch = fetch
+        self.arrays:dict[str,np.ndarray] = dict()
+
+    def __getitem__(self, name:str)->np.ndarray:
+        if name not in self.arrays:
+            if name not in self.names: raise KeyError(name)
+            self.arrays.update(self.fetch([name]))
+        return self.arrays[name]
+
+    def __contains__(self, name)->bool:
+        return name in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self)->int:
+        return len(self.names)
+
+    @property
+    def nbytes(self)->int:
+        """
+        Bytes held: decoded arrays, and the source's payload if it keeps one in memory
+        """
+        return sum(a.nbytes for a in self.arrays.values()) + getattr(self.fetch, 'nbytes', 0)
+
+
+class UnsupportedVTUError(Exception):
+    """
+    Raised by `VTUFile` for layouts it does not decode, callers fall back to VTK
+    """
+    pass
+
+
+vtk_types = {
+    'Int8': 'i1', 'UInt8': 'u1', 'Int16': 'i2', 'UInt16': 'u2', 'Int32': 'i4', 'UInt32': 'u4',
+    'Int64': 'i8', 'UInt64': 'u8', 'Float32': 'f4', 'Float64': 'f8',
+}
+decompressors = {
+    'vtkZLibDataCompressor': zlib.decompress,
+    'vtkLZMADataCompressor': lzma.decompress,
+}
+
+def _base64_length(n_bytes:int)->int:
+    return -(-n_bytes//3)*4
+
+
+class VTUFile:
+    """
+    Pure NumPy reader for the unstructured grid files written by Chaste.
+    Decodes Points and named PointData arrays without importing VTK.
+    Supports appended (raw or base64), inline binary and ascii DataArrays, optionally zlib or lzma compressed.
+
+    Instances are callable with a list of array names, so can be used as the fetch function of `LazyPointData`.
+
+    Attributes
+    ----------
+    file : pathlib.Path
+        Path to .vtu file
+    n_points : int
+        Number of points in the file
+    point_data_names : list[str]
+        Names of the point data arrays in the file
+    """
+    def __init__(self, file:str|pathlib.Path):
+        self.file = pathlib.Path(file)
+        self._load()
+
+    def _load(self):
+        self.content:bytes = self.file.read_bytes()
+        appended_start = self.content.find(b'<AppendedData')
+        if appended_start >= 0:
+            header = self.content[:appended_start] + b'</VTKFile>'
+            tag_end = self.content.index(b'>', appended_start)
+            self.appended_encoding = xml.etree.ElementTree.fromstring(self.content[appended_start:tag_end] + b'/>').get('encoding', 'raw')
+            self.appended_offset = self.content.index(b'_', tag_end) + 1
+        else:
+            header = self.content
+            self.appended_encoding = None
+            self.appended_offset = None
+        try:
+            root = xml.etree.ElementTree.fromstring(header)
+        except xml.etree.ElementTree.ParseError as e:
+            raise UnsupportedVTUError(f'Could not parse header of {self.file}: {e}')
+        if root.get('type') != 'UnstructuredGrid': raise UnsupportedVTUError(f'{self.file} is not an UnstructuredGrid')
+
+        self.byte_order = '<' if root.get('byte_order', 'LittleEndian') == 'LittleEndian' else '>'
+        self.header_type = np.dtype(self.byte_order + vtk_types[root.get('header_type', 'UInt32')])
+        compressor = root.get('compressor')
+        if compressor is not None and compressor not in decompressors:
+            raise UnsupportedVTUError(f'Unsupported compressor {compressor} in {self.file}')
+        self.decompress = decompressors.get(compressor)
+
+        pieces = root.findall('UnstructuredGrid/Piece')
+        if len(pieces) != 1: raise UnsupportedVTUError(f'{self.file} has {len(pieces)} pieces')
+        piece = pieces[0]
+        self.n_points = int(piece.get('NumberOfPoints'))
+        self.points_element = piece.find('Points/DataArray')
+        self.point_data_elements = {e.get('Name'): e for e in piece.findall('PointData/DataArray')}
+        self.point_data_names = list(self.point_data_elements.keys())
+
+    def __getstate__(self):
+        return dict(file=self.file)
+
+    def __setstate__(self, state):
+        self.file = state['file']
+        self._load()
+
+    def __call__(self, names:list[str])->dict[str,np.ndarray]:
+        return self.point_data(names)
+
+    @property
+    def nbytes(self)->int:
+        """
+        Size of the file contents held in memory
+        """
+        return len(self.content)
+
+    def points(self)->np.ndarray:
+        if self.points_element is None: return np.empty((0,3))
+        return self.decode(self.points_element)
+
+    def point_data(self, names:list[str]|None=None)->dict[str,np.ndarray]:
+        if names is None: names = self.point_data_names
+        return {name: self.decode(self.point_data_elements[name]) for name in names}
+
+    def read(self)->VTUData:
+        return VTUData(self.points(), self.point_data())
+
+    def read_lazy(self)->VTUData:
+        return VTUData(self.points(), LazyPointData(self.point_data_names, self))
+
+    def decode(self, element:xml.etree.ElementTree.Element)->np.ndarray:
+        """
+        Decode a single DataArray element into a numpy array
+        """
+        dtype = np.dtype(self.byte_order + vtk_types[element.get('type')])
+        n_components = int(element.get('NumberOfComponents', 1))
+        match element.get('format'):
+            case 'appended':
+                start = self.appended_offset + int(element.get('offset'))
+                if self.appended_encoding == 'raw': data = self._decode_raw(start)
+                elif self.appended_encoding == 'base64': data = self._decode_base64(start)
+                else: raise UnsupportedVTUError(f'Unsupported appended encoding {self.appended_encoding} in {self.file}')
+            case 'binary':
+                text = (element.text or '').strip().encode()
+                data = self._decode_base64(0, text)
+            case 'ascii':
+                return np.array((element.text or '').split(), dtype=dtype.newbyteorder('=')).reshape(self._shape(n_components))
+            case format:
+                raise UnsupportedVTUError(f'Unsupported DataArray format {format} in {self.file}')
+        array = np.frombuffer(data, dtype=dtype)
+        if not dtype.isnative: array = array.astype(dtype.newbyteorder('='))
+        return array.reshape(self._shape(n_components))
+
+    def _shape(self, n_components:int)->tuple[int,...]:
+        return (-1,) if n_components == 1 else (-1, n_components)
+
+    def _decode_raw(self, start:int)->bytes:
+        size = self.header_type.itemsize
+        if self.decompress is None:
+            n_bytes = int(np.frombuffer(self.content, self.header_type, 1, start)[0])
+            return self.content[start+size:start+size+n_bytes]
+        n_blocks = int(np.frombuffer(self.content, self.header_type, 1, start)[0])
+        header = np.frombuffer(self.content, self.header_type, 3+n_blocks, start)
+        block_start = start + size*(3+n_blocks)
+        blocks = []
+        for compressed_size in header[3:].tolist():
+            blocks.append(self.decompress(self.content[block_start:block_start+compressed_size]))
+            block_start += compressed_size
+        return b''.join(blocks)
+
+    def _decode_base64(self, start:int, content:bytes|None=None)->bytes:
+        if content is None: content = self.content
+        size = self.header_type.itemsize
+        if self.decompress is None:
+            # Header and data are encoded together
+            n_bytes = int(np.frombuffer(binascii.a2b_base64(content[start:start+_base64_length(size)])[:size], self.header_type)[0])
+            decoded = binascii.a2b_base64(content[start:start+_base64_length(size+n_bytes)])
+            return decoded[size:size+n_bytes]
+        # Header and compressed blocks are encoded separately
+        n_blocks = int(np.frombuffer(binascii.a2b_base64(content[start:start+_base64_length(size)])[:size], self.header_type)[0])
+        header_length = _base64_length(size*(3+n_blocks))
+        header = np.frombuffer(binascii.a2b_base64(content[start:start+header_length])[:size*(3+n_blocks)], self.header_type)
+        compressed_sizes = header[3:].tolist()
+        data_start = start + header_length
+        compressed = binascii.a2b_base64(content[data_start:data_start+_base64_length(sum(compressed_sizes))])
+        blocks = []
+        block_start = 0
+        for compressed_size in compressed_sizes:
+            blocks.append(self.decompress(compressed[block_start:block_start+compressed_size]))
+            block_start += compressed_size
+        return b''.join(blocks)
+
+
+def read_header(file:str|pathlib.Path, chunk_size:int=1<<16)->tuple[int,list[str]]:
+    """
+    Read the number of points and point data array names of a .vtu file without decoding any data.
+    For appended files only the XML header before the appended data is read.
+
+    Parameters
+    ----------
+    file : str, pathlib.Path
+        Path to .vtu file
+    chunk_size : int, optional (default 65536)
+        Number of bytes read at a time while looking for the end of the header
+
+    Returns
+    -------
+    tuple[int, list[str]]
+        Number of points and names of the point data arrays
+    """
+    content = b''
+    with open(file, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            search_start = max(0, len(content)-len(b'<AppendedData'))
+            content += chunk
+            appended_start = content.find(b'<AppendedData', search_start)
+            if appended_start >= 0:
+                content = content[:appended_start] + b'</VTKFile>'
+                break
+            if len(chunk) == 0: break
+    try:
+        root = xml.etree.ElementTree.fromstring(content)
+    except xml.etree.ElementTree.ParseError as e:
+        raise UnsupportedVTUError(f'Could not parse header of {file}: {e}')
+    piece = root.find('UnstructuredGrid/Piece')
+    if piece is None: raise UnsupportedVTUError(f'{file} is not an UnstructuredGrid')
+    return int(piece.get('NumberOfPoints')), [e.get('Name') for e in piece.findall('PointData/DataArray')]
+
+
+def read_numpy(file:str|pathlib.Path, lazy:bool=False)->VTUData|None:
+    """
+    Read a .vtu file using `VTUFile`, falling back to VTK for layouts it does not support
+
+    Parameters
+    ----------
+    file : str, pathlib.Path
+        Path to .vtu file
+    lazy : bool, optional (default False)
+        Only decode point data arrays when they are first accessed
+
+    Returns
+    -------
+    VTUData|None
+        Decoded arrays, or None if the file cannot be read
+    """
+    if not pathlib.Path(file).is_file(): return None
+    try:
+        f = VTUFile(file)
+        return f.read_lazy() if lazy else f.read()
+    except UnsupportedVTUError:
+        return read_vtk(file)
+
+
+def read_vtk(file:str|pathlib.Path)->VTUData|None:
+    """
+    Read a .vtu file using VTK
+
+    Parameters
+    ----------
+    file : str, pathlib.Path
+        Path to .vtu file
+
+    Returns
+    -------
+    VTUData|None
+        Decoded arrays, or None if VTK cannot read the file
+    """
+    import vtk
+    from vtk.numpy_interface import dataset_adapter as dsa
+    reader = vtk.vtkXMLUnstructuredGridReader()
+    reader.SetFileName(str(file))
+    if not reader.CanReadFile(str(file)): return None
+    reader.Update()
+    output = dsa.WrapDataObject(reader.GetOutput())
+    return VTUData(
+        np.asarray(output.Points),
+        {k: np.asarray(output.PointData[k]) for k in output.PointData.keys()})
+
+
+readers = {
+    'vtk': lambda file, lazy=False: read_vtk(file),
+    'numpy': read_numpy,
+}
+
+def read_vtu(file:str|pathlib.Path, reader:str='vtk', lazy:bool=False)->VTUData|None:
+    """
+    Read a .vtu file with the named reader
+
+    Parameters
+    ----------
+    file : str, pathlib.Path
+        Path to .vtu file
+    reader : str, optional (default 'vtk')
+        'vtk' or 'numpy'
+    lazy : bool, optional (default False)
+        Only decode point data arrays when they are first accessed, if the reader supports it
+
+    Returns
+    -------
+    VTUData|None
+        Decoded arrays, or None if the file cannot be read
+    """
+    if reader not in readers: raise ValueError(f'Unknown reader "{reader}", try one of {list(readers)}')
+    return readers[reader](file, lazy=lazy)
@@ -0,0 +1,41 @@
+import multiprocessing
+import pandas as pd
+import pytest
+
+pytest.importorskip('chaste_simulation_database_connector')
+from cell_movie_maker.csdc.analysis_spool import AnalysisSpool
+
+
+fork = multiprocessing.get_context('fork')
+
+def _append(spool, token, rows):
+    assert spool.append(token, rows) == 0 # Buffered, written when the worker exits
+
+def _rows(spool:AnalysisSpool)->list[dict]:
+    segments = sorted(spool.segments_folder.glob('*.parquet'))
+    return [r for p in segments for r in pd.read_parquet(p).to_dict('records')]
+
+
+def test_segment_written_when_full(tmp_path):
+    spool = AnalysisSpool(tmp_path, segment_rows=2)
+    assert spool.append(0, [dict(iteration=0, timestep=0)]) == 0
+    assert spool.append(0, [dict(iteration=0, timestep=1)]) == 2
+    assert [r['timestep'] for r in _rows(spool)] == [0, 1]
+    assert spool.flush(0) == 0
+
+def test_flush_writes_rows_of_one_ingest(tmp_path):
+    spool = AnalysisSpool(tmp_path, segment_rows=100)
+    spool.append(1, [dict(iteration=1, timestep=0)])
+    spool.append(2, [dict(iteration=2, timestep=0)])
+    assert spool.flush(1) == 1
+    assert [r['iteration'] for r in _rows(spool)] == [1]
+    assert spool.flush(2) == 1
+
+def test_worker_writes_buffered_rows_on_exit(tmp_path):
+    spool = AnalysisSpool(tmp_path, segment_rows=100)
+    workers = [fork.Process(target=_append, args=(spool, 3, [dict(iteration=i, timestep=t) for t in range(3)])) for i in range(2)]
+    for p in workers: p.start()
+    for p in workers: p.join(timeout=60)
+    assert [p.exitcode for p in workers] == [0, 0]
+    assert sorted((r['iteration'], r['timestep']) for r in _rows(spool)) == [(i, t) for i in range(2) for t in range(3)]
+    assert not list(tmp_path.joinpath('tmp').iterdir())
@@ -0,0 +1,54 @@
+import multiprocessing
+import types
+import pytest
+from cell_movie_maker import sharding
+from cell_movie_maker.sharding import Shard
+
+
+fork = multiprocessing.get_context('fork')
+
+def _run(folder, index, log):
+    def render():
+        with open(log, 'a') as f: f.write(f'{index}\n')
+    sharding.run_shard(folder, 'job', Shard(index, 3), render)
+
+
+def test_parse_shard(monkeypatch):
+    assert sharding.parse_shard('2/4') == Shard(2, 4)
+    monkeypatch.setenv('SLURM_ARRAY_TASK_ID', '5')
+    monkeypatch.setenv('SLURM_ARRAY_TASK_MIN', '1')
+    monkeypatch.setenv('SLURM_ARRAY_TASK_COUNT', '8')
+    assert sharding.parse_shard() == Shard(4, 8)
+    with pytest.raises(ValueError): sharding.parse_shard('4/4')
+
+def test_shards_partition_items():
+    costs = [5., 1., 3., 3., 8., 2., 2.]
+    shards = [sharding.select(costs, Shard(i, 3)) for i in range(3)]
+    assert sorted(i for s in shards for i in s) == list(range(len(costs)))
+    assert shards == [sharding.select(costs, Shard(i, 3)) for i in range(3)]
+
+def test_run_shard_marks_complete(tmp_path):
+    calls = []
+    assert sharding.run_shard(tmp_path, 'job', Shard(0, 2), lambda: calls.append(0))
+    assert not sharding.run_shard(tmp_path, 'job', Shard(0, 2), lambda: calls.append(0))
+    assert sharding.run_shard(tmp_path, 'job', Shard(0, 2), lambda: calls.append(0), force=True)
+    assert calls == [0, 0]
+    assert sharding.missing_shards(tmp_path, 'job', 2) == [1]
+
+def test_failed_shard_is_not_marked(tmp_path):
+    def fail(): raise RuntimeError('boom')
+    with pytest.raises(RuntimeError): sharding.run_shard(tmp_path, 'job', Shard(1, 2), fail)
+    assert sharding.missing_shards(tmp_path, 'job', 2) == [0, 1]
+
+def test_merge_waits_for_every_shard(tmp_path):
+    log = tmp_path.joinpath('log')
+    experiment = types.SimpleNamespace(experiment_folder=tmp_path, simulations=[])
+    workers = [fork.Process(target=_run, args=(tmp_path, i, log)) for i in range(2)]
+    for p in workers: p.start()
+    for p in workers: p.join(timeout=60)
+    with pytest.raises(RuntimeError, match=r'\[2\]'): sharding.merge(experiment, 'job', 3)
+    _run(tmp_path, 2, log)
+    sharding.merge(experiment, 'job', 3)
+    assert sorted(log.read_text().split()) == ['0', '1', '2']
+    # Markers of a different shard count are not mistaken for these
+    assert sharding.missing_shards(tmp_path, 'job', 2) == [0, 1]
@@ -0,0 +1,80 @@
+import collections
+import multiprocessing
+import os
+import time
+from cell_movie_maker.task_queue import TaskQueue
+
+
+fork = multiprocessing.get_context('fork')
+
+def _work(folder, log, crash_on):
+    def handler(task):
+        if task['i'] == crash_on: os._exit(1) # Die holding the lease
+        with open(log, 'a') as f: f.write(f"{task['i']}\n")
+    TaskQueue(folder, lease_seconds=1).work(handler, poll=0.1)
+
+def _plan(folder, n, result):
+    def tasks():
+        time.sleep(0.5) # Planning in progress while the other worker starts
+        return (dict(i=i) for i in range(n))
+    planned = TaskQueue(folder).plan_once(tasks, poll=0.1)
+    with open(result, 'a') as f: f.write(f'{planned}\n')
+
+def _state(queue:TaskQueue, state:str)->list[str]:
+    return sorted(f for f in os.listdir(queue.folder.joinpath(state)) if f.endswith('.json'))
+
+
+def test_put_skips_queued_tasks(tmp_path):
+    queue = TaskQueue(tmp_path)
+    assert queue.put([dict(i=i) for i in range(5)]) == 5
+    assert queue.put([dict(i=i) for i in range(7)]) == 2
+    assert queue.counts() == dict(pending=7, leased=0, done=0, failed=0)
+    assert [queue.claim().task['i'] for _ in range(7)] == list(range(7))
+    assert queue.claim() is None
+
+def test_expired_lease_is_requeued(tmp_path):
+    queue = TaskQueue(tmp_path, lease_seconds=0.5)
+    queue.put([dict(i=0)])
+    lease = queue.claim()
+    assert lease.attempt == 0
+    time.sleep(1)
+    other = TaskQueue(tmp_path, lease_seconds=0.5).claim()
+    assert other.task == dict(i=0) and other.attempt == 1
+    assert not lease.renew() and not lease.complete()
+    assert other.complete()
+    assert queue.counts() == dict(pending=0, leased=0, done=1, failed=0)
+
+def test_failed_after_max_attempts(tmp_path):
+    queue = TaskQueue(tmp_path, max_attempts=2)
+    queue.put([dict(i=0)])
+    queue.claim().fail('first')
+    queue.claim().fail('second')
+    assert queue.claim() is None
+    assert queue.counts() == dict(pending=0, leased=0, done=0, failed=1)
+    assert tmp_path.joinpath('failed', _state(queue, 'failed')[0].replace('.json', '.error')).read_text() == 'second'
+
+def test_workers_complete_every_task_once(tmp_path):
+    n = 30
+    queue = TaskQueue(tmp_path.joinpath('queue'), lease_seconds=1)
+    queue.put([dict(i=i) for i in range(n)])
+    queue.folder.joinpath('planned').touch()
+    log = tmp_path.joinpath('log')
+    crashed = fork.Process(target=_work, args=(queue.folder, log, 0))
+    crashed.start()
+    crashed.join(timeout=60)
+    assert crashed.exitcode == 1 and queue.counts()['leased'] == 1
+    workers = [fork.Process(target=_work, args=(queue.folder, log, None)) for _ in range(2)]
+    for p in workers: p.start()
+    for p in workers: p.join(timeout=60)
+    assert [p.exitcode for p in workers] == [0, 0]
+    assert queue.counts() == dict(pending=0, leased=0, done=n, failed=0)
+    runs = collections.Counter(int(line) for line in log.read_text().split())
+    assert sorted(runs) == list(range(n)) and set(runs.values()) == {1}
+
+def test_plan_once_with_concurrent_workers(tmp_path):
+    folder, result = tmp_path.joinpath('queue'), tmp_path.joinpath('result')
+    workers = [fork.Process(target=_plan, args=(folder, 10, result)) for _ in range(2)]
+    for p in workers: p.start()
+    for p in workers: p.join(timeout=60)
+    assert sorted(result.read_text().split()) == ['False', 'True']
+    assert TaskQueue(folder).counts()['pending'] == 10
@@ -0,0 +1,78 @@
+"""
+Check the NumPy .vtu reader against VTK and compare their speed.
+
+Usage: python benchmark-vtu-reader.py <results_from_time_0 folder> [n_files]
+
+Every results_*.vtu and pde_results_*.vtu file (up to n_files of each) is read with both readers and
+the decoded Points and PointData arrays are compared. The first results file is also re-encoded by VTK
+as raw appended, inline binary and ascii, compressed and uncompressed, and checked the same way.
+"""
+import sys
+import subprocess
+import time
+import pathlib
+import tempfile
+import numpy as np
+from cell_movie_maker.vtu_reader import VTUFile, read_vtk
+
+
+def check_parity(file):
+    expected = read_vtk(file)
+    actual = VTUFile(file).read()
+    assert np.array_equal(expected.Points, actual.Points), f'Points differ in {file}'
+    assert list(expected.PointData.keys()) == list(actual.PointData.keys()), f'PointData names differ in {file}'
+    for k in expected.PointData.keys():
+        assert np.array_equal(expected.PointData[k], actual.PointData[k], equal_nan=True), f'{k} differs in {file}'
+
+def reencode(file, folder):
+    import vtk
+    reader = vtk.vtkXMLUnstructuredGridReader()
+    reader.SetFileName(str(file))
+    reader.Update()
+    files = []
+    for mode in ['appended-raw', 'appended-base64', 'binary', 'ascii']:
+        for compress in [False, True]:
+            if mode == 'ascii' and compress: continue
+            writer = vtk.vtkXMLUnstructuredGridWriter()
+            writer.SetInputData(reader.GetOutput())
+            out = pathlib.Path(folder, f'{mode}{"-zlib" if compress else ""}.vtu')
+            writer.SetFileName(str(out))
+            if mode.startswith('appended'):
+                writer.SetDataModeToAppended()
+                if mode == 'appended-raw': writer.EncodeAppendedDataOff()
+            elif mode == 'binary': writer.SetDataModeToBinary()
+            else: writer.SetDataModeToAscii()
+            if compress: writer.SetCompressorTypeToZLib()
+            else: writer.SetCompressorTypeToNone()
+            writer.SetHeaderTypeToUInt64()
+            writer.Write()
+            files.append(out)
+    return files
+
+def benchmark(files, read):
+    t = time.perf_counter()
+    for f in files: read(f)
+    return time.perf_counter() - t
+
+
+if __name__ == '__main__':
+    results_folder = pathlib.Path(sys.argv[1])
+    n_files = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    assert results_folder.is_dir(), f"Folder not found: {results_folder}\n"
+
+    results_files = sorted(results_folder.glob('results_*.vtu'))[:n_files]
+    pde_files = sorted(results_folder.glob('pde_results_*.vtu'))[:n_files]
+
+    for f in results_files + pde_files: check_parity(f)
+    with tempfile.TemporaryDirectory() as folder:
+        for f in reencode(results_files[0], folder): check_parity(f)
+    print(f'Parity OK for {len(results_files)} results files, {len(pde_files)} pde files and re-encoded layouts')
+
+    import_time = subprocess.run([sys.executable, '-c', 'import time; t = time.perf_counter(); import vtk; print(time.perf_counter()-t)'],
+                                 capture_output=True, text=True).stdout.strip()
+    print(f'import vtk: {float(import_time):.3f}s')
+    for name, files in [('results', results_files), ('pde_results', pde_files)]:
+        if len(files) == 0: continue
+        t_vtk = benchmark(files, read_vtk)
+        t_numpy = benchmark(files, lambda f: VTUFile(f).read())
+        print(f'{name}: vtk {1000*t_vtk/len(files):.2f}ms/file, numpy {1000*t_numpy/len(files):.2f}ms/file ({t_vtk/t_numpy:.1f}x)')